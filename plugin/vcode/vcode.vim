@@ -6,12 +6,15 @@ if p:
 	import sys
 	sys.path.append(p)
 	import vcode.util
+	import vcode.vimbridge
 	import vcode.project
 else:
 	raise EnvironmentError("Could not find plugin/vimcode on runtime path.")
 
 
 #vCodeProj = vcode.project.Project("/Users/espeak/code/vcode/testproject/testproject.vcode")
+#vCodeProj = vcode.project.Workspace(["/Users/espeak/code/a/a.vcode",
+#		"/Users/espeak/code/b/b.vcode"])
 #vcode.util.colorDiffCommand(["git", "diff"])
 
 
@@ -20,11 +23,47 @@ EOF
 
 
 
+function VCodeFindBuffer(name)
+	" Find a window showing the buffer a:name, in the current tab page if
+	" there is one. Returns [tab, window, current tab, current window], or []
+	" if the buffer is not shown. Used by vcode.vimbridge.
+	let nr = bufnr('^' . a:name . '$')
+	if nr < 0
+		return []
+	endif
+	let tabs = [tabpagenr()] + range(1, tabpagenr('$'))
+	for tab in tabs
+		let win = index(tabpagebuflist(tab), nr)
+		if win >= 0
+			return [tab, win + 1, tabpagenr(), winnr()]
+		endif
+	endfor
+	return []
+endfunction
+
+function VCodeGoToBuffer(name, allTabs)
+	" Move to a window showing the buffer a:name, in the current tab page if
+	" there is one, otherwise in any tab page if a:allTabs. Returns [tab,
+	" window] before the move followed by [tab, window] after it, or [] if the
+	" buffer is not shown. Used by vcode.vimbridge.
+	let found = VCodeFindBuffer(a:name)
+	if empty(found) || (!a:allTabs && found[0] != found[2])
+		return []
+	endif
+	if found[0] != found[2]
+		exe "tabnext " . found[0]
+	endif
+	if found[1] != winnr()
+		exe found[1] . "wincmd w"
+	endif
+	return [found[2], found[3], found[0], found[1]]
+endfunction
+
+
 function VCodeReccomendedKeymaps()
-	au BufNewFile,BufRead *.h map <buffer> <C-M-Up> :python vcode.util.cppAltHeaderFile()<CR>
-	au BufNewFile,BufRead *.c map <buffer> <C-M-Up> :python vcode.util.cppAltHeaderFile()<CR>
-	au BufNewFile,BufRead *.cpp map <buffer> <C-M-Up> :python vcode.util.cppAltHeaderFile()<CR>
-	au BufNewFile,BufRead *.hpp map <buffer> <C-M-Up> :python vcode.util.cppAltHeaderFile()<CR>
+	" Switch between source and header, and between class and test.
+	nnoremap <C-M-Up> :python vCodeProj.openAlternate("header")<CR>
+	nnoremap <C-M-Down> :python vCodeProj.openAlternate("test")<CR>
 
 	nnoremap <S-C-t> :python vCodeProj.ui.view.open()<CR>
 endfunction
@@ -36,15 +75,51 @@ function VCodeExtraKeymaps()
 endfunction
 
 
+function VCodePollChanges(...)
+	python vcode.util.pollDiffs()
+	if exists("vCodeProj")
+		python vCodeProj.pollChanges()
+	endif
+endfunction
+
+function VCodePollDiffs(timer)
+	python vcode.util.pollDiffs()
+endfunction
+
+function VCodeWatchFiles()
+	" Apply changes to the files in the project while vim is idle.
+	if has("timers")
+		call timer_start(500, "VCodePollChanges", {"repeat": -1})
+	else
+		au CursorHold,CursorHoldI,FocusGained * call VCodePollChanges()
+	endif
+	au BufWritePost * if exists("vCodeProj") | python vCodeProj.fileSaved() | endif
+endfunction
+
+
+function VCodeSearch(query, regex)
+	" Search the content of the files in the project.
+	python vCodeProj.search(vim.eval("a:query"), int(vim.eval("a:regex")))
+endfunction
+
+
+function VCodeGrep(query, regex)
+	" Search the content of the files in the project without an index.
+	" Results are added while vim is idle, see VCodeWatchFiles.
+	python vCodeProj.grep(vim.eval("a:query"), int(vim.eval("a:regex")))
+endfunction
+
+
 function VCodeReccomendedSettings()
 	" Hide buffer instead of deleting it when the buffer closes.
 	" This makes buffers retain undo-history. Especially important
-	" if you use altHeaderFile.
+	" if you use openAlternate.
 	set hidden
 endfunction
 
 "call VCodeReccomendedSettings()
 "call VCodeReccomendedKeymaps()
+"call VCodeWatchFiles()
 call VCodeExtraKeymaps()
 
 
@@ -54,3 +129,30 @@ call VCodeExtraKeymaps()
 "endfunction
 "command -complete=customlist,s:AutoCompleteApplyFilter -nargs=1 VCodeApplyFilter :py vCodeProj.browser.applyFilter("<args>")
 "command VCodeClearFilter :py vCodeProj.browser.clearFilter()
+"
+"function s:AutoCompleteShowView(ArgLead,L,P)
+"	py vCodeProj.autoCompleteViews()
+"	return result
+"endfunction
+"command -complete=customlist,s:AutoCompleteShowView -nargs=1 VCodeShowView :py vCodeProj.showView("<args>")
+"command VCodeShowProject :py vCodeProj.showView()
+"
+"function s:AutoCompleteJumpToFile(ArgLead,L,P)
+"	py vCodeProj.browser.autoCompleteFiles()
+"	return result
+"endfunction
+"command -complete=customlist,s:AutoCompleteJumpToFile -nargs=1 VCodeJumpToFile :py vCodeProj.browser.jumpToFile("<args>")
+"command VCodeRevealFile :py vCodeProj.revealCurrentFile()
+"command -nargs=1 VCodeSearch call VCodeSearch(<q-args>, 0)
+"command -nargs=1 VCodeSearchRegex call VCodeSearch(<q-args>, 1)
+"command VCodeUpdateIndexes :py vCodeProj.updateIndexes()
+"command -nargs=1 VCodeGrep call VCodeGrep(<q-args>, 0)
+"command -nargs=1 VCodeGrepRegex call VCodeGrep(<q-args>, 1)
+"command VCodeCancelGrep :py vCodeProj.cancelGrep()
+"
+"function s:AutoCompleteSymbols(ArgLead,L,P)
+"	py vCodeProj.autoCompleteSymbols()
+"	return result
+"endfunction
+"command -complete=customlist,s:AutoCompleteSymbols -nargs=1 VCodeJumpToSymbol :py vCodeProj.jumpToSymbol("<args>")
+"command VCodeCancelDiff :py vcode.util.cancelDiff()
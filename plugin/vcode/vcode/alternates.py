@@ -0,0 +1,240 @@
+"""
+Alternate files, like the header of a C++ source file, or the test of a class.
+
+An L{AlternateFiles} map is built from the files in a
+L{file_memorymodel.FileIndex} once, and is kept up to date as the index is
+patched. Finding the alternates of a file is a dict lookup, and does not touch
+the filesystem.
+
+Files are paired by rules. Each rule gives every file it applies to a key and
+a side (0 or 1), and the alternates of a file are the files with the same key
+on the other side:
+
+	- L{ExtensionRule} pairs files with the same name but paired extensions,
+	  like .h and .cpp, anywhere in the project. Headers kept in an include/
+	  tree are found as well as headers next to the source. Alternates in the
+	  nearest directory come first.
+	- L{DirRule} pairs files at the same place below two directories, like
+	  src/main and src/test. The file names may differ by a test prefix or
+	  suffix, so src/main/java/Hello.java is paired with
+	  src/test/java/TestHello.java.
+
+Paths are matched relative to the project root, with / as separator, and
+names are compared ignoring case.
+"""
+from os import sep
+from os.path import splitext
+
+from file_memorymodel import File
+
+
+class ExtensionRule(object):
+	""" Pairs files with the same name, and extensions in *left* and
+	*right*. """
+	def __init__(self, name, left, right):
+		self.name = name
+		self._sides = {}
+		for ext in left:
+			self._sides[ext.lower()] = 0
+		for ext in right:
+			self._sides[ext.lower()] = 1
+
+	def key(self, relPath):
+		""" Get the key and side of *relPath*.
+		@return: (key, side), or None if the rule does not apply. """
+		root, ext = splitext(relPath.rsplit("/", 1)[-1])
+		side = self._sides.get(ext.lower())
+		if side is None:
+			return None
+		return root.lower(), side
+
+
+class DirRule(object):
+	""" Pairs files below the directory *left* with files at the same place
+	below the directory *right*. The directories may be anywhere in the path,
+	like src/main in modules/a/src/main. """
+	def __init__(self, name, left, right, prefixes=("test_", "test"),
+			suffixes=("_test", "test", "tests")):
+		"""
+		@param prefixes: Prefixes of the names of files below *right*, which
+			are removed before they are compared. Compared ignoring case.
+		@param suffixes: Like *prefixes*, but at the end of the name, before
+			the extension.
+		"""
+		self.name = name
+		self._dirs = ("/" + left.strip("/") + "/", "/" + right.strip("/") + "/")
+		self._prefixes = [p.lower() for p in prefixes]
+		self._suffixes = [s.lower() for s in suffixes]
+
+	def _stripAffixes(self, name):
+		for prefix in self._prefixes:
+			if name.startswith(prefix) and len(name) > len(prefix):
+				return name[len(prefix):]
+		for suffix in self._suffixes:
+			if name.endswith(suffix) and len(name) > len(suffix):
+				return name[:-len(suffix)]
+		return name
+
+	def key(self, relPath):
+		""" Get the key and side of *relPath*.
+		@return: (key, side), or None if the rule does not apply. """
+		path = "/" + relPath.lower()
+		for side, d in enumerate(self._dirs):
+			pos = path.find(d)
+			if pos >= 0:
+				break
+		else:
+			return None
+		rest = path[pos+len(d):]
+		if "/" in rest:
+			dirPart, name = rest.rsplit("/", 1)
+		else:
+			dirPart, name = "", rest
+		name, ext = splitext(name)
+		if side == 1:
+			name = self._stripAffixes(name)
+		return (path[:pos], dirPart, name, ext), side
+
+
+DEFAULT_RULES = [
+	ExtensionRule("header", (".h", ".hh", ".hpp", ".hxx"),
+			(".c", ".cc", ".cpp", ".cxx")),
+	DirRule("test", "src/main", "src/test"),
+]
+
+
+def _commonDirLength(a, b):
+	""" The number of leading directories shared by the paths *a* and *b*. """
+	count = 0
+	for x, y in zip(a.split("/")[:-1], b.split("/")[:-1]):
+		if x != y:
+			break
+		count += 1
+	return count
+
+
+class AlternateFiles(object):
+	""" Map from each file to its alternates. See the module docs. """
+	def __init__(self, fileindex, rules=None):
+		"""
+		@param rules: L{ExtensionRule}s and L{DirRule}s. Defaults to
+			L{DEFAULT_RULES}.
+		"""
+		self._rules = rules or DEFAULT_RULES
+		# For each rule, [files on side 0, files on side 1] by key.
+		self._maps = dict([(rule.name, {}) for rule in self._rules])
+		self._add([item for item in fileindex if isinstance(item, File)])
+		fileindex.addListener(self._onIndexPatched)
+
+	def _relPath(self, item):
+		return item.relPath.replace(sep, "/")
+
+	def _add(self, files):
+		for rule in self._rules:
+			m = self._maps[rule.name]
+			for f in files:
+				found = rule.key(self._relPath(f))
+				if found:
+					key, side = found
+					m.setdefault(key, ([], []))[side].append(f)
+
+	def _remove(self, files):
+		for rule in self._rules:
+			m = self._maps[rule.name]
+			for f in files:
+				found = rule.key(self._relPath(f))
+				if found:
+					key, side = found
+					sides = m.get(key)
+					if sides and f in sides[side]:
+						sides[side].remove(f)
+						if not sides[0] and not sides[1]:
+							del m[key]
+
+	def _onIndexPatched(self, group, removed, added):
+		self._remove([i for i in removed if isinstance(i, File)])
+		self._add([i for i in added if isinstance(i, File)])
+
+	def getRuleNames(self):
+		return [rule.name for rule in self._rules]
+
+	def find(self, relPath, ruleName=None):
+		""" Get the alternates of the file *relPath*.
+		@param ruleName: Only use the rule with this name. By default, every
+			rule is used, in order.
+		@return: A list of L{file_memorymodel.File}s, with the files in the
+			nearest directories first for each rule. Each file is only
+			included once.
+		"""
+		relPath = relPath.replace(sep, "/")
+		found = []
+		for rule in self._rules:
+			if ruleName is not None and rule.name != ruleName:
+				continue
+			key = rule.key(relPath)
+			if key is None:
+				continue
+			key, side = key
+			sides = self._maps[rule.name].get(key)
+			if not sides:
+				continue
+			files = [f for f in sides[1 - side] if not f in found]
+			files.sort(key=lambda f: -_commonDirLength(relPath,
+					self._relPath(f)))
+			found.extend(files)
+		return found
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from os.path import join
+	from file_memorymodel import Group, FileIndex
+
+	def makeFile(relPath):
+		return File(relPath.rsplit("/", 1)[-1], relPath.replace("/", sep),
+				join("/root", relPath), 1)
+
+	class TestAlternateFiles(unittest.TestCase):
+		def setUp(self):
+			self.root = Group("root", 0, *[makeFile(p) for p in (
+				"src/main/cpp/hello.cpp", "src/main/cpp/hello.h",
+				"src/test/cpp/testHello.cpp",
+				"src/main/java/Hello.java", "src/test/java/TestHello.java",
+				"src/main/python/hello.py", "src/test/python/test_hello.py",
+				"lib/util.cpp", "include/util.h", "other/include/util.h",
+				"README")])
+			self.index = FileIndex(self.root)
+			self.alt = AlternateFiles(self.index)
+
+		def _find(self, relPath, ruleName=None):
+			return [f.relPath.replace(sep, "/")
+					for f in self.alt.find(relPath, ruleName)]
+
+		def testHeader(self):
+			self.assertEquals(self._find("src/main/cpp/hello.cpp", "header"),
+					["src/main/cpp/hello.h"])
+			self.assertEquals(self._find("src/main/cpp/hello.h"),
+					["src/main/cpp/hello.cpp"])
+			self.assertEquals(self._find("lib/util.cpp"),
+					["include/util.h", "other/include/util.h"])
+			self.assertEquals(self._find("other/include/util.h"),
+					["lib/util.cpp"])
+
+		def testTest(self):
+			self.assertEquals(self._find("src/main/java/Hello.java", "test"),
+					["src/test/java/TestHello.java"])
+			self.assertEquals(self._find("src/test/python/test_hello.py"),
+					["src/main/python/hello.py"])
+			self.assertEquals(self._find("src/test/cpp/testHello.cpp", "test"),
+					["src/main/cpp/hello.cpp"])
+			self.assertEquals(self._find("README"), [])
+
+		def testPatch(self):
+			self.root.remove(self.root.getByTitle("hello.h"))
+			self.root.add(makeFile("include/hello.hpp"))
+			self.index.patch(self.root)
+			self.assertEquals(self._find("src/main/cpp/hello.cpp", "header"),
+					["include/hello.hpp"])
+
+	unittest.main()
@@ -0,0 +1,262 @@
+"""
+Benchmarks of parsing a project and showing it in the browser.
+
+Generates a synthetic project tree, with a .vcode directory holding matching
+*.files.xml and *.filters.xml configs, and times the steps of opening it:
+
+	- parsing the configs with L{settings_parser.SettingsParser}, with and
+	  without the snapshot, and lazily,
+	- building the L{file_memorymodel.FileIndex},
+	- L{project.ProjectBrowser._generateDisplay} and
+	  L{project.ProjectBrowser._toList} with every group open,
+	- applying a filter in the browser,
+	- opening the browser in a new tab, counting the calls into vim,
+
+and estimates the memory used by each item of the tree. The fake vim module
+of L{fakevim} is installed when not running inside vim, so the benchmarks
+run headless.
+
+Run from the command line; the results are written as JSON, so they can be
+compared between versions:
+
+	python benchmark.py --width 10 --depth 3 --files 50 --output results.json
+
+Each timing is the best of --repeat runs, in seconds.
+"""
+import sys
+import gc
+import platform
+from os import makedirs, walk, utime
+from os.path import join, dirname, abspath
+from time import time
+from shutil import rmtree
+from tempfile import mkdtemp
+from subprocess import Popen, PIPE
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+
+PROJECT_NAME = "bench"
+
+# Directories and files in each directory of an exclude-heavy tree, which
+# are excluded by the generated config.
+EXCLUDED_DIRS = ("build", "bin")
+EXCLUDED_FILES_PER_DIR = 5
+
+# The <exclude> of each group. An <exclude> applies to the <dir>-tags of its
+# group, so there is one in every group.
+EXCLUDE = "<exclude><shellpatterns>*/build */bin *.o</shellpatterns></exclude>"
+
+# The rules of the "sources" filter of the generated config.
+SOURCE_FILTER = ("+*.c", "+*.h")
+
+
+def generateTree(rootDir, width, depth, files, excludeHeavy=True):
+	""" Create a synthetic project in *rootDir*: *width* directories in each
+	directory, *depth* levels deep, with *files* source files in each, and a
+	.vcode directory with a config adding every top-level directory as a
+	group.
+
+	@param excludeHeavy: Add build/ and bin/ directories full of object
+		files to every directory, which the config excludes.
+	@return: dict with the number of directories and files created, and of
+		them, the number excluded by the config.
+	"""
+	counts = dict(dirs=0, files=0, excludedDirs=0, excludedFiles=0)
+	def fill(path, level):
+		for i in xrange(files):
+			ext = (".c", ".h", ".py")[i % 3]
+			open(join(path, "file%d%s" % (i, ext)), "w").close()
+		counts["files"] += files
+		if excludeHeavy:
+			for name in EXCLUDED_DIRS:
+				d = join(path, name)
+				makedirs(d)
+				for i in xrange(EXCLUDED_FILES_PER_DIR):
+					open(join(d, "obj%d.o" % i), "w").close()
+				counts["dirs"] += 1
+				counts["files"] += EXCLUDED_FILES_PER_DIR
+				counts["excludedDirs"] += 1
+				counts["excludedFiles"] += EXCLUDED_FILES_PER_DIR
+		if level < depth:
+			for i in xrange(width):
+				d = join(path, "dir%d" % i)
+				makedirs(d)
+				counts["dirs"] += 1
+				fill(d, level + 1)
+
+	groups = []
+	for i in xrange(width):
+		makedirs(join(rootDir, "top%d" % i))
+		counts["dirs"] += 1
+		fill(join(rootDir, "top%d" % i), 1)
+		groups.append('\t<group title="top%d">%s<dir path="top%d"/></group>'
+				% (i, EXCLUDE, i))
+	projectDir = join(rootDir, PROJECT_NAME + ".vcode")
+	makedirs(projectDir)
+	open(join(projectDir, "project.files.xml"), "w").write("\n".join(
+			["<files>"] + groups + ["</files>\n"]))
+	open(join(projectDir, "project.filters.xml"), "w").write(
+			'<filters><filter name="sources">%s</filter></filters>\n'
+			% " ".join(SOURCE_FILTER))
+	# The listings of recently modified directories are not trusted by the
+	# snapshot, see scanner.ListingCache.
+	old = time() - 60
+	for path, dirs, names in walk(rootDir):
+		utime(path, (old, old))
+	return counts
+
+
+def best(func, repeat):
+	""" Run *func* *repeat* times.
+	@return: (the shortest time in seconds, the result of the last run) """
+	times = []
+	result = None
+	for i in xrange(repeat):
+		gc.collect()
+		start = time()
+		result = func()
+		times.append(time() - start)
+	return min(times), result
+
+
+def itemSize(item):
+	""" Estimate the bytes used by a tree item, with its attribute, meta and
+	extraInfo dicts and child containers. Strings shared between items, like
+	interned titles, are counted for every item. """
+	size = sys.getsizeof(item) + sys.getsizeof(item.__dict__)
+	for value in item.__dict__.itervalues():
+		if isinstance(value, (basestring, dict, list)):
+			size += sys.getsizeof(value)
+	return size
+
+
+def runBenchmarks(rootDir, repeat=3, counts=None):
+	""" Time parsing and browsing the project generated in *rootDir*.
+	@param counts: The counts returned by L{generateTree}. The parsed tree
+		must have one group for each directory and one item for each file
+		that is not excluded, and a root group.
+	@return: dict with the timings, and the memory estimates.
+	@raise AssertionError: If the parsed tree does not match *counts*. """
+	if not "vim" in sys.modules:
+		import fakevim
+		fakevim.install()
+	import vim
+	from settings_parser import SettingsParser
+	from file_memorymodel import FileIndex, File, Group
+	from project import ProjectBrowser
+	from filter import Filter
+
+	projectDir = join(rootDir, PROJECT_NAME + ".vcode")
+	timings = {}
+	def parse(**kw):
+		return SettingsParser(projectDir, PROJECT_NAME, rootDir, **kw)
+
+	timings["parse"], settings = best(lambda: parse(useSnapshot=False), repeat)
+	timings["parseLazy"] = best(lambda: parse(useSnapshot=False, lazy=True),
+			repeat)[0]
+	parse() # Write the snapshot.
+	timings["parseSnapshot"] = best(parse, repeat)[0]
+
+	root = settings.files
+	timings["fileIndex"], index = best(lambda: FileIndex(root), repeat)
+	if counts is not None:
+		expected = 1 + counts["dirs"] - counts["excludedDirs"] \
+				+ counts["files"] - counts["excludedFiles"]
+		if len(list(index)) != expected:
+			raise AssertionError("Parsed %d items, expected %d."
+					% (len(list(index)), expected))
+	browser = ProjectBrowser(index, rootDir)
+	browser._setOpenGroup(root, open=True, recursive=True)
+	timings["generateDisplay"] = best(browser._generateDisplay, repeat)[0]
+	for item in root.iterRecursive():
+		item.getMeta(ProjectBrowser).pop("line", None)
+	timings["toList"] = best(browser._toList, 1)[0]
+	timings["toListCached"] = best(browser._toList, repeat)[0]
+
+	for name, f in settings.filters.iteritems():
+		browser.addFilter(name, f)
+	def applyFilter():
+		# A new filter, so nothing is cached.
+		browser.addFilter("sources", Filter(SOURCE_FILTER))
+		browser.applyFilter("sources")
+	timings["applyFilter"] = best(applyFilter, repeat)[0]
+	browser.clearFilter()
+	timings["applyFilterCached"] = best(
+			lambda: browser.applyFilter("sources"), repeat)[0]
+
+	# Calls into vim are only counted by the fake.
+	vimCalls = {}
+	calls = getattr(vim, "calls", None)
+	timings["openBrowser"] = best(browser._createBuffer, 1)[0]
+	if calls is not None:
+		vimCalls["openBrowser"] = vim.calls - calls
+
+	items = list(index)
+	files = [i for i in items if isinstance(i, File)]
+	groups = [i for i in items if isinstance(i, Group)]
+	memory = dict(
+		items = len(items),
+		bytesPerFile = sum(map(itemSize, files)) / max(len(files), 1),
+		bytesPerGroup = sum(map(itemSize, groups)) / max(len(groups), 1))
+	return dict(timings=timings, memory=memory, vimCalls=vimCalls)
+
+
+def revision():
+	""" Get the git revision of vcode, or None if not in a git checkout. """
+	try:
+		p = Popen(["git", "rev-parse", "HEAD"], cwd=dirname(abspath(__file__)),
+				stdout=PIPE, stderr=PIPE)
+	except OSError:
+		return None
+	out = p.communicate()[0].strip()
+	return p.returncode == 0 and out or None
+
+
+
+if __name__ == "__main__":
+	from optparse import OptionParser
+
+	parser = OptionParser(usage="%prog [options]")
+	parser.add_option("--width", type="int", default=4,
+			help="Directories in each directory. [default: %default]")
+	parser.add_option("--depth", type="int", default=3,
+			help="Levels of directories. [default: %default]")
+	parser.add_option("--files", type="int", default=10,
+			help="Files in each directory. [default: %default]")
+	parser.add_option("--no-excludes", dest="excludeHeavy",
+			action="store_false", default=True,
+			help="Do not add excluded build/ and bin/ directories.")
+	parser.add_option("--repeat", type="int", default=3,
+			help="Runs of each benchmark. [default: %default]")
+	parser.add_option("--output", help="Write the results to this file "
+			"instead of stdout.")
+	parser.add_option("--keep", action="store_true", default=False,
+			help="Keep the generated tree, and print where it is.")
+	options, args = parser.parse_args()
+
+	rootDir = mkdtemp(prefix="vcode-bench-")
+	try:
+		counts = generateTree(rootDir, options.width, options.depth,
+				options.files, options.excludeHeavy)
+		results = runBenchmarks(rootDir, options.repeat, counts)
+	finally:
+		if options.keep:
+			sys.stderr.write("Generated tree kept in %s\n" % rootDir)
+		else:
+			rmtree(rootDir)
+	results.update(
+		revision = revision(),
+		python = platform.python_version(),
+		platform = platform.platform(),
+		tree = dict(counts, width=options.width, depth=options.depth,
+				filesPerDir=options.files, excludeHeavy=options.excludeHeavy),
+		repeat = options.repeat)
+	out = json.dumps(results, indent=2, sort_keys=True)
+	if options.output:
+		open(options.output, "w").write(out + "\n")
+	else:
+		print out
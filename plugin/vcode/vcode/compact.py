@@ -0,0 +1,460 @@
+"""
+Compact storage for large file trees.
+
+A L{CompactTree} stores a Group/File tree in parallel arrays instead of one
+object per item. Each item is a number, and the tree holds, for each item,
+the number of its parent, its depth, the id of its title in a table of
+interned strings, and flags telling if it is a group and if it is a lazy group
+that has been loaded. The children of each group are kept in an array.
+
+Files store the ids of the directory and filename of their path, in the same
+string table, and the paths are joined when asked for. Metadata, extraInfo,
+loaders and onLoad functions are kept in dicts holding only the items which
+have them. Reading the metadata or extraInfo of an item without any gives an
+empty L{_SparseDict}, which is only stored in the tree when written to, so
+walking the tree to render or decorate it does not fill these dicts.
+
+The existing API is provided by proxy objects (L{CompactFile},
+L{CompactGroup} and L{CompactLazyGroup}), which are subclasses of File, Group
+and LazyGroup holding the tree and the item number. Proxies are created when
+an item is first used. There is at most one proxy for each item, so proxies
+can be compared by identity and used as dict keys like the items of a normal
+tree.
+
+Items added to a compact group are copied into the tree, so use the
+group returned by L{Group.getByTitle} or L{Group.iterChildren} afterwards,
+not the added item. Removed items are unlinked from their parent, but their
+storage is not reused.
+"""
+from array import array
+from os.path import join, dirname, basename
+
+from file_memorymodel import File, Group, LazyGroup
+
+
+GROUP = 1
+LAZY = 2
+LOADED = 4
+
+
+class CompactTree(object):
+	def __init__(self, rootDir):
+		"""
+		@param rootDir: Root directory of the project. The absolute path of
+			files is created by joining it with the relative path.
+		"""
+		self.rootDir = rootDir
+		self.root = None
+		self._parent = array("i")
+		self._depth = array("H")
+		self._name = array("i")
+		self._dir = array("i")
+		self._base = array("i")
+		self._flags = array("B")
+		self._strings = []
+		self._stringIds = {}
+		self._proxies = []
+		# Children of each group, and the title ids of the children.
+		self._children = {}
+		self._childNames = {}
+		# Sparse state, keyed on item number.
+		self._meta = {}
+		self._extraInfo = {}
+		self._absPaths = {}
+		self._loaders = {}
+		self._onLoad = {}
+
+	def __len__(self):
+		""" The number of items stored, including removed items. """
+		return len(self._flags)
+
+	def intern(self, s):
+		""" Get the id of *s* in the string table. """
+		i = self._stringIds.get(s)
+		if i is None:
+			i = self._stringIds[s] = len(self._strings)
+			self._strings.append(s)
+		return i
+
+	def setRoot(self, item):
+		""" Copy the tree below *item* into this tree, and make it the root.
+		@return: The proxy of the root. """
+		self.root = self.copy(item, -1)
+		return self.root
+
+	def copy(self, item, parent):
+		""" Copy *item*, and the items below it, into the tree as the last
+		child of the item numbered *parent* (-1 for no parent).
+		@return: The proxy of the copy.
+		"""
+		i = len(self._flags)
+		name = self.intern(item.title)
+		self._parent.append(parent)
+		self._depth.append(item.depth)
+		self._name.append(name)
+		self._proxies.append(None)
+		if parent >= 0:
+			self._children[parent].append(i)
+			self._childNames[parent].append(name)
+		if item.meta:
+			self._meta[i] = item.meta
+		if item.extraInfo:
+			self._extraInfo[i] = item.extraInfo
+
+		if not isinstance(item, Group):
+			relPath = item.relPath
+			self._dir.append(self.intern(dirname(relPath)))
+			self._base.append(self.intern(basename(relPath)))
+			self._flags.append(0)
+			if item.absPath != join(self.rootDir, relPath):
+				self._absPaths[i] = item.absPath
+			return self.item(i)
+
+		flags = GROUP
+		children = item.childLst
+		if isinstance(item, LazyGroup):
+			flags |= LAZY
+			if item.loaded:
+				flags |= LOADED
+			else:
+				self._loaders[i] = item._loader
+				children = []
+			if item.onLoad:
+				self._onLoad[i] = list(item.onLoad)
+		self._dir.append(-1)
+		self._base.append(-1)
+		self._flags.append(flags)
+		self._children[i] = array("i")
+		self._childNames[i] = array("i")
+		for child in children:
+			self.copy(child, i)
+		return self.item(i)
+
+	def item(self, i):
+		""" Get the proxy of the item numbered *i*. """
+		proxy = self._proxies[i]
+		if proxy is None:
+			flags = self._flags[i]
+			if flags & LAZY:
+				proxy = CompactLazyGroup(self, i)
+			elif flags & GROUP:
+				proxy = CompactGroup(self, i)
+			else:
+				proxy = CompactFile(self, i)
+			self._proxies[i] = proxy
+		return proxy
+
+
+class _SparseDict(dict):
+	""" An empty dict standing in for a dict of a L{CompactTree} which does
+	not exist yet. The first write stores it in the tree, by calling
+	attach(self), which returns the dict to write to. That is this dict,
+	unless another one was stored for the same item in the meantime. """
+	__slots__ = ("_attach",)
+
+	def __init__(self, attach):
+		dict.__init__(self)
+		self._attach = attach
+
+	def _write(self, method, *args):
+		target = self._attach(self)
+		result = getattr(dict, method)(target, *args)
+		if target is not self:
+			dict.clear(self)
+			dict.update(self, target)
+		return result
+
+	def __setitem__(self, key, value):
+		self._write("__setitem__", key, value)
+
+	def __delitem__(self, key):
+		self._write("__delitem__", key)
+
+	def setdefault(self, key, default=None):
+		return self._write("setdefault", key, default)
+
+	def update(self, *args, **kw):
+		target = self._attach(self)
+		dict.update(target, *args, **kw)
+		if target is not self:
+			dict.update(self, target)
+
+	def pop(self, *args):
+		return self._write("pop", *args)
+
+	def popitem(self):
+		return self._write("popitem")
+
+	def clear(self):
+		self._write("clear")
+
+
+class _CompactItem(object):
+	""" Implements L{file_memorymodel.FileTreeItem} on top of a
+	L{CompactTree}. """
+	def __init__(self, tree, i):
+		self._tree = tree
+		self._i = i
+
+	@property
+	def title(self):
+		return self._tree._strings[self._tree._name[self._i]]
+
+	@property
+	def depth(self):
+		return self._tree._depth[self._i]
+
+	@property
+	def parent(self):
+		p = self._tree._parent[self._i]
+		if p < 0:
+			return None
+		return self._tree.item(p)
+
+	@property
+	def meta(self):
+		meta = self._tree._meta.get(self._i)
+		if meta is None:
+			meta = _SparseDict(
+					lambda d: self._tree._meta.setdefault(self._i, d))
+		return meta
+
+	@property
+	def extraInfo(self):
+		extraInfo = self._tree._extraInfo.get(self._i)
+		if extraInfo is None:
+			extraInfo = _SparseDict(
+					lambda d: self._tree._extraInfo.setdefault(self._i, d))
+		return extraInfo
+
+	def getMeta(self, cls):
+		""" Like L{file_memorymodel.FileTreeItem.getMeta}, without storing
+		anything until the entry is written to. """
+		name = cls.__name__
+		meta = self._tree._meta.get(self._i)
+		if meta is not None and name in meta:
+			return meta[name]
+		return _SparseDict(lambda d: self._tree._meta.setdefault(self._i,
+				{}).setdefault(name, d))
+
+
+class CompactFile(_CompactItem, File):
+
+	@property
+	def relPath(self):
+		tree = self._tree
+		return join(tree._strings[tree._dir[self._i]],
+				tree._strings[tree._base[self._i]])
+
+	@property
+	def absPath(self):
+		absPath = self._tree._absPaths.get(self._i)
+		if absPath is None:
+			absPath = join(self._tree.rootDir, self.relPath)
+		return absPath
+
+
+class _CompactGroupMixin(_CompactItem):
+	""" Implements L{file_memorymodel.Group} on top of a L{CompactTree}. """
+
+	@property
+	def childLst(self):
+		return [self._tree.item(c) for c in self._tree._children[self._i]]
+
+	@property
+	def childDct(self):
+		return dict([(c.title, c) for c in self.childLst])
+
+	def getByIndex(self, index):
+		return self._tree.item(self._tree._children[self._i][index])
+
+	def getByTitle(self, title):
+		""" Get the last added child titled *title*, like L{Group.getByTitle}.
+		@raise KeyError: If there is no such child. """
+		tree = self._tree
+		name = tree._stringIds.get(title)
+		names = tree._childNames[self._i]
+		count = name is not None and names.count(name) or 0
+		if not count:
+			raise KeyError(title)
+		if count == 1:
+			pos = names.index(name)
+		else:
+			pos = len(names) - 1
+			while names[pos] != name:
+				pos -= 1
+		return tree.item(tree._children[self._i][pos])
+
+	def add(self, item):
+		if isinstance(item, Group) and item.isEmpty():
+			return
+		tree = self._tree
+		if isinstance(item, _CompactItem) and item._tree is tree:
+			tree._parent[item._i] = self._i
+			tree._children[self._i].append(item._i)
+			tree._childNames[self._i].append(tree._name[item._i])
+		else:
+			tree.copy(item, self._i)
+
+	def remove(self, item):
+		tree = self._tree
+		children = tree._children[self._i]
+		pos = children.index(item._i)
+		del children[pos]
+		del tree._childNames[self._i][pos]
+		tree._parent[item._i] = -1
+
+	def iterChildren(self):
+		tree = self._tree
+		for c in tree._children[self._i][:]:
+			yield tree.item(c)
+
+	def iterRecursive(self, load=False):
+		tree = self._tree
+		stack = [self._i]
+		while stack:
+			i = stack.pop()
+			flags = tree._flags[i]
+			if load and flags & LAZY and not flags & LOADED:
+				tree.item(i).load()
+				flags = tree._flags[i]
+			yield tree.item(i)
+			if flags & GROUP and (not flags & LAZY or flags & LOADED):
+				children = tree._children[i][:]
+				children.reverse()
+				stack.extend(children)
+
+	def isEmpty(self):
+		return len(self._tree._children[self._i]) == 0
+
+
+class CompactGroup(_CompactGroupMixin, Group):
+	pass
+
+
+class CompactLazyGroup(_CompactGroupMixin, LazyGroup):
+
+	@property
+	def loaded(self):
+		return bool(self._tree._flags[self._i] & LOADED)
+
+	@property
+	def onLoad(self):
+		return self._tree._onLoad.setdefault(self._i, [])
+
+	def load(self):
+		if self.loaded:
+			return
+		tree = self._tree
+		tree._flags[self._i] |= LOADED
+		loader = tree._loaders.pop(self._i)
+		loader(self)
+		for f in tree._onLoad.pop(self._i, []):
+			f(self)
+
+	def getByIndex(self, index):
+		self.load()
+		return _CompactGroupMixin.getByIndex(self, index)
+
+	def getByTitle(self, title):
+		self.load()
+		return _CompactGroupMixin.getByTitle(self, title)
+
+	def iterChildren(self):
+		self.load()
+		return _CompactGroupMixin.iterChildren(self)
+
+	def isEmpty(self):
+		return self.loaded and _CompactGroupMixin.isEmpty(self)
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from file_memorymodel import FileIndex
+
+	class TestCompactTree(unittest.TestCase):
+		def setUp(self):
+			self.tree = CompactTree("/root")
+			main = Group("main", 2, File("a.c", join("src", "a.c"),
+					join("/root", "src", "a.c"), 3))
+			main.getMeta(TestCompactTree)["x"] = 1
+			plain = Group("root", 0,
+					Group("src", 1, main, File("b.c", join("src", "b.c"),
+						join("/root", "src", "b.c"), 2)),
+					File("README", "README", "/elsewhere/README", 1))
+			self.root = self.tree.setRoot(plain)
+
+		def _titles(self, group):
+			return [(i.title, i.depth) for i in group.iterRecursive()]
+
+		def testCopy(self):
+			self.assertEquals(self._titles(self.root), [("root", 0), ("src", 1),
+					("main", 2), ("a.c", 3), ("b.c", 2), ("README", 1)])
+			src = self.root.getByTitle("src")
+			a = src.getByTitle("main").getByIndex(0)
+			self.assertTrue(isinstance(src, Group))
+			self.assertTrue(isinstance(a, File))
+			self.assertEquals(a.relPath, join("src", "a.c"))
+			self.assertEquals(a.absPath, join("/root", "src", "a.c"))
+			self.assertEquals(self.root.getByTitle("README").absPath,
+					"/elsewhere/README")
+			self.assertTrue(a.parent.parent is src)
+			self.assertEquals(src.getByTitle("main").getMeta(TestCompactTree),
+					{"x": 1})
+			self.assertRaises(KeyError, src.getByTitle, "nothing")
+
+		def testAddRemove(self):
+			src = self.root.getByTitle("src")
+			src.add(File("c.c", join("src", "c.c"), join("/root", "src", "c.c"), 2))
+			src.add(Group("empty", 2))
+			src.remove(src.getByTitle("b.c"))
+			self.assertEquals([i.title for i in src.iterChildren()],
+					["main", "c.c"])
+			src.add(File("main", "main", "/root/main", 2))
+			self.assertTrue(isinstance(src.getByTitle("main"), File))
+
+		def testFileIndex(self):
+			index = FileIndex(self.root)
+			src = self.root.getByTitle("src")
+			src.add(Group("new", 2, File("d.c", "d.c", "/root/d.c", 3)))
+			index.patch(src)
+			self.assertEquals([i.title for i in index], ["root", "src", "main",
+					"a.c", "b.c", "new", "d.c", "README"])
+			self.assertTrue(index.getFile("/root/d.c") is
+					src.getByTitle("new").getByIndex(0))
+
+		def testSparse(self):
+			tree = self.tree
+			for item in self.root.iterRecursive():
+				item.getMeta(TestCompactTree).get("x")
+				self.assertFalse(item.extraInfo)
+			self.assertEquals((len(tree._meta), len(tree._extraInfo)), (1, 0))
+			a = self.root.getByTitle("src").getByTitle("b.c")
+			first, second = a.extraInfo, a.extraInfo
+			first["vcs"] = "[M]"
+			second.setdefault("size", "1k")
+			self.assertEquals(a.extraInfo, {"vcs": "[M]", "size": "1k"})
+			self.assertEquals(second, a.extraInfo)
+			a.getMeta(TestCompactTree)["line"] = 1
+			self.assertEquals(a.meta, {"TestCompactTree": {"line": 1}})
+			self.assertEquals((len(tree._meta), len(tree._extraInfo)), (2, 1))
+
+		def testLazy(self):
+			def loader(group):
+				group.add(File("x.c", "x.c", "/root/x.c", group.depth + 1))
+			self.root.add(LazyGroup("lazy", 1, loader))
+			lazy = self.root.getByTitle("lazy")
+			loaded = []
+			lazy.onLoad.append(loaded.append)
+			self.assertFalse(lazy.loaded)
+			self.assertFalse(lazy.isEmpty())
+			self.assertEquals(self._titles(lazy), [("lazy", 1)])
+			self.assertEquals(self._titles(self.root.getByTitle("lazy")),
+					[("lazy", 1)])
+			self.assertEquals(lazy.getByIndex(0).title, "x.c")
+			self.assertTrue(lazy.loaded)
+			self.assertEquals(loaded, [lazy])
+			self.assertEquals(self._titles(lazy), [("lazy", 1), ("x.c", 2)])
+
+	unittest.main()
@@ -0,0 +1,283 @@
+"""
+Streaming of the output of diff commands.
+
+A L{DiffStream} runs a command like C{git diff}, and reads its output in a
+background thread, so a huge diff is shown as it is read instead of after the
+command has finished. Lines are handed over in chunks through a bounded queue;
+when vim falls behind, the reader waits, and so does the command, so at most
+a few chunks are held in memory outside the buffer.
+
+While reading, the stream builds an index of where each file ("diff ...")
+and hunk ("@@ ...") starts. L{DiffIndex} keeps, for every line, the number of
+the file and hunk it belongs to, so the start of the next or previous hunk
+or file is found in constant time.
+"""
+import sys
+from array import array
+from threading import Thread
+from Queue import Queue, Empty, Full
+from subprocess import Popen, PIPE
+
+
+class DiffIndex(object):
+	""" The start of each file and hunk of a diff, and the file and hunk of
+	each line. Line numbers start at 0. """
+	def __init__(self):
+		self.fileStarts = array("i")
+		self.hunkStarts = array("i")
+		self._fileOfLine = array("i")
+		self._hunkOfLine = array("i")
+
+	def __len__(self):
+		""" The number of lines indexed. """
+		return len(self._hunkOfLine)
+
+	def addLines(self, lines):
+		fileOfLine = self._fileOfLine
+		hunkOfLine = self._hunkOfLine
+		for line in lines:
+			if line.startswith("diff "):
+				self.fileStarts.append(len(hunkOfLine))
+			elif line.startswith("@@"):
+				self.hunkStarts.append(len(hunkOfLine))
+			fileOfLine.append(len(self.fileStarts) - 1)
+			hunkOfLine.append(len(self.hunkStarts) - 1)
+
+	def _next(self, starts, ofLine, line):
+		if line >= len(ofLine):
+			return None
+		i = ofLine[line] + 1
+		if i < len(starts):
+			return starts[i]
+		return None
+
+	def _previous(self, starts, ofLine, line):
+		if line >= len(ofLine):
+			line = len(ofLine) - 1
+		if line < 0:
+			return None
+		i = ofLine[line]
+		if i >= 0 and starts[i] < line:
+			return starts[i]
+		if i >= 1:
+			return starts[i-1]
+		return None
+
+	def nextHunk(self, line):
+		""" Get the first line of the hunk after *line*.
+		@return: The line number, or None if there is no such hunk. """
+		return self._next(self.hunkStarts, self._hunkOfLine, line)
+
+	def previousHunk(self, line):
+		""" Get the first line of the hunk before *line*, or of the hunk
+		*line* is in, if *line* is not its first line.
+		@return: The line number, or None if there is no such hunk. """
+		return self._previous(self.hunkStarts, self._hunkOfLine, line)
+
+	def nextFile(self, line):
+		""" Like L{nextHunk}, for files. """
+		return self._next(self.fileStarts, self._fileOfLine, line)
+
+	def previousFile(self, line):
+		""" Like L{previousHunk}, for files. """
+		return self._previous(self.fileStarts, self._fileOfLine, line)
+
+
+class DiffStream(object):
+	""" Runs a diff command, and reads its output in the background. """
+
+	# Number of lines in each chunk.
+	CHUNK_LINES = 2000
+
+	# Number of chunks read ahead of L{poll}.
+	QUEUE_CHUNKS = 16
+
+	def __init__(self, cmd, cwd=None):
+		self._cmd = cmd
+		self._cwd = cwd
+		self._process = None
+		self._thread = None
+		self._stderrThread = None
+		self._stderr = []
+		self._queue = Queue(self.QUEUE_CHUNKS)
+		self._cancelled = False
+		self.index = DiffIndex()
+		self.done = False
+		self.error = None
+
+	def start(self):
+		try:
+			self._process = Popen(self._cmd, cwd=self._cwd, stdout=PIPE,
+					stderr=PIPE, close_fds=sys.platform != "win32")
+		except OSError, e:
+			self.error = str(e)
+			self.done = True
+			return
+		# stderr is drained by a thread of its own, since the command blocks
+		# when a pipe it writes to is full.
+		self._stderrThread = Thread(target=self._readStderr,
+				name="vcode-diff-stderr")
+		self._stderrThread.setDaemon(True)
+		self._stderrThread.start()
+		self._thread = Thread(target=self._read, name="vcode-diff")
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def _readStderr(self):
+		for data in iter(lambda: self._process.stderr.read(65536), ""):
+			self._stderr.append(data)
+
+	def _read(self):
+		process = self._process
+		chunk = []
+		for line in iter(process.stdout.readline, ""):
+			chunk.append(line.rstrip("\r\n"))
+			if len(chunk) == self.CHUNK_LINES:
+				if not self._put(chunk):
+					return
+				chunk = []
+		if chunk and not self._put(chunk):
+			return
+		self._stderrThread.join()
+		stderr = "".join(self._stderr)
+		if process.wait() != 0 and not self._cancelled:
+			self._put(stderr.strip() or "%s exited with %d" % (self._cmd[0],
+					process.returncode))
+		self._put(None)
+
+	def _put(self, item):
+		""" Queue *item*, waiting while the queue is full.
+		@return: False if the stream has been cancelled. """
+		while not self._cancelled:
+			try:
+				self._queue.put(item, timeout=0.1)
+				return True
+			except Full:
+				pass
+		return False
+
+	def cancel(self):
+		""" Kill the command, and stop reading its output. """
+		self._cancelled = True
+		if self._process is not None and self._process.poll() is None:
+			try:
+				self._process.kill()
+			except OSError:
+				pass
+
+	def poll(self, maxLines=None):
+		""" Get the lines read since the last call, without blocking, and add
+		them to L{index}. L{done} is set when the whole output has been read,
+		and L{error} is set if the command failed.
+		@param maxLines: Stop after the first chunk reaching this number of
+			lines. The rest is returned by the next call.
+		@return: A list of lines.
+		"""
+		lines = []
+		while not self._cancelled:
+			if maxLines is not None and len(lines) >= maxLines:
+				break
+			try:
+				item = self._queue.get_nowait()
+			except Empty:
+				break
+			if item is None:
+				self.done = True
+				break
+			elif isinstance(item, list):
+				lines.extend(item)
+			else:
+				self.error = item
+		self.index.addLines(lines)
+		return lines
+
+
+
+if __name__ == "__main__":
+	import unittest
+	import time
+
+	DIFF = """diff --git a/a.c b/a.c
+--- a/a.c
++++ b/a.c
+@@ -1,2 +1,2 @@
+-x
++y
+@@ -10,1 +10,1 @@
+-z
+diff --git a/b.c b/b.c
+@@ -1 +1 @@
++w"""
+
+	class TestDiffIndex(unittest.TestCase):
+		def setUp(self):
+			self.index = DiffIndex()
+			lines = DIFF.split("\n")
+			self.index.addLines(lines[:5])
+			self.index.addLines(lines[5:])
+
+		def testStarts(self):
+			self.assertEquals(list(self.index.fileStarts), [0, 8])
+			self.assertEquals(list(self.index.hunkStarts), [3, 6, 9])
+
+		def testNext(self):
+			self.assertEquals([self.index.nextHunk(i) for i in (0, 3, 6, 9)],
+					[3, 6, 9, None])
+			self.assertEquals([self.index.nextFile(i) for i in (0, 7, 8)],
+					[8, 8, None])
+
+		def testPrevious(self):
+			self.assertEquals([self.index.previousHunk(i)
+					for i in (0, 3, 4, 6, 10)], [None, None, 3, 3, 9])
+			self.assertEquals([self.index.previousFile(i) for i in (0, 5, 8)],
+					[None, 0, 0])
+
+	class TestDiffStream(unittest.TestCase):
+		def _run(self, cmd, maxLines=None):
+			stream = DiffStream(cmd)
+			stream.start()
+			polls = []
+			timeout = time.time() + 10
+			while not stream.done:
+				self.assertTrue(time.time() < timeout)
+				time.sleep(0.01)
+				polls.append(stream.poll(maxLines))
+			return stream, polls
+
+		def testStream(self):
+			DiffStream.CHUNK_LINES = 3
+			try:
+				stream, polls = self._run([sys.executable, "-c",
+						"import sys; sys.stdout.write(%r)" % DIFF], maxLines=3)
+			finally:
+				DiffStream.CHUNK_LINES = 2000
+			self.assertEquals(sum(polls, []), DIFF.split("\n"))
+			self.assertTrue(max([len(p) for p in polls]) <= 3)
+			self.assertEquals(list(stream.index.hunkStarts), [3, 6, 9])
+			self.assertEquals(stream.error, None)
+
+		def testError(self):
+			stream, polls = self._run([sys.executable, "-c",
+					"import sys; sys.stderr.write('bad'); sys.exit(2)"])
+			self.assertEquals(stream.error, "bad")
+			stream, polls = self._run(["vcode-no-such-command"])
+			self.assertTrue(stream.error)
+
+		def testLargeStderr(self):
+			stream, polls = self._run([sys.executable, "-c",
+					"import sys; sys.stderr.write('w' * 200000); "
+					"sys.stdout.write('+x\\n' * 10)"])
+			self.assertEquals(sum(polls, []), ["+x"] * 10)
+			self.assertEquals(stream.error, None)
+
+		def testCancel(self):
+			stream = DiffStream([sys.executable, "-c",
+					"while True: print '+' * 100"])
+			stream.start()
+			time.sleep(0.1)
+			stream.cancel()
+			stream._thread.join(5)
+			self.assertFalse(stream._thread.isAlive())
+			self.assertEquals(stream.poll(), [])
+
+	unittest.main()
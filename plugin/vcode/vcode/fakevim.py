@@ -0,0 +1,521 @@
+"""
+An in-process fake of the vim module, for running the user interface of
+vcode outside vim: in tests, benchmarks and profilers.
+
+The fake keeps tab pages, windows and buffers, and understands the commands
+and functions vcode uses to manage them, like "tabnew", "wincmd w",
+"setlocal", setbufvar() and bufwinnr(), and a few more for tests, like
+"split" and "wincmd r". Other commands, like syntax rules
+and key maps, are only recorded. Every command, including each command of a
+batch (see L{vimbridge}), is kept in L{commands}, and every call into the
+fake is counted in L{calls}, so tests can check how often vcode crosses into
+vim.
+
+Install it before importing the modules using vim:
+
+	import fakevim
+	fakevim.install()
+	import project
+"""
+import re
+import sys
+
+
+class error(Exception):
+	""" Like vim.error. """
+
+
+class Buffer(list):
+	""" A buffer: a list of lines, with a name, a number and options. """
+	def __init__(self, number, name=""):
+		list.__init__(self, [""])
+		self.number = number
+		self.name = name
+		self.options = {}
+		self.valid = True
+
+	def append(self, lines, nr=None):
+		if isinstance(lines, basestring):
+			lines = [lines]
+		if nr is None:
+			nr = len(self)
+		self[nr:nr] = lines
+
+	def __hash__(self):
+		return id(self)
+
+	def __eq__(self, other):
+		return self is other
+
+	def __ne__(self, other):
+		return self is not other
+
+
+class Window(object):
+	def __init__(self, buffer):
+		self.buffer = buffer
+		self.cursor = (1, 0)
+
+
+class TabPage(object):
+	def __init__(self, window):
+		self.windows = [window]
+		self.window = window
+
+
+class _Current(object):
+	""" Like vim.current. """
+	@property
+	def tabpage(self):
+		return _state.tab
+
+	@property
+	def window(self):
+		return _state.tab.window
+
+	@property
+	def buffer(self):
+		return _state.tab.window.buffer
+
+
+class _State(object):
+	def __init__(self):
+		self.buffers = []
+		self.tabs = []
+		self.tab = None
+		self.variables = {}
+		tab = TabPage(Window(self.newBuffer("")))
+		self.tabs.append(tab)
+		self.tab = tab
+
+	def newBuffer(self, name):
+		b = Buffer(len(self.buffers) + 1, name)
+		self.buffers.append(b)
+		return b
+
+	def findBuffer(self, name):
+		for b in self.buffers:
+			if b.valid and b.name == name:
+				return b
+		return None
+
+	def bufferNamed(self, name):
+		return self.findBuffer(name) or self.newBuffer(name)
+
+	def newTab(self, name, after=None):
+		tab = TabPage(Window(self.bufferNamed(name)))
+		i = self.tabs.index(after or self.tab) + 1
+		self.tabs.insert(i, tab)
+		self.tab = tab
+
+
+_state = None
+current = _Current()
+
+# Every command run, one per line of a batch.
+commands = []
+
+# The number of calls to command() and eval().
+calls = 0
+
+
+def reset():
+	""" Forget every buffer, window and tab page, and start over with one
+	empty window. """
+	global _state, calls
+	_state = _State()
+	del commands[:]
+	calls = 0
+
+def install():
+	""" Make "import vim" import this module. """
+	if _state is None:
+		reset()
+	sys.modules["vim"] = sys.modules[__name__]
+
+
+def _windowNr(tab, buffer):
+	for i, w in enumerate(tab.windows):
+		if w.buffer is buffer:
+			return i + 1
+	return -1
+
+def _bufferByPattern(pattern):
+	""" Find a buffer by a pattern like '^name$', as used by bufwinnr(). """
+	return _state.findBuffer(pattern.lstrip("^").rstrip("$"))
+
+def _literal(text):
+	text = text.strip()
+	if text.startswith("'"):
+		return text[1:-1].replace("''", "'")
+	if text.startswith('"'):
+		return text[1:-1].replace('\\"', '"')
+	try:
+		return int(text)
+	except ValueError:
+		raise error("Unsupported argument: %s" % text)
+
+def _args(text):
+	""" Split the arguments of a function call into literals. """
+	args = []
+	for m in re.finditer(r"\s*('(?:[^']|'')*'|\"(?:[^\"\\]|\\.)*\"|[^,]+)\s*,?",
+			text):
+		args.append(_literal(m.group(1)))
+	return args
+
+
+def _tabpagenr(which=None):
+	if which == "$":
+		return len(_state.tabs)
+	return _state.tabs.index(_state.tab) + 1
+
+def _winnr():
+	return _state.tab.windows.index(_state.tab.window) + 1
+
+def _bufwinnr(pattern):
+	b = _bufferByPattern(pattern)
+	if b is None:
+		return -1
+	return _windowNr(_state.tab, b)
+
+def _bufnr(pattern):
+	b = _bufferByPattern(pattern)
+	return b and b.number or -1
+
+def _findBuffer(name):
+	""" Like VCodeFindBuffer in vcode.vim. """
+	b = _state.findBuffer(name)
+	if b is None:
+		return []
+	tabs = [_state.tab] + _state.tabs
+	for tab in tabs:
+		win = _windowNr(tab, b)
+		if win > 0:
+			return [_state.tabs.index(tab) + 1, win, _tabpagenr(), _winnr()]
+	return []
+
+def _goToBuffer(name, allTabs):
+	""" Like VCodeGoToBuffer in vcode.vim. """
+	found = _findBuffer(name)
+	if not found or (not allTabs and found[0] != found[2]):
+		return []
+	_state.tab = _state.tabs[found[0] - 1]
+	_goToWindow(found[1])
+	return [found[2], found[3], found[0], found[1]]
+
+def _expand(what):
+	if what in ("%:p", "%"):
+		return current.buffer.name
+	return ""
+
+def _has(feature):
+	return 0
+
+def _setbufvar(nr, name, value):
+	for b in _state.buffers:
+		if b.number == nr:
+			b.options[name.lstrip("&")] = value
+
+# The functions understood by eval() and "call".
+functions = {
+	"tabpagenr": _tabpagenr,
+	"winnr": _winnr,
+	"bufwinnr": _bufwinnr,
+	"bufnr": _bufnr,
+	"expand": _expand,
+	"has": _has,
+	"setbufvar": _setbufvar,
+	"VCodeFindBuffer": _findBuffer,
+	"VCodeGoToBuffer": _goToBuffer,
+}
+
+def _toVim(value):
+	""" Convert *value* like vim.eval does: numbers to strings. """
+	if isinstance(value, list):
+		return [_toVim(v) for v in value]
+	return str(value)
+
+def _call(expr):
+	m = re.match(r"(\w+)\((.*)\)$", expr.strip())
+	if m is None or not m.group(1) in functions:
+		raise error("Unsupported expression: %s" % expr)
+	return functions[m.group(1)](*_args(m.group(2)))
+
+def eval(expr):
+	global calls
+	calls += 1
+	expr = expr.strip()
+	if expr in _state.variables:
+		return _state.variables[expr]
+	return _toVim(_call(expr))
+
+
+def _setlocal(args):
+	for arg in args.split():
+		if "=" in arg:
+			name, value = arg.split("=", 1)
+			current.buffer.options[name] = value
+		elif arg.startswith("no"):
+			current.buffer.options[arg[2:]] = 0
+		else:
+			current.buffer.options[arg] = 1
+
+def _goToWindow(nr):
+	windows = _state.tab.windows
+	if 1 <= nr <= len(windows):
+		_state.tab.window = windows[nr-1]
+
+def _run(cmd):
+	cmd = cmd.strip()
+	m = re.match(r'exec (\d+) \. "wincmd w"$', cmd) \
+			or re.match(r"(\d+)\s*wincmd w$", cmd)
+	if m:
+		_goToWindow(int(m.group(1)))
+		return
+	if cmd == "wincmd r":
+		# Rotate the windows downwards, keeping the cursor in its window.
+		_state.tab.windows.insert(0, _state.tab.windows.pop())
+		return
+	name, _, args = cmd.partition(" ")
+	args = args.strip()
+	if name == "tabnew":
+		_state.newTab(args)
+	elif name == "tabedit":
+		if args.startswith("+"):
+			lineNr, _, args = args.partition(" ")
+			_state.newTab(args.strip())
+			current.window.cursor = (int(lineNr[1:]), 0)
+		else:
+			_state.newTab(args)
+	elif name == "tabnext":
+		if args:
+			_state.tab = _state.tabs[int(args) - 1]
+		else:
+			i = _state.tabs.index(_state.tab) + 1
+			_state.tab = _state.tabs[i % len(_state.tabs)]
+	elif name == "tabmove":
+		_state.tabs.remove(_state.tab)
+		_state.tabs.append(_state.tab)
+	elif name == "split":
+		window = Window(_state.bufferNamed(args))
+		windows = _state.tab.windows
+		windows.insert(windows.index(_state.tab.window), window)
+		_state.tab.window = window
+	elif name == "edit":
+		current.window.buffer = _state.bufferNamed(args)
+	elif name == "setlocal":
+		_setlocal(args)
+	elif name == "call":
+		_call(args)
+	elif name == "let":
+		var, _, value = args.partition("=")
+		_state.variables[var.strip()] = value.strip()
+
+_BATCH_PATT = re.compile(r"for (\w+) in \[(.*)\] \| exe \1 \| endfor$")
+
+def command(cmd):
+	""" Run *cmd*, like vim.command. """
+	global calls
+	calls += 1
+	m = _BATCH_PATT.match(cmd)
+	if m:
+		batch = _args(m.group(2))
+	else:
+		batch = [cmd]
+	for c in batch:
+		commands.append(c)
+		_run(c)
+
+
+class _Buffers(object):
+	""" Like vim.buffers. """
+	def __iter__(self):
+		return iter([b for b in _state.buffers if b.valid])
+
+	def __len__(self):
+		return len(list(iter(self)))
+
+buffers = _Buffers()
+
+
+
+if __name__ == "__main__":
+	import unittest
+	install()
+	from vimbridge import CommandBatch, execute, windows
+
+	class TestFakeVim(unittest.TestCase):
+		def setUp(self):
+			reset()
+
+		def testTabsAndWindows(self):
+			command("for c in ['tabnew first', 'setlocal nonumber buftype=nofile']"
+					" | exe c | endfor")
+			self.assertEquals(current.buffer.name, "first")
+			self.assertEquals(current.buffer.options,
+					{"number": 0, "buftype": "nofile"})
+			command("tabnew second")
+			self.assertEquals(eval("tabpagenr('$')"), "3")
+			self.assertEquals(eval("bufwinnr('^first$')"), "-1")
+			self.assertEquals(eval("VCodeFindBuffer('first')"),
+					["2", "1", "3", "1"])
+			command("tabnext 2")
+			self.assertEquals(eval("bufwinnr('^first$')"), "1")
+			command("tabnext")
+			self.assertEquals(current.buffer.name, "second")
+			self.assertEquals(calls, 8)
+			self.assertEquals(len(commands), 5)
+
+		def testBufferOptions(self):
+			command("call setbufvar(%d, '&modifiable', 0)" % current.buffer.number)
+			self.assertEquals(current.buffer.options["modifiable"], 0)
+			current.buffer[:] = ["a", "b"]
+			current.buffer.append("c")
+			self.assertEquals(list(current.buffer), ["a", "b", "c"])
+			self.assertRaises(error, eval, "getline(1)")
+
+	class TestBridge(unittest.TestCase):
+		def setUp(self):
+			install()
+			reset()
+
+		def testBatch(self):
+			batch = CommandBatch("tabnew a")
+			batch.add("setlocal nonumber", "syn match x #x#",
+					"nnoremap <buffer> x :python f('a, b')<CR>")
+			batch.execute()
+			batch.execute()
+			self.assertEquals(calls, 1)
+			self.assertEquals(commands, ["tabnew a", "setlocal nonumber",
+					"syn match x #x#", "nnoremap <buffer> x :python f('a, b')<CR>"])
+			self.assertEquals(current.buffer.options, {"number": 0})
+
+		def testWindows(self):
+			global calls
+			execute("tabnew a")
+			execute("tabnew b")
+			calls = 0
+			self.assertEquals(windows.windowNr("a"), -1)
+			self.assertEquals(windows.find("a"), (2, 1))
+			self.assertEquals(windows.goToBuffer("a", allTabs=False), None)
+			self.assertEquals(windows.goToBuffer("a"), ((3, 1), (2, 1)))
+			self.assertEquals(current.buffer.name, "a")
+			self.assertEquals(windows.goToBuffer("missing"), None)
+			self.assertEquals(windows.goToBuffer("b"), ((2, 1), (3, 1)))
+			self.assertEquals(current.buffer.name, "b")
+			# One call for each lookup or move.
+			self.assertEquals(calls, 6)
+
+		def testRenumberedWindows(self):
+			command("tabnew a")
+			command("split b")
+			self.assertEquals(windows.windowNr("a"), 2)
+			# Vim renumbers the windows without any event.
+			command("wincmd r")
+			self.assertEquals(current.buffer.name, "b")
+			self.assertEquals(windows.windowNr("a"), 1)
+			self.assertEquals(windows.goToBuffer("a"), ((2, 2), (2, 1)))
+			self.assertEquals(current.buffer.name, "a")
+
+		def testProjectBrowser(self):
+			from file_memorymodel import File, Group, FileIndex
+			from project import ProjectBrowser
+			root = Group("root", 0, Group("src", 1,
+					File("a.c", "src/a.c", "/p/src/a.c", 2)))
+			browser = ProjectBrowser(FileIndex(root))
+			browser.open()
+			b = current.buffer
+			self.assertEquals(b.name, ProjectBrowser.BUFNAME)
+			self.assertEquals(b.options["buftype"], "nofile")
+			self.assertEquals(b[2:], ["|~root/", "| |~src/"])
+			# The lookup, the new buffer, and making it modifiable around
+			# the draw.
+			self.assertEquals(calls, 4)
+			command("tabnew other")
+			browser.open()
+			self.assertTrue(current.buffer is b)
+
+		def testProjectBrowserInRenumberedWindow(self):
+			from file_memorymodel import File, Group, FileIndex
+			from project import ProjectBrowser
+			root = Group("root", 0, File("a.c", "a.c", "/p/a.c", 1))
+			browser = ProjectBrowser(FileIndex(root))
+			browser.open()
+			b = current.buffer
+			command("split other")
+			command("wincmd r")
+			other = current.buffer
+			other[:] = ["mine"]
+			browser.invalidate()
+			browser.update()
+			self.assertEquals(b[2:], ["|~root/", "| |-a.c"])
+			self.assertEquals(list(other), ["mine"])
+			self.assertTrue(current.buffer is other)
+			# Never drawn into another buffer.
+			browser.invalidate()
+			browser._draw()
+			self.assertEquals(list(other), ["mine"])
+
+		def testRevealInWorkspace(self):
+			from shutil import rmtree
+			from tempfile import mkdtemp
+			from os import makedirs
+			from os.path import join
+			from project import Workspace
+			tmp = mkdtemp()
+			try:
+				projectDirs = []
+				for name in ("first", "second"):
+					makedirs(join(tmp, name, "src", "sub"))
+					open(join(tmp, name, "src", "sub", "b.c"), "w").close()
+					projectDir = join(tmp, name, name + ".vcode")
+					makedirs(projectDir)
+					open(join(projectDir, "project.files.xml"), "w").write(
+							'<files><group title="src"><dir path="src"/></group>'
+							'</files>')
+					projectDirs.append(projectDir)
+				workspace = Workspace(projectDirs, watch=False, lazy=True)
+				b = current.buffer
+				workspace.browser.revealFile(
+						join(tmp, "second", "src", "sub", "b.c"))
+				row = current.window.cursor[0] - 1
+				self.assertEquals(b[row], "| | | | |-b.c")
+				item = workspace.browser._rows.itemAt(
+						row - len(workspace.browser._curHeader))
+				self.assertEquals(item.absPath,
+						join(tmp, "second", "src", "sub", "b.c"))
+			finally:
+				rmtree(tmp)
+
+		def testDiffWithoutTimers(self):
+			import time
+			import util
+			util.colorDiffCommand(["printf", "+a\\n-b\\n"])
+			b = current.buffer
+			self.assertTrue("au CursorHold,CursorMoved <buffer> "
+					"python vcode.util.pollDiffs()" in commands)
+			timeout = time.time() + 10
+			while b.options.get("statusline") != "diff: 2 lines":
+				self.assertTrue(time.time() < timeout)
+				time.sleep(0.01)
+				# Run by the autocommands.
+				util.pollDiffs()
+			self.assertEquals(list(b), ["+a", "-b"])
+
+		def testReplaceFilter(self):
+			from file_memorymodel import File, Group, FileIndex
+			from filter import Filter
+			from project import ProjectBrowser
+			root = Group("root", 0, File("a.c", "a.c", "/p/a.c", 1),
+					File("b.h", "b.h", "/p/b.h", 1))
+			index = FileIndex(root)
+			browser = ProjectBrowser(index)
+			listeners = len(index._listeners)
+			browser.addFilter("src", Filter(["+*.c"]))
+			browser.applyFilter("src")
+			for i in xrange(3):
+				browser.addFilter("src", Filter(["+*.h"]))
+			self.assertEquals(len(index._listeners), listeners + 1)
+			self.assertEquals([i.title for i in browser._rows], ["root", "b.h"])
+
+	unittest.main()
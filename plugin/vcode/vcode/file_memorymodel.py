@@ -16,11 +16,21 @@ class FileTreeItem(object):
 		self.title = title.encode(ENCODING)
 		self.depth = depth
 		self.meta = {} # a place for other parts of the system to attach metadata
+		self.extraInfo = {} # displayed after the title, ordered by key
 		self.parent = None
 
 	def listFormatPrefix(self, depth):
 		return "".join(["| " for x in xrange(depth)])
 
+	def iterExtraInfoSorted(self):
+		""" Iterate over extraInfo.
+		@return: (key,value) pairs ordered by key.
+		"""
+		keys = self.extraInfo.keys()
+		keys.sort()
+		for k in keys:
+			yield k, self.extraInfo[k]
+
 	def getMeta(self, cls):
 		""" Get the metadata entry for the given class. """
 		if not cls.__name__ in self.meta:
@@ -66,17 +76,26 @@ class Group(FileTreeItem):
 		self.childDct[item.title] = item
 		item.parent = self
 
+	def remove(self, item):
+		self.childLst.remove(item)
+		if self.childDct.get(item.title) is item:
+			del self.childDct[item.title]
+		item.parent = None
+
 	def iterChildren(self):
 		""" Iterate over the items directly below this group. """
 		for item in self.childLst:
 			yield item
 
-	def iterRecursive(self):
-		""" Recurse the entire tree below this folder, including this group. """
+	def iterRecursive(self, load=False):
+		""" Recurse the entire tree below this folder, including this group.
+		@param load: Load the L{LazyGroup}s below this group. If False, the
+			children of lazy groups which are not loaded are skipped.
+		"""
 		yield self
 		for item in self.childLst:
 			if isinstance(item, Group):
-				for i in item.iterRecursive():
+				for i in item.iterRecursive(load):
 					yield i
 			else:
 				yield item
@@ -85,14 +104,134 @@ class Group(FileTreeItem):
 		return len(self.childLst) == 0
 
 
+class LazyGroup(Group):
+	""" A group which does not create its children until they are needed.
+	The children are added by a loader function the first time they are
+	accessed through L{iterChildren}, L{getByIndex}, L{getByTitle} or L{load}.
+	"""
+	def __init__(self, title, depth, loader):
+		"""
+		@param loader: Called as loader(group) to add the children of the group.
+		"""
+		super(LazyGroup, self).__init__(title, depth)
+		self._loader = loader
+		self.loaded = False
+		# Functions called as f(group) after the group has been loaded.
+		self.onLoad = []
+
+	def load(self):
+		if self.loaded:
+			return
+		self.loaded = True
+		loader = self._loader
+		self._loader = None
+		loader(self)
+		for f in self.onLoad:
+			f(self)
+		self.onLoad = []
+
+	def getByIndex(self, index):
+		self.load()
+		return super(LazyGroup, self).getByIndex(index)
+
+	def getByTitle(self, title):
+		self.load()
+		return super(LazyGroup, self).getByTitle(title)
+
+	def iterChildren(self):
+		self.load()
+		return super(LazyGroup, self).iterChildren()
+
+	def iterRecursive(self, load=False):
+		if load:
+			self.load()
+		if self.loaded:
+			return super(LazyGroup, self).iterRecursive(load)
+		return iter([self])
+
+	def isEmpty(self):
+		""" A group which is not loaded is never considered empty, since
+		that would require loading it. """
+		return self.loaded and super(LazyGroup, self).isEmpty()
+
+
 class FileIndex(object):
 	def __init__(self, root):
 		self.root = root
 		self._allItems = [x for x in self.root.iterRecursive()]
+		# Increased every time the index changes.
+		self.generation = 0
+		self._listeners = []
+		self._patchOnLoad(self._allItems)
+		self._files = None
+		self._filesGeneration = None
+
+	def _patchOnLoad(self, items):
+		""" Patch the index when any of the lazy groups in *items* is loaded. """
+		for item in items:
+			if isinstance(item, LazyGroup) and not item.loaded:
+				item.onLoad.append(self.patch)
+
+	def addListener(self, listener):
+		""" Add a function called as listener(group, removed, added) after the
+		items below a group has been patched with L{patch}. *removed* and
+		*added* are lists of the items no longer/now in the index. """
+		self._listeners.append(listener)
+
+	def removeListener(self, listener):
+		""" Remove a listener added with L{addListener}. """
+		self._listeners.remove(listener)
+
+	def _subtreeEnd(self, start):
+		depth = self._allItems[start].depth
+		end = start + 1
+		while end < len(self._allItems) and self._allItems[end].depth > depth:
+			end += 1
+		return end
+
+	def patch(self, group):
+		""" Update the index after items has been added to or removed
+		from the tree below *group*. """
+		start = self._allItems.index(group)
+		end = self._subtreeEnd(start)
+		old = self._allItems[start:end]
+		new = list(group.iterRecursive())
+		self._allItems[start:end] = new
+		self.generation += 1
+
+		oldIds = set(map(id, old))
+		newIds = set(map(id, new))
+		removed = [i for i in old if not id(i) in newIds]
+		added = [i for i in new if not id(i) in oldIds]
+		self._patchOnLoad(added)
+		for listener in list(self._listeners):
+			listener(group, removed, added)
 
 	def __iter__(self):
 		return self._allItems.__iter__()
 
+	def getFile(self, absPath):
+		""" Get the file with the absolute path *absPath*.
+		@return: The first L{File} with the path, or None if no file in the
+			index has the path.
+		"""
+		files = self.getFiles(absPath)
+		return files and files[0] or None
+
+	def getFiles(self, absPath):
+		""" Get all the files with the absolute path *absPath*, in the order
+		of the index. The same file may be in several groups.
+		@return: A list of L{File}s, empty if no file in the index has the
+			path.
+		"""
+		if self._filesGeneration != self.generation:
+			self._files = {}
+			for item in self._allItems:
+				if isinstance(item, File):
+					self._files.setdefault(item.absPath, []).append(item)
+			self._filesGeneration = self.generation
+		return self._files.get(absPath, [])
+
 	def getByIndex(self, index):
 		return self._allItems[index]
 
@@ -1,3 +1,28 @@
+"""
+Filters with ordered +/- rules, as described in *.filters.xml.
+
+A rule is a shell pattern prefixed with + (accept) or - (reject). The rules of
+a filter are tried in order, and the first rule matching a path decides if
+the path is accepted. Paths matching no rule are rejected.
+
+Paths are relative to the project root, use / as separator, and always start
+with /. A file is also rejected if the first rule matching any of the
+directories above it is a - rule, so "-*/build" rejects everything below
+build directories.
+
+The rules are compiled into a single regex with one group per rule. The
+regex is anchored at both ends of each alternative, so the first alternative
+that matches is the first matching rule, and is found in a single match.
+Verdicts are memoized per path until the rules change.
+
+L{SubtreeCounts} keeps the number of files accepted by a filter below each
+group, so groups without any accepted files can be hidden.
+"""
+import re
+import fnmatch
+from os import sep
+
+from file_memorymodel import Group, LazyGroup
 
 
 class Pattern(object):
@@ -10,33 +35,243 @@ class Pattern(object):
 
 
 class ShellPattern(Pattern):
-	def __init__(self, pattern):
-		self._negative = shellPatt[0] == "-"
-		self._pattern = shellPatt[1:]
+	""" A shell pattern rule, like "+*.py" or "-*/build". """
+	def __init__(self, shellPatt):
+		if not shellPatt[:1] in ("+", "-"):
+			raise ValueError("Rules must start with + or -: %r" % shellPatt)
+		self.negative = shellPatt[0] == "-"
+		self.pattern = shellPatt[1:]
+		self._regex = None
+
+	def toRegex(self):
+		""" Get a regex matching the same paths as the pattern, without
+		anchors or flags. """
+		regex = fnmatch.translate(self.pattern)
+		if regex.endswith("\\Z(?ms)"):
+			regex = regex[:-len("\\Z(?ms)")]
+		return regex
 
 	def check(self, path):
-		match = fnmatch.fnmatchcase(path, self._pattern)
-		if not match:
+		if self._regex is None:
+			self._regex = re.compile("(?s)(?:%s)\\Z" % self.toRegex())
+		if not self._regex.match(path):
 			return Pattern.CONTINUE
-		elif self._negative:
+		elif self.negative:
 			return Pattern.ABORT
 		else:
 			return Pattern.MATCH
 
+	def __str__(self):
+		return (self.negative and "-" or "+") + self.pattern
+
 
 class Filter(object):
-	def __init__(self, patterns=[]):
-		self._patterns = patterns
+	def __init__(self, patterns=None, name=None, description=""):
+		"""
+		@param patterns: L{ShellPattern}s, or rule strings like "+*.py".
+		"""
+		self.name = name
+		self.description = description
+		self._patterns = []
+		self._regex = None
+		self._verdicts = {}
+		for pattern in patterns or []:
+			self.addPattern(pattern)
 
 	def addPattern(self, pattern):
+		if isinstance(pattern, basestring):
+			pattern = ShellPattern(pattern)
 		self._patterns.append(pattern)
+		self._regex = None
+		self._verdicts = {}
+
+	def _compile(self):
+		alternatives = ["(%s)\\Z" % p.toRegex() for p in self._patterns]
+		return re.compile("(?s)(?:%s)" % "|".join(alternatives or ["(?!)"]))
+
+	def _firstMatch(self, path):
+		""" Get the first rule matching *path*.
+		@return: The pattern, or None if no rule matches. """
+		if self._regex is None:
+			self._regex = self._compile()
+		m = self._regex.match(path)
+		if m is None:
+			return None
+		return self._patterns[m.lastindex - 1]
+
+	def matches(self, path):
+		""" Check if the filter accepts *path*. See the module docs. """
+		verdict = self._verdicts.get(path)
+		if verdict is None:
+			parent = path.rsplit("/", 1)[0]
+			if parent and not self._isDirAccepted(parent):
+				verdict = False
+			else:
+				p = self._firstMatch(path)
+				verdict = p is not None and not p.negative
+			self._verdicts[path] = verdict
+		return verdict
+
+	def _isDirAccepted(self, path):
+		key = path + "/"
+		verdict = self._verdicts.get(key)
+		if verdict is None:
+			parent = path.rsplit("/", 1)[0]
+			if parent and not self._isDirAccepted(parent):
+				verdict = False
+			else:
+				p = self._firstMatch(path)
+				verdict = p is None or not p.negative
+			self._verdicts[key] = verdict
+		return verdict
+
+	def letThrough(self, f):
+		""" Check if the filter accepts the L{file_memorymodel.File} *f*. """
+		return self.matches("/" + f.relPath.replace(sep, "/"))
 
 	def filter(self, filePaths):
-		def f(path):
-			for patt in self._patterns:
-				r = patt.check(path)
-				if r == Pattern.MATCH:
-					return True
-				elif r == Pattern.ABORT:
-					return False
-			return False
+		""" Get the paths in *filePaths* accepted by the filter. """
+		return [path for path in filePaths if self.matches(path)]
+
+	def __str__(self):
+		return " ".join([str(p) for p in self._patterns])
+
+
+class SubtreeCounts(object):
+	""" The number of files accepted by a L{Filter} below each group of a
+	L{file_memorymodel.FileIndex}.
+
+	The counts are computed bottom-up in one pass over the index. When the
+	index is patched, only the patched subtree is counted again, and the
+	difference is added to the groups above it. L{LazyGroup}s which are not
+	loaded count as one accepted file, so they are not hidden before their
+	contents is known.
+	"""
+	def __init__(self, filter, fileindex):
+		self._filter = filter
+		self._counts = {}
+		self._fileindex = fileindex
+		self._countTree(list(fileindex))
+		fileindex.addListener(self._onIndexPatched)
+
+	def close(self):
+		""" Stop following the index. The counts are not updated anymore. """
+		self._fileindex.removeListener(self._onIndexPatched)
+
+	def _countTree(self, items):
+		""" Count the groups in *items*, the items of a subtree in the order
+		of L{Group.iterRecursive}. """
+		counts = self._counts
+		for item in items:
+			if isinstance(item, Group):
+				counts[item] = 0
+		root = items[0]
+		# Every item comes after its descendants in reverse order, so the
+		# count of a group is complete when it is reached.
+		for item in reversed(items):
+			if isinstance(item, LazyGroup) and not item.loaded:
+				counts[item] = 1
+			if isinstance(item, Group):
+				count = counts[item]
+			else:
+				count = self._filter.letThrough(item) and 1 or 0
+			if item is not root and count:
+				counts[item.parent] += count
+
+	def _onIndexPatched(self, group, removed, added):
+		old = self._counts.get(group, 0)
+		for item in removed:
+			self._counts.pop(item, None)
+		self._countTree(list(group.iterRecursive()))
+		delta = self._counts[group] - old
+		parent = group.parent
+		while parent is not None and delta:
+			self._counts[parent] += delta
+			parent = parent.parent
+
+	def count(self, group):
+		""" Get the number of accepted files below *group*. """
+		return self._counts.get(group, 0)
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from os.path import join
+	from file_memorymodel import File, FileIndex
+
+	class TestFilter(unittest.TestCase):
+		def testFirstMatch(self):
+			f = Filter(["-*/build", "-*/bin", "-*.o", "+*"])
+			self.assertEquals(f.filter(["/a.c", "/a.o", "/src/b.c",
+					"/src/build/c.c", "/bin/d", "/src/binary/e"]),
+					["/a.c", "/src/b.c", "/src/binary/e"])
+
+		def testOrder(self):
+			f = Filter(["+/src/keep.o", "-*.o", "+*"])
+			self.assertTrue(f.matches("/src/keep.o"))
+			self.assertFalse(f.matches("/src/other.o"))
+
+		def testNoMatch(self):
+			self.assertFalse(Filter(["+*.java"]).matches("/a.py"))
+			self.assertFalse(Filter().matches("/a.py"))
+
+		def testAddPatternClearsVerdicts(self):
+			f = Filter(["+*.py"])
+			self.assertFalse(f.matches("/a.c"))
+			f.addPattern("+*.c")
+			self.assertTrue(f.matches("/a.c"))
+
+		def testLetThrough(self):
+			f = Filter(["+/src/*.c"])
+			self.assertTrue(f.letThrough(File("a.c", join("src", "a.c"),
+					"/root/src/a.c", 2)))
+
+		def testShellPattern(self):
+			p = ShellPattern("-*.o")
+			self.assertEquals(p.check("/a.o"), Pattern.ABORT)
+			self.assertEquals(p.check("/a.c"), Pattern.CONTINUE)
+			self.assertEquals(ShellPattern("+*.c").check("/a.c"), Pattern.MATCH)
+			self.assertRaises(ValueError, ShellPattern, "*.c")
+
+	class TestSubtreeCounts(unittest.TestCase):
+		def setUp(self):
+			self.main = Group("main", 2, File("a.c", "a.c", "/a.c", 3),
+					File("a.h", "a.h", "/a.h", 3))
+			self.doc = Group("doc", 1, File("r.txt", "r.txt", "/r.txt", 2))
+			self.src = Group("src", 1, self.main, File("b.c", "b.c", "/b.c", 2))
+			self.root = Group("root", 0, self.src, self.doc)
+			self.index = FileIndex(self.root)
+			self.counts = SubtreeCounts(Filter(["+*.c"]), self.index)
+
+		def testCount(self):
+			self.assertEquals([self.counts.count(g) for g in
+					(self.root, self.src, self.main, self.doc)], [2, 2, 1, 0])
+
+		def testPatch(self):
+			self.main.remove(self.main.getByTitle("a.c"))
+			self.index.patch(self.main)
+			self.doc.add(File("d.c", "d.c", "/d.c", 2))
+			self.index.patch(self.doc)
+			self.assertEquals([self.counts.count(g) for g in
+					(self.root, self.src, self.main, self.doc)], [2, 1, 0, 1])
+
+		def testClose(self):
+			self.counts.close()
+			self.doc.add(File("d.c", "d.c", "/d.c", 2))
+			self.index.patch(self.doc)
+			self.assertEquals(self.counts.count(self.doc), 0)
+			self.assertEquals(self.index._listeners, [])
+
+		def testLazy(self):
+			lazy = LazyGroup("lazy", 1,
+					lambda g: g.add(File("x.h", "x.h", "/x.h", 2)))
+			self.root.add(lazy)
+			self.index.patch(self.root)
+			self.assertEquals(self.counts.count(lazy), 1)
+			self.assertEquals(self.counts.count(self.root), 3)
+			lazy.load()
+			self.assertEquals(self.counts.count(lazy), 0)
+			self.assertEquals(self.counts.count(self.root), 2)
+
+	unittest.main()
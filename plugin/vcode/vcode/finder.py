@@ -0,0 +1,235 @@
+"""
+Fuzzy file finder.
+
+A query matches a file if the characters of the query occur in order in the
+path of the file relative to the project root, so "hlcpp" matches
+"src/main/cpp/hello.cpp". Matches are ranked in tiers:
+
+	0. The query is a substring of the filename.
+	1. The characters of the query occur in order in the filename.
+	2. The query is a substring of the path.
+	3. The characters of the query occur in order in the path.
+
+and by path length within each tier.
+
+Files are numbered by path length, and the index keeps a bitset (a python
+long) for each character telling which files contain it. The files containing
+every character in a query are found by and-ing the bitsets. The candidates
+are then checked in order of path length, in batches, by running a regex over
+their joined paths. When a query matches a very large number of files, only
+the shortest L{PathIndex.RANK_LIMIT} matches are ranked.
+
+When a query extends the previous query, and every match of the previous
+query was found, only those matches are checked.
+
+The index is rebuilt the first time it is searched after the FileIndex has
+changed. Files below lazy groups which are not loaded are not in the
+FileIndex, and can not be found.
+"""
+import re
+from os import sep
+
+from file_memorymodel import File
+from common import ENCODING
+
+
+ONE_BIT = re.compile("1")
+MARKER = "\x01"
+
+
+def _seq(query, exclude=""):
+	""" Regex matching the characters in query in order. Each character is
+	preceded by a class excluding it, which makes the regex match in linear
+	time. """
+	return "".join(["[^%s%s\n]*%s" % (re.escape(c), exclude, re.escape(c))
+			for c in query])
+
+def _charBitsets(paths):
+	""" Create a bitset for each character in *paths*, with bit i set if
+	paths[i] contains the character.
+
+	Done without looping over each path: every path is prefixed with a marker,
+	everything except the markers and the character is deleted, and each
+	marker followed by the character is replaced by 1.
+	@return: dict mapping character to bitset.
+	"""
+	marked = MARKER + MARKER.join(paths)
+	allChars = [chr(i) for i in xrange(256)]
+	bitsets = {}
+	for c in set(marked) - set(MARKER):
+		deleteChars = "".join([x for x in allChars if x != c and x != MARKER])
+		kept = marked.translate(None, deleteChars)
+		bits = re.sub(MARKER + re.escape(c) + "+", "1", kept).replace(MARKER, "0")
+		bitsets[c] = long(bits[::-1], 2)
+	return bitsets
+
+def _iterBits(bitset):
+	""" Iterate over the set bits in *bitset*, lowest first. """
+	for m in ONE_BIT.finditer(bin(bitset)[:1:-1]):
+		yield m.start()
+
+
+class PathIndex(object):
+	""" Fuzzy search in the paths of the files in a
+	L{file_memorymodel.FileIndex}. """
+	LINE_PREFIX = r"^(\d+)\t"
+	BASENAME_PREFIX = r"(?:[^\n]*/)?"
+
+	# Number of candidates checked at a time.
+	BATCH_SIZE = 1000
+
+	# Stop looking for matches when this many has been found.
+	RANK_LIMIT = 1000
+
+	def __init__(self, fileindex):
+		self._fileindex = fileindex
+		self._generation = None
+
+	def _build(self):
+		files = {}
+		for item in self._fileindex:
+			if not isinstance(item, File) or item.absPath in files:
+				continue
+			path = item.relPath.replace(sep, "/").lower()
+			if isinstance(path, unicode):
+				path = path.encode(ENCODING)
+			files[item.absPath] = (len(path), intern(path), item)
+		files = files.values()
+		files.sort()
+
+		self._items = [item for length, path, item in files]
+		self._lines = ["%d\t%s" % (i, f[1]) for i, f in enumerate(files)]
+		self._charBits = _charBitsets([path for length, path, item in files])
+		self._allBits = (1L << len(files)) - 1
+
+		self._generation = self._fileindex.generation
+		self._prevQuery = None
+		self._prevMatches = None
+
+	def _ensureBuilt(self):
+		if self._generation != self._fileindex.generation:
+			self._build()
+
+	def _iterCandidates(self, query):
+		if self._prevMatches is not None and query.startswith(self._prevQuery):
+			return iter(self._prevMatches)
+		bits = self._allBits
+		for c in set(query):
+			bits &= self._charBits.get(c, 0)
+		return _iterBits(bits)
+
+	def _match(self, regex, text):
+		""" Find the lines in *text* matching *regex*.
+		@return: (list of ids, text containing the matching lines) """
+		patt = re.compile(self.LINE_PREFIX + regex + "[^\n]*", re.M)
+		ids = []
+		lines = []
+		for m in patt.finditer(text):
+			ids.append(int(m.group(1)))
+			lines.append(m.group(0))
+		return ids, "\n".join(lines)
+
+	def _findMatches(self, query):
+		""" Find the files where the characters of *query* occur in order.
+		@return: (ids, complete). *complete* is False if the search stopped at
+			L{RANK_LIMIT} matches.
+		"""
+		candidates = self._iterCandidates(query)
+		patt = re.compile(self.LINE_PREFIX + _seq(query), re.M)
+		matches = []
+		while len(matches) < self.RANK_LIMIT:
+			batch = [self._lines[i] for i, x in
+					zip(candidates, xrange(self.BATCH_SIZE))]
+			if not batch:
+				return matches, True
+			matches.extend([int(m.group(1))
+					for m in patt.finditer("\n".join(batch))])
+		return matches, False
+
+	def find(self, query, limit=50):
+		""" Find the files matching *query*.
+		@return: Up to *limit* L{file_memorymodel.File}s, best match first.
+		"""
+		query = "".join(query.lower().split())
+		if isinstance(query, unicode):
+			query = query.encode(ENCODING)
+		if not query:
+			return []
+		self._ensureBuilt()
+
+		ids, complete = self._findMatches(query)
+		self._prevQuery = query
+		self._prevMatches = complete and ids or None
+
+		text = "\n".join([self._lines[i] for i in ids])
+		inBasename, basenameText = self._match(
+				self.BASENAME_PREFIX + _seq(query, "/") + "[^/\n]*$", text)
+		substrInBasename = self._match(self.BASENAME_PREFIX + "[^/\n]*" +
+				re.escape(query) + "[^/\n]*$", basenameText)[0]
+		substr = self._match("[^\n]*" + re.escape(query), text)[0]
+
+		# ids are ordered by path length, so each tier is sorted when
+		# created in the order of *ids*.
+		tierOf = dict.fromkeys(ids, 3)
+		for tier, tierIds in ((2, substr), (1, inBasename),
+				(0, substrInBasename)):
+			for i in tierIds:
+				tierOf[i] = tier
+		tiers = ([], [], [], [])
+		for i in ids:
+			tiers[tierOf[i]].append(i)
+
+		result = []
+		for tierIds in tiers:
+			result.extend(tierIds[:limit - len(result)])
+		return [self._items[i] for i in result]
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from os.path import join
+	from file_memorymodel import Group, FileIndex
+
+	class TestPathIndex(unittest.TestCase):
+		def setUp(self):
+			root = Group("root", 0)
+			paths = ["src/main/cpp/hello.cpp", "src/main/cpp/hello.h",
+					"src/test/cpp/testHello.cpp", "doc/help.txt",
+					"src/main/python/hello.py", "hlcpp/readme"]
+			for path in paths:
+				relPath = path.replace("/", sep)
+				root.add(File(path, relPath, join("/root", relPath), 1))
+			self.index = FileIndex(root)
+			self.p = PathIndex(self.index)
+
+		def _find(self, query, limit=50):
+			return [f.title for f in self.p.find(query, limit)]
+
+		def testFind(self):
+			self.assertEquals(self._find("hlcpp"), ["src/main/cpp/hello.cpp",
+					"src/test/cpp/testHello.cpp", "hlcpp/readme"])
+			self.assertEquals(self._find("hlcpp", limit=1),
+					["src/main/cpp/hello.cpp"])
+			self.assertEquals(self._find("HELLO.h"), ["src/main/cpp/hello.h"])
+			self.assertEquals(self._find("xyz"), [])
+			self.assertEquals(self._find(""), [])
+
+		def testIncremental(self):
+			self.assertEquals(len(self._find("hel")), 5)
+			self.assertEquals(self._find("help"), ["doc/help.txt",
+					"src/main/cpp/hello.cpp", "src/main/python/hello.py",
+					"src/test/cpp/testHello.cpp"])
+			self.assertEquals(self._find("hello.py"), ["src/main/python/hello.py"])
+
+		def testRebuildWhenIndexChanges(self):
+			self.assertEquals(self._find("new"), [])
+			root = self.index.root
+			root.add(File("new.c", "new.c", "/root/new.c", 1))
+			self.index.patch(root)
+			self.assertEquals(self._find("new"), ["new.c"])
+
+		def testSpecialChars(self):
+			self.assertEquals(self._find("[]\\"), [])
+
+	unittest.main()
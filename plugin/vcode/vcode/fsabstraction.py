@@ -1,6 +1,18 @@
+"""
+Virtual paths of the files and directories below a root directory.
+
+An L{FsIndex} is a sorted database of virtual paths. The paths are interned
+and kept in a sorted list beside a dict, so lookups are dict lookups, and
+prefix and subtree queries ("everything under /src/main") are two binary
+searches and a slice. Every node links to its parent directory, so walking up
+the tree does not build any strings.
+"""
 import re
-from os import sep, getcwd, walk
-from os.path import abspath, isdir, dirname
+from bisect import bisect_left, insort
+from os import sep, getcwd, listdir
+from os.path import abspath, isdir, islink, dirname, join
+
+from scanner import scandir
 
 
 VIRTPATH_SEP = "/"
@@ -14,6 +26,32 @@ def joinVirtualPath(a, b):
 	""" Just like os.path.join, but for virtual paths. """
 	return normVirtualPath(a + VIRTPATH_SEP + b)
 
+def _intern(path):
+	if isinstance(path, str):
+		return intern(path)
+	return path
+
+def _prefixEnd(prefix):
+	""" Get the smallest string greater than every string starting with
+	*prefix*. """
+	if isinstance(prefix, unicode):
+		return prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+	return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _listDir(absPath):
+	""" List *absPath* like L{scanner.listDir}, without following symlinks to
+	directories.
+	@return: A list of (name, isDir, isLink) tuples.
+	"""
+	if scandir is None:
+		result = []
+		for name in listdir(absPath):
+			p = join(absPath, name)
+			result.append((name, isdir(p), islink(p)))
+		return result
+	return [(entry.name, entry.is_dir(), entry.is_symlink())
+			for entry in scandir(absPath)]
+
 
 class FsNode(object):
 	def __init__(self, absPath, virtualPath):
@@ -30,6 +68,13 @@ class FsNode(object):
 	def getParent(self):
 		return self._parent
 
+	def iterAncestors(self):
+		""" Iterate over the directories above this node, nearest first. """
+		node = self._parent
+		while node is not None:
+			yield node
+			node = node._parent
+
 
 class FsFile(FsNode):
 	pass
@@ -38,44 +83,71 @@ class FsFile(FsNode):
 class FsDir(FsNode):
 	def __init__(self, absPath, virtualPath):
 		super(FsDir, self).__init__(absPath, virtualPath)
+		# Sorted by virtual path.
 		self.childList = []
+		self._childPaths = []
 
 	def addChild(self, childNode):
-		self.childList.append(childNode)
+		i = bisect_left(self._childPaths, childNode._virtPath)
+		self._childPaths.insert(i, childNode._virtPath)
+		self.childList.insert(i, childNode)
+		childNode._parent = self
 
 
 class FsIndex(object):
-
+	""" Sorted database of the virtual paths below *rootDir*. See the module
+	docs. """
 	def __init__(self, rootDir):
-		self._rootDir = rootDir
-		self._nodeLst = []
+		self._rootDir = abspath(rootDir)
+		self._rootPrefix = join(self._rootDir, "")
+		# Sorted list of the virtual path of every node.
+		self._paths = []
 		self._nodeDct = {}
 
+	def __len__(self):
+		return len(self._paths)
+
 	def makeVirtualPath(self, absPath):
 		""" Turn the absolute filesystem-path, *absPath*, into a virtual path
-		relative to this FsIndex. """
-		p = absPath.replace(self._rootDir, "").replace(sep, VIRTPATH_SEP)
-		return p or "/"
+		relative to this FsIndex.
+		@raise ValueError: If *absPath* is not below the root directory. """
+		if absPath == self._rootDir:
+			return "/"
+		if not absPath.startswith(self._rootPrefix):
+			raise ValueError("%s is not below %s." % (absPath, self._rootDir))
+		p = absPath[len(self._rootPrefix)-1:]
+		if sep != VIRTPATH_SEP:
+			p = p.replace(sep, VIRTPATH_SEP)
+		return p
 
 	def absVirtualPath(self, relativeVirtualPath):
 		""" Just like os.path.abspath, but for virtual paths is this FsIndex. """
-		absPath = join(getcwd(), relativeVirtualPath)
-		print absPath
-		return self.makeVirtualPath(absPath)
+		return self.makeVirtualPath(abspath(join(getcwd(),
+				relativeVirtualPath)))
 
-	def _add(self, NodeCls, path):
-		absPath = abspath(path)
-		virtualPath = self.makeVirtualPath(absPath)
+	def _parentPath(self, virtualPath):
+		i = virtualPath.rfind(VIRTPATH_SEP)
+		return i > 0 and virtualPath[:i] or VIRTPATH_SEP
+
+	def _makeNode(self, NodeCls, absPath, virtualPath):
+		""" Create a node, and link it to its parent, without adding it to
+		the sorted paths. """
+		virtualPath = _intern(virtualPath)
 		if virtualPath in self._nodeDct:
 			raise ValueError("%s is already in the FsIndex." % virtualPath)
 		n = NodeCls(absPath, virtualPath)
-		self._nodeLst.append(n)
 		self._nodeDct[virtualPath] = n
+		if virtualPath != VIRTPATH_SEP:
+			parentDir = self._nodeDct.get(self._parentPath(virtualPath))
+			if parentDir is not None:
+				parentDir.addChild(n)
+		return n
 
-		parentVirtPath = self.makeVirtualPath(dirname(absPath))
-		parentDir = self._nodeDct.get(parentVirtPath)
-		if parentVirtPath != virtualPath and parentDir != None:
-			parentDir.addChild(n)
+	def _add(self, NodeCls, path):
+		absPath = abspath(path)
+		n = self._makeNode(NodeCls, absPath, self.makeVirtualPath(absPath))
+		insort(self._paths, n._virtPath)
+		return n
 
 	def add(self, path):
 		if isdir(path):
@@ -87,12 +159,29 @@ class FsIndex(object):
 		self._add(FsDir, path)
 
 	def addDirRecursive(self, path):
-		self.addDir(path)
-		for root, dirs, files in walk(path):
-			for d in dirs:
-				self.addDir(join(root, d))
-			for f in files:
-				self.addFile(join(root, f))
+		""" Add the directory *path*, and everything below it. Directories are
+		listed with scandir when available, which tells files from
+		directories without a stat of each entry. Symlinks to directories are
+		added, but not followed. """
+		absPath = abspath(path)
+		root = self._makeNode(FsDir, absPath, self.makeVirtualPath(absPath))
+		added = [root._virtPath]
+		stack = [root]
+		while stack:
+			d = stack.pop()
+			dirPath = d._absPath
+			virtDir = d._virtPath
+			if virtDir == VIRTPATH_SEP:
+				virtDir = ""
+			for name, isDir, isLink in _listDir(dirPath):
+				cls = isDir and FsDir or FsFile
+				n = self._makeNode(cls, join(dirPath, name),
+						virtDir + VIRTPATH_SEP + name)
+				added.append(n._virtPath)
+				if isDir and not isLink:
+					stack.append(n)
+		self._paths.extend(added)
+		self._paths.sort()
 
 	def addFile(self, path):
 		self._add(FsFile, path)
@@ -103,6 +192,25 @@ class FsIndex(object):
 	def getByVirtualPath(self, virtualPath):
 		return self._nodeDct[virtualPath]
 
+	def getRange(self, start, end):
+		""" Get the virtual paths from *start* up to, but not including,
+		*end*, in sorted order. """
+		return self._paths[bisect_left(self._paths, start):
+				bisect_left(self._paths, end)]
+
+	def getByPrefix(self, prefix):
+		""" Get the virtual paths starting with the string *prefix*, in
+		sorted order. """
+		if not prefix:
+			return list(self._paths)
+		return self.getRange(prefix, _prefixEnd(prefix))
+
+	def getSubtree(self, virtualPath):
+		""" Get the nodes below the directory *virtualPath*, not including
+		the directory itself, sorted by virtual path. """
+		prefix = virtualPath.rstrip(VIRTPATH_SEP) + VIRTPATH_SEP
+		return [self._nodeDct[p] for p in self.getByPrefix(prefix)]
+
 
 
 
@@ -110,8 +218,8 @@ if __name__ == "__main__":
 	import unittest
 	from shutil import rmtree
 	from tempfile import mkdtemp
-	from os.path import join
-	from os import chdir
+	from os.path import basename
+	from os import chdir, makedirs
 
 	class TestFsIndex(unittest.TestCase):
 		def setUp(self):
@@ -138,9 +246,43 @@ if __name__ == "__main__":
 			self.assertEquals(self.i.makeVirtualPath(self.fileA), "/test.txt")
 			self.assertEquals(self.i.makeVirtualPath(self.rootDir), "/")
 
-		def testMakeVirtualPath(self):
+		def testMakeVirtualPathOutsideRoot(self):
+			self.assertRaises(ValueError, self.i.makeVirtualPath,
+					self.rootDir + "x")
+			self.assertEquals(self.i.makeVirtualPath(join(self.rootDir, "a",
+					basename(self.rootDir))), "/a/" + basename(self.rootDir))
+
+		def testAbsVirtualPath(self):
 			self.assertEquals(self.i.absVirtualPath("test.txt"), "/test.txt")
 
+		def testQueries(self):
+			for d in ("src/main/java", "src/mainx", "src/test"):
+				makedirs(join(self.rootDir, d))
+			for f in ("src/main/a.py", "src/main/java/B.java", "src/mainx/c.py",
+					"src/test/d.py"):
+				open(join(self.rootDir, f), "w").close()
+			self.i.addDirRecursive(self.rootDir)
+			self.assertEquals(len(self.i), 11)
+			self.assertEquals([n.getVirtualPath()
+					for n in self.i.getSubtree("/src/main")],
+					["/src/main/a.py", "/src/main/java", "/src/main/java/B.java"])
+			self.assertEquals(self.i.getByPrefix("/src/main"), ["/src/main",
+					"/src/main/a.py", "/src/main/java", "/src/main/java/B.java",
+					"/src/mainx", "/src/mainx/c.py"])
+			self.assertEquals(self.i.getRange("/src/mainx", "/src/test"),
+					["/src/mainx", "/src/mainx/c.py"])
+			b = self.i.getByVirtualPath("/src/main/java/B.java")
+			self.assertEquals([d.getVirtualPath() for d in b.iterAncestors()],
+					["/src/main/java", "/src/main", "/src", "/"])
+			self.assertEquals([n.getVirtualPath() for n in
+					self.i.getByVirtualPath("/src").childList],
+					["/src/main", "/src/mainx", "/src/test"])
+			self.i.addFile(join(self.rootDir, "src", "main", "0.py"))
+			self.assertEquals(self.i.getSubtree("/src/main")[0].getVirtualPath(),
+					"/src/main/0.py")
+			self.assertRaises(ValueError, self.i.addDir,
+					join(self.rootDir, "src"))
+
 	class TestModuleFunction(unittest.TestCase):
 		def testNormVirtualPath(self):
 			self.assertEquals(normVirtualPath("//hello/world///"),
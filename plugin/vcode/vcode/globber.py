@@ -0,0 +1,187 @@
+"""
+Glob patterns evaluated against directory listings.
+
+A L{Globber} matches the patterns of <filesearch>-tags against the listings
+of a L{scanner.DirScanner}, usually backed by a L{scanner.ListingCache}, and
+remembers every listing it has used. Overlapping patterns, like src/*.c and
+src/**/*.h, therefore list each directory once, and nothing depends on the
+working directory of the process.
+
+Patterns are relative to the root directory of the scanner, and use / as
+separator. Each part is a name, a shell pattern (see the fnmatch module), or
+**, which matches any number of directories, including none. Like
+glob.glob, wildcards do not match names starting with a dot unless the
+pattern starts with a dot, and ** does not descend into hidden directories.
+Patterns are compiled once, and shared by all globbers.
+"""
+import re
+import fnmatch
+from os.path import join
+
+
+PATTERN_SEP = "/"
+MAGIC_PATT = re.compile("[*?[]")
+
+# Kinds of pattern parts.
+NAME, WILDCARD, RECURSIVE = range(3)
+
+# Compiled patterns, by pattern.
+_compiled = {}
+
+
+def compileGlob(pattern):
+	""" Compile *pattern*.
+	@return: A list of (kind, value) for each part of the pattern. *value* is
+		the name for NAME, (compiled regex, matchesHidden) for WILDCARD, and
+		None for RECURSIVE.
+	"""
+	parts = _compiled.get(pattern)
+	if parts is None:
+		parts = []
+		for part in pattern.split(PATTERN_SEP):
+			if not part or part == ".":
+				continue
+			if part == "**":
+				if parts and parts[-1][0] == RECURSIVE:
+					continue
+				parts.append((RECURSIVE, None))
+			elif MAGIC_PATT.search(part):
+				parts.append((WILDCARD, (re.compile(fnmatch.translate(part)),
+						part.startswith("."))))
+			else:
+				parts.append((NAME, part))
+		_compiled[pattern] = parts
+	return parts
+
+
+class Globber(object):
+	""" Evaluates glob patterns against directory listings. See the module
+	docs. """
+	def __init__(self, listDir):
+		"""
+		@param listDir: Called as listDir(relPath) to list the directory
+			*relPath*, like L{scanner.DirScanner.listDir}.
+		"""
+		self._listDir = listDir
+		# (entries sorted by name, dict mapping name to isDir), by relPath.
+		self._listings = {}
+
+	def _list(self, relPath):
+		listing = self._listings.get(relPath)
+		if listing is None:
+			try:
+				entries = sorted(self._listDir(relPath))
+			except OSError:
+				entries = []
+			listing = self._listings[relPath] = (entries, dict(entries))
+		return listing
+
+	def _walk(self, relPath):
+		""" Generate (relPath, isDir) for every entry below the directory
+		*relPath*, skipping hidden entries. """
+		for name, isDir in self._list(relPath)[0]:
+			if name.startswith("."):
+				continue
+			p = join(relPath, name)
+			yield p, isDir
+			if isDir:
+				for found in self._walk(p):
+					yield found
+
+	def _match(self, dirs, kind, value, last):
+		""" Match one part of a pattern against the entries of *dirs*.
+		@return: A list of (relPath, isDir). Only directories, unless *last*.
+		"""
+		matches = []
+		for d in dirs:
+			if kind == NAME:
+				isDir = self._list(d)[1].get(value)
+				if isDir is not None:
+					matches.append((join(d, value), isDir))
+			elif kind == WILDCARD:
+				regex, hidden = value
+				for name, isDir in self._list(d)[0]:
+					if (hidden or not name.startswith(".")) \
+							and regex.match(name):
+						matches.append((join(d, name), isDir))
+			else:
+				if not last:
+					matches.append((d, True))
+				matches.extend(self._walk(d))
+		if last:
+			return matches
+		return [(p, isDir) for p, isDir in matches if isDir]
+
+	def glob(self, pattern):
+		""" Find the files and directories matching *pattern*.
+		@return: A list of (relPath, isDir), in the order of the pattern
+			parts, and by name within each directory. Each path is only
+			included once.
+		"""
+		parts = compileGlob(pattern)
+		if not parts:
+			return []
+		matches = [("", True)]
+		for i, (kind, value) in enumerate(parts):
+			last = i == len(parts) - 1
+			matches = self._match([p for p, isDir in matches], kind, value,
+					last)
+		seen = set()
+		result = []
+		for p, isDir in matches:
+			if not p in seen:
+				seen.add(p)
+				result.append((p, isDir))
+		return result
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from os import sep
+
+	TREE = {
+		"": [("README", False), ("src", True), (".git", True)],
+		"src": [("a.c", False), ("a.h", False), ("sub", True),
+				(".hidden.c", False)],
+		join("src", "sub"): [("b.c", False), ("deep", True)],
+		join("src", "sub", "deep"): [("c.c", False)],
+		".git": [("config", False)],
+	}
+
+	class TestGlobber(unittest.TestCase):
+		def setUp(self):
+			self.listed = []
+			def listDir(relPath):
+				self.listed.append(relPath)
+				if not relPath in TREE:
+					raise OSError(relPath)
+				return TREE[relPath]
+			self.g = Globber(listDir)
+
+		def _glob(self, pattern):
+			return [p.replace(sep, "/") for p, isDir in self.g.glob(pattern)]
+
+		def testWildcards(self):
+			self.assertEquals(self._glob("src/*.c"), ["src/a.c"])
+			self.assertEquals(self._glob("src/.*"), ["src/.hidden.c"])
+			self.assertEquals(self._glob("*/?.[ch]"), ["src/a.c", "src/a.h"])
+			self.assertEquals(self._glob("src/sub/b.c"), ["src/sub/b.c"])
+			self.assertEquals(self._glob("src/missing/*.c"), [])
+
+		def testRecursive(self):
+			self.assertEquals(self._glob("**/*.c"),
+					["src/a.c", "src/sub/b.c", "src/sub/deep/c.c"])
+			self.assertEquals(self._glob("src/**/**/deep"), ["src/sub/deep"])
+			self.assertEquals(self._glob("src/sub/**"),
+					["src/sub/b.c", "src/sub/deep", "src/sub/deep/c.c"])
+
+		def testListedOnce(self):
+			self._glob("src/*.c")
+			self._glob("**/*.h")
+			self._glob("src/sub/*")
+			self.assertEquals(sorted(self.listed), ["", "src",
+					join("src", "sub"), join("src", "sub", "deep")])
+			self.assertTrue(compileGlob("**/*.h") is compileGlob("**/*.h"))
+
+	unittest.main()
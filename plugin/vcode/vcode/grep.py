@@ -0,0 +1,265 @@
+"""
+Content search without an index.
+
+A L{ParallelGrep} searches a set of files with a pool of processes (see
+L{procpool}), or of threads, and needs no setup, unlike the
+L{search.TrigramIndex}. The files are split into
+batches, and each batch is searched by one process. Files are read through
+mmap, and files with a NUL byte in their first bytes are skipped as binary
+before they are mapped.
+
+The results of each batch are queued as soon as the batch is done, and
+L{ParallelGrep.poll}, called from vim's main thread, returns them as they
+arrive. The search runs until every file has been searched, or until
+L{ParallelGrep.cancel} is called.
+
+The directories of L{file_memorymodel.LazyGroup}s which have not been loaded
+are searched too. They are walked in the background with the exclude pattern
+of their <dir>-tag (see L{scanner.getDirBindings}), so excluded files are
+never searched.
+"""
+import re
+import mmap
+from os import fstat, sep
+from os.path import join
+from threading import Thread
+from Queue import Queue, Empty
+from multiprocessing.pool import ThreadPool
+
+from procpool import ProcessPool
+from scanner import listDir
+from search import BINARY_CHECK_SIZE, isBinary, searchText
+
+
+def grepFile(regex, absPath):
+	""" Search the file *absPath* with the compiled *regex*.
+	@return: A list of (lineNr, line) for each line with a match. Binary,
+		empty and unreadable files have no matches. """
+	try:
+		f = open(absPath, "rb")
+	except IOError:
+		return []
+	try:
+		try:
+			if isBinary(f.read(BINARY_CHECK_SIZE)):
+				return []
+			if fstat(f.fileno()).st_size == 0:
+				return []
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except (IOError, OSError, ValueError, mmap.error):
+			return []
+		try:
+			return list(searchText(regex, data))
+		finally:
+			data.close()
+	finally:
+		f.close()
+
+def grepBatch(args):
+	""" Search a batch of files. Run in the processes of the pool.
+	@param args: (paths, pattern, flags)
+	@return: A list of (absPath, lineNr, line). """
+	paths, pattern, flags = args
+	regex = re.compile(pattern, flags)
+	results = []
+	for path in paths:
+		for lineNr, line in grepFile(regex, path):
+			results.append((path, lineNr, line))
+	return results
+
+def walkDir(rootDir, relPath, excludePatt=None):
+	""" Find the files below the directory *relPath*, skipping files and
+	directories matching *excludePatt*, like L{scanner.DirScanner.scanInto}.
+	@return: A generator yielding the relative path of each file. """
+	stack = [relPath]
+	while stack:
+		path = stack.pop()
+		try:
+			entries = listDir(path and join(rootDir, path) or rootDir)
+		except OSError:
+			continue
+		for name, isDir in entries:
+			p = join(path, name)
+			if excludePatt is not None and excludePatt.match(p):
+				continue
+			if isDir:
+				stack.append(p)
+			else:
+				yield p
+
+
+class ParallelGrep(object):
+	""" Searches files in a pool of processes or threads. See the module
+	docs. """
+
+	# Number of files searched by each task in the pool.
+	BATCH_SIZE = 64
+
+	def __init__(self, pattern, flags, paths, rootDir=None, dirs=(),
+			filter=None, workers=None, python=None):
+		"""
+		@param pattern: The regex to search for. See L{search.queryPattern}.
+		@param paths: Absolute paths of the files to search.
+		@param dirs: (relPath, excludePatt) of directories to search, relative
+			to *rootDir*. Only the files accepted by *filter* are searched.
+		@param filter: A L{filter.Filter}, or None to search every file in
+			*dirs*.
+		@param workers: Number of processes. Defaults to the number of cpus.
+		@param python: Search in processes run by this python interpreter. If
+			None, the files are searched in threads, since forking vim is not
+			safe. See L{procpool}.
+		"""
+		self._args = (pattern, flags)
+		self._paths = paths
+		self._rootDir = rootDir
+		self._dirs = dirs
+		self._filter = filter
+		self._workers = workers
+		self._python = python
+		self._results = Queue()
+		self._cancelled = False
+		self._thread = None
+		self.done = False
+		self.fileCount = 0
+
+	def start(self):
+		self._thread = Thread(target=self._run, name="vcode-grep")
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def _batches(self):
+		""" Generate the tasks of the pool. Run in a thread of the pool. """
+		batch = []
+		for path in self._iterPaths():
+			if self._cancelled:
+				return
+			batch.append(path)
+			if len(batch) == self.BATCH_SIZE:
+				self.fileCount += len(batch)
+				yield (batch,) + self._args
+				batch = []
+		if batch:
+			self.fileCount += len(batch)
+			yield (batch,) + self._args
+
+	def _iterPaths(self):
+		for path in self._paths:
+			yield path
+		for relPath, excludePatt in self._dirs:
+			for p in walkDir(self._rootDir, relPath, excludePatt):
+				if self._filter is None \
+						or self._filter.matches("/" + p.replace(sep, "/")):
+					yield join(self._rootDir, p)
+
+	def _run(self):
+		if self._python:
+			pool = ProcessPool(self._python, self._workers)
+		else:
+			pool = ThreadPool(self._workers)
+		try:
+			for results in pool.imap_unordered(grepBatch, self._batches()):
+				if self._cancelled:
+					break
+				self._results.put(results)
+		finally:
+			pool.terminate()
+			pool.join()
+			self._results.put(None)
+
+	def cancel(self):
+		""" Stop the search. Batches being searched are finished, but their
+		results are dropped. """
+		self._cancelled = True
+
+	def poll(self):
+		""" Get the results found since the last call, without blocking.
+		L{done} is set when the search is complete.
+		@return: A list of (absPath, lineNr, line).
+		"""
+		found = []
+		while not self._cancelled:
+			try:
+				results = self._results.get_nowait()
+			except Empty:
+				break
+			if results is None:
+				self.done = True
+				break
+			found.extend(results)
+		return found
+
+
+
+if __name__ == "__main__":
+	import unittest
+	import sys
+	import time
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import makedirs
+	from filter import Filter
+	from search import queryPattern
+
+	class TestParallelGrep(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			makedirs(join(self.rootDir, "src", "build"))
+			makedirs(join(self.rootDir, "lazy", "build"))
+			for relPath, content in (("src/a.py", "x = 1\nhello = 2\n"),
+					("src/b.bin", "hello\0"),
+					("src/empty.py", ""),
+					("src/build/c.py", "hello"),
+					("lazy/d.py", "\n\nprint hello"),
+					("lazy/d.txt", "hello"),
+					("lazy/build/e.py", "hello")):
+				open(join(self.rootDir, relPath), "wb").write(content)
+
+		def tearDown(self):
+			rmtree(self.rootDir)
+
+		def _grep(self, query, paths, **kw):
+			pattern, flags = queryPattern(query)
+			kw.setdefault("python", sys.executable)
+			grep = ParallelGrep(pattern, flags, paths, self.rootDir,
+					workers=2, **kw)
+			grep.start()
+			results = []
+			timeout = time.time() + 10
+			while not grep.done:
+				self.assertTrue(time.time() < timeout)
+				time.sleep(0.01)
+				results.extend(grep.poll())
+			return sorted([(path[len(self.rootDir)+1:], lineNr, line)
+					for path, lineNr, line in results])
+
+		def testPaths(self):
+			paths = [join(self.rootDir, "src", name)
+					for name in ("a.py", "b.bin", "empty.py", "missing.py")]
+			self.assertEquals(self._grep("hello", paths),
+					[("src/a.py", 2, "hello = 2")])
+
+		def testDirs(self):
+			exclude = re.compile(".*build$")
+			self.assertEquals(self._grep("hello", [],
+					dirs=[("lazy", exclude), ("src", exclude)],
+					filter=Filter(["+*.py"])),
+					[("lazy/d.py", 3, "print hello"),
+					("src/a.py", 2, "hello = 2")])
+
+		def testBatches(self):
+			paths = [join(self.rootDir, "src", "a.py")] * 200
+			self.assertEquals(len(self._grep("x", paths)), 200)
+
+		def testThreads(self):
+			paths = [join(self.rootDir, "src", "a.py")] * 200
+			self.assertEquals(len(self._grep("x", paths, python=None)), 200)
+
+		def testCancel(self):
+			grep = ParallelGrep("x", 0,
+					[join(self.rootDir, "src", "a.py")] * 1000, workers=1)
+			grep.start()
+			grep.cancel()
+			grep._thread.join()
+			self.assertEquals(grep.poll(), [])
+
+	unittest.main()
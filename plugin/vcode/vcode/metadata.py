@@ -0,0 +1,237 @@
+"""
+File metadata shown in the project browser.
+
+A L{MetadataService} stats files in a thread pool, in batches, and keeps the
+results in a cache. The browser asks for the files it displays with
+L{MetadataService.request}, which decorates them from the cache right away
+and queues a stat of each file in the background. L{MetadataService.poll},
+called from vim's main thread, applies the results and reports the files
+whose decoration changed. Displaying files therefore never waits for the
+filesystem, which matters on network mounts.
+
+The stat of a file is kept as an (inode, mtime, size) key. Content hashes are
+only computed when asked for with L{MetadataService.contentHash}, and are
+cached until the key of the file changes.
+"""
+from os import stat
+from time import localtime, strftime
+from hashlib import md5
+from Queue import Queue, Empty
+from multiprocessing.pool import ThreadPool
+
+from file_memorymodel import File
+
+
+# The key of the decoration in File.extraInfo.
+EXTRA_INFO_KEY = "stat"
+
+
+def statKey(absPath):
+	""" Stat *absPath*.
+	@return: (inode, mtime, size), or None if the file does not exist. """
+	try:
+		st = stat(absPath)
+	except OSError:
+		return None
+	return (st.st_ino, st.st_mtime, st.st_size)
+
+def _statBatch(paths):
+	return [(path, statKey(path)) for path in paths]
+
+def formatSize(size):
+	""" Format *size* in bytes with at most 3 digits, like 12K. """
+	for unit in ("B", "K", "M", "G"):
+		if size < 1000 or unit == "G":
+			break
+		size /= 1024.0
+	if unit == "B" or size >= 10:
+		return "%d%s" % (size, unit)
+	return "%.1f%s" % (size, unit)
+
+def formatStatKey(key):
+	inode, mtime, size = key
+	return "[%s %s]" % (formatSize(size),
+			strftime("%Y-%m-%d %H:%M", localtime(mtime)))
+
+
+class MetadataService(object):
+	""" Background stat of files, and decoration of their extraInfo. """
+
+	# Number of files stat'ed by each task in the pool.
+	BATCH_SIZE = 200
+
+	def __init__(self, workers=None):
+		"""
+		@param workers: Number of threads stat'ing files. Defaults to the
+			number of cpus.
+		"""
+		self._workers = workers
+		self._pool = None
+		self._stats = {}
+		self._hashes = {}
+		# The files to decorate, by absolute path.
+		self._files = {}
+		self._results = Queue()
+
+	def close(self):
+		if self._pool is not None:
+			self._pool.close()
+			self._pool.join()
+			self._pool = None
+
+	def getStat(self, absPath):
+		""" Get the cached (inode, mtime, size) of *absPath*.
+		@return: The key, or None if the file has not been stat'ed or does not
+			exist. """
+		return self._stats.get(absPath)
+
+	def request(self, items):
+		""" Decorate the files in *items* from the cache, and stat them in the
+		background. Files whose decoration changes are returned by L{poll}.
+		"""
+		paths = []
+		for item in items:
+			if not isinstance(item, File):
+				continue
+			path = item.absPath
+			self._files.setdefault(path, set()).add(item)
+			self._decorate(item, self._stats.get(path))
+			paths.append(path)
+		if not paths:
+			return
+		if self._pool is None:
+			self._pool = ThreadPool(self._workers)
+		for i in xrange(0, len(paths), self.BATCH_SIZE):
+			self._pool.apply_async(_statBatch, (paths[i:i+self.BATCH_SIZE],),
+					callback=self._results.put)
+
+	def forget(self, items):
+		""" Stop decorating the files in *items*, like files removed from
+		the project. """
+		for item in items:
+			if isinstance(item, File):
+				files = self._files.get(item.absPath)
+				if files:
+					files.discard(item)
+					if not files:
+						del self._files[item.absPath]
+
+	def poll(self):
+		""" Apply the stat results received since the last call. Never blocks.
+		@return: The files whose decoration changed.
+		"""
+		changed = []
+		while True:
+			try:
+				results = self._results.get_nowait()
+			except Empty:
+				return changed
+			for path, key in results:
+				if key == self._stats.get(path, False):
+					continue
+				if key is None:
+					self._stats.pop(path, None)
+				else:
+					self._stats[path] = key
+				for item in self._files.get(path, ()):
+					if self._decorate(item, key):
+						changed.append(item)
+
+	def _decorate(self, item, key):
+		""" Set the decoration of *item*.
+		@return: True if the decoration changed. """
+		old = item.extraInfo.get(EXTRA_INFO_KEY)
+		if key is None:
+			item.extraInfo.pop(EXTRA_INFO_KEY, None)
+			return old is not None
+		new = formatStatKey(key)
+		item.extraInfo[EXTRA_INFO_KEY] = new
+		return old != new
+
+	def contentHash(self, item):
+		""" Get the md5 hex digest of the content of the file *item*.
+		Computed when first asked for, and cached until the inode, mtime or
+		size of the file changes.
+		@raise IOError: If the file can not be read.
+		"""
+		path = item.absPath
+		key = statKey(path)
+		if key is not None:
+			self._stats[path] = key
+		cached = self._hashes.get(path)
+		if cached and cached[0] == key:
+			return cached[1]
+		h = md5()
+		f = open(path, "rb")
+		try:
+			while True:
+				data = f.read(65536)
+				if not data:
+					break
+				h.update(data)
+		finally:
+			f.close()
+		digest = h.hexdigest()
+		self._hashes[path] = (key, digest)
+		return digest
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import utime, remove
+	from os.path import join
+
+	class TestMetadataService(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			self.files = []
+			for name in ("a.c", "b.c"):
+				absPath = join(self.rootDir, name)
+				open(absPath, "w").write(name)
+				utime(absPath, (1000, 1000))
+				self.files.append(File(name, name, absPath, 1))
+			self.m = MetadataService(workers=2)
+
+		def tearDown(self):
+			self.m.close()
+			rmtree(self.rootDir)
+
+		def _poll(self):
+			self.m.close() # wait for the pool to finish
+			return self.m.poll()
+
+		def testRequest(self):
+			self.m.request(self.files)
+			self.assertEquals(self.files[0].extraInfo, {})
+			self.assertEquals(sorted(self._poll()), sorted(self.files))
+			self.assertEquals(self.files[0].extraInfo[EXTRA_INFO_KEY],
+					formatStatKey((0, 1000, 3)))
+			self.assertEquals(self.m.getStat(self.files[0].absPath)[1:],
+					(1000, 3))
+
+			# Decorated from the cache, unchanged stats are not reported.
+			copy = File("a.c", "a.c", self.files[0].absPath, 1)
+			self.m.request([copy, self.files[1]])
+			self.assertTrue(EXTRA_INFO_KEY in copy.extraInfo)
+			self.assertEquals(self._poll(), [])
+
+			remove(self.files[1].absPath)
+			self.m.request([self.files[1]])
+			self.assertEquals(self._poll(), [self.files[1]])
+			self.assertEquals(self.files[1].extraInfo, {})
+
+		def testContentHash(self):
+			a = self.files[0]
+			self.assertEquals(self.m.contentHash(a), md5("a.c").hexdigest())
+			open(a.absPath, "w").write("changed")
+			self.assertEquals(self.m.contentHash(a), md5("changed").hexdigest())
+
+		def testFormatSize(self):
+			self.assertEquals([formatSize(s) for s in (0, 999, 1000, 12345,
+					5*1024**3, 5000*1024**3)],
+					["0B", "999B", "1.0K", "12K", "5.0G", "5000G"])
+
+	unittest.main()
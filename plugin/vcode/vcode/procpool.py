@@ -0,0 +1,182 @@
+"""
+A pool of python subprocesses.
+
+multiprocessing.Pool forks the process it is created in. Inside vim, that is
+vim itself, and the threads of vcode (the watcher, the prefetching of the
+scanner, the metadata service) may be holding locks which then stay locked
+forever in the child. A L{ProcessPool} instead runs each worker as a fresh
+interpreter, like L{worker.ProcessIndexWorker} does: the given python,
+running this file.
+
+Tasks and results are sent through the pipes of the workers as marshal
+data, each prefixed with its length, so they must be marshallable.
+"""
+import sys
+import marshal
+import struct
+from os.path import abspath, basename, splitext
+from threading import Thread, Lock
+from Queue import Queue
+from subprocess import Popen, PIPE
+from multiprocessing import cpu_count
+
+
+FRAME_HEADER = struct.Struct("!I")
+
+# Run by the workers of ProcessPool.
+POOL_SCRIPT = splitext(abspath(__file__))[0] + ".py"
+
+_NO_TASK = object()
+
+
+def writeFrame(f, message):
+	""" Write *message* to the file *f* as a length-prefixed marshal frame. """
+	data = marshal.dumps(message, 2)
+	f.write(FRAME_HEADER.pack(len(data)) + data)
+	f.flush()
+
+def readFrames(f):
+	""" Read the frames written by L{writeFrame} to *f* until end of file.
+	@return: A generator yielding each message. """
+	while True:
+		header = f.read(FRAME_HEADER.size)
+		if len(header) < FRAME_HEADER.size:
+			return
+		size, = FRAME_HEADER.unpack(header)
+		data = f.read(size)
+		if len(data) < size:
+			return
+		yield marshal.loads(data)
+
+
+class ProcessPool(object):
+	""" Runs a function on tasks in python subprocesses. Used like
+	multiprocessing.Pool. """
+	def __init__(self, python, workers=None):
+		"""
+		@param python: The python interpreter running the workers. Note that
+			sys.executable is vim itself when running inside vim.
+		@param workers: Number of processes. Defaults to the number of cpus.
+		"""
+		self._python = python
+		self._workers = workers or cpu_count()
+		self._processes = []
+		self._lock = Lock()
+
+	def imap_unordered(self, func, tasks):
+		""" Run func(task) for each of *tasks*. Each worker takes the next
+		task when it is done with the previous one.
+		@param func: A function defined at the top level of a module of vcode.
+		@return: A generator yielding the results in the order they are done.
+		@raise RuntimeError: If a task fails.
+		"""
+		# The name of the module in the directory of vcode, also when it is
+		# run as __main__.
+		module = splitext(basename(sys.modules[func.__module__].__file__))[0]
+		tasks = iter(tasks)
+		results = Queue()
+		for i in xrange(self._workers):
+			process = Popen([self._python, POOL_SCRIPT, "--worker", module,
+					func.__name__], stdin=PIPE, stdout=PIPE,
+					close_fds=sys.platform != "win32")
+			self._processes.append(process)
+			thread = Thread(target=self._feed, args=(process, tasks, results),
+					name="vcode-pool")
+			thread.setDaemon(True)
+			thread.start()
+		running = self._workers
+		while running:
+			kind, payload = results.get()
+			if kind == "result":
+				yield payload
+			elif kind == "error":
+				raise RuntimeError(payload)
+			else:
+				running -= 1
+
+	def _feed(self, process, tasks, results):
+		""" Send the tasks to *process* one by one, and queue the results.
+		Run in a thread for each process. """
+		frames = readFrames(process.stdout)
+		try:
+			while True:
+				self._lock.acquire()
+				try:
+					task = next(tasks, _NO_TASK)
+				finally:
+					self._lock.release()
+				if task is _NO_TASK:
+					break
+				writeFrame(process.stdin, task)
+				message = next(frames, None)
+				if message is None:
+					results.put(("error", "Pool worker exited with %d."
+							% process.wait()))
+					break
+				results.put(message)
+		except Exception, e:
+			results.put(("error", "%s: %s" % (e.__class__.__name__, e)))
+		finally:
+			try:
+				process.stdin.close()
+			except IOError:
+				pass
+			results.put(("exit", None))
+
+	def terminate(self):
+		""" Stop the workers, dropping the tasks they are running. """
+		for process in self._processes:
+			if process.poll() is None:
+				process.kill()
+
+	def join(self):
+		""" Wait for the workers to exit. """
+		for process in self._processes:
+			process.wait()
+			process.stdout.close()
+		self._processes = []
+
+
+def workerMain(module, funcName):
+	""" Entry point of the workers of L{ProcessPool}. """
+	func = getattr(__import__(module), funcName)
+	out = sys.stdout
+	# Anything printed by the tasks must not end up in the frames.
+	sys.stdout = sys.stderr
+	for task in readFrames(sys.stdin):
+		try:
+			message = ("result", func(task))
+		except Exception, e:
+			message = ("error", "%s: %s" % (e.__class__.__name__, e))
+		writeFrame(out, message)
+
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["--worker"]:
+	workerMain(*sys.argv[2:4])
+
+elif __name__ == "__main__":
+	import unittest
+
+	class TestProcessPool(unittest.TestCase):
+		def testResults(self):
+			pool = ProcessPool(sys.executable, workers=2)
+			try:
+				results = pool.imap_unordered(basename,
+						["/a/%d" % i for i in xrange(50)])
+				self.assertEquals(sorted(results, key=int),
+						[str(i) for i in xrange(50)])
+			finally:
+				pool.terminate()
+				pool.join()
+
+		def testError(self):
+			pool = ProcessPool(sys.executable, workers=1)
+			try:
+				self.assertRaises(RuntimeError, list,
+						pool.imap_unordered(basename, [5]))
+			finally:
+				pool.terminate()
+				pool.join()
+
+	unittest.main()
@@ -1,13 +1,29 @@
-from os.path import dirname, abspath, basename, join
+from os.path import dirname, abspath, basename, join, relpath
 import logging
 import logging.handlers
 import sys
 import vim
 import fnmatch
-from util import goToWindowByBufName
-
-from file_memorymodel import FileIndex, Group
-from settings_parser import SettingsParser
+import re
+from util import goToWindowByBufName, searchResults, replaceLines
+from vimbridge import CommandBatch, execute, windows
+
+from file_memorymodel import FileIndex, File, Group, LazyGroup
+from scanner import getDirBindings, ListingCache
+from settings_parser import SettingsParser, parseFilters, parseViews
+from watcher import TreeWatcher
+from finder import PathIndex
+from rowindex import VisibleRows
+from filter import SubtreeCounts
+from compact import CompactTree
+from worker import IndexWorker, ProcessIndexWorker
+from metadata import MetadataService
+from vcs import GitStatus
+from search import TrigramIndex, SEARCH_INDEX_FILENAME, queryPattern
+from grep import ParallelGrep
+from symbols import SymbolIndex, SYMBOLS_FILENAME
+from alternates import AlternateFiles
+from views import ViewEngine
 from common import ENCODING
 
 
@@ -17,17 +33,6 @@ from common import ENCODING
 ##############################################################
 
 
-class ProjectBrowserFilter(object):
-	def __init__(self, fnpatt=["*"]):
-		self.fnpatt = fnpatt
-
-	def letThrough(self, f):
-		for patt in self.fnpatt:
-			if fnmatch.fnmatch(f.absPath, patt):
-				return True
-		return False
-
-
 class ProjectBrowser(object):
 	STDHEADER = [
 			"\" ? for help",
@@ -35,39 +40,79 @@ class ProjectBrowser(object):
 
 	BUFNAME = "VCodeProjectExplorer"
 
-	def __init__(self, index):
+	def __init__(self, index, rootDir=None):
+		"""
+		@param rootDir: Root directory of the project. Used to find files
+			below lazy groups which are not loaded. See also L{setRootDir}.
+		"""
 		self._fileindex = index
+		self._rootDir = rootDir
+		# The root directories of the projects below groups, by group.
+		self._rootDirs = {}
+		self._rows = VisibleRows(index)
 		self._curFilter = None
+		self._curCounts = None
+		# SubtreeCounts of the filters which have been applied, by name.
+		self._filterCounts = {}
+		self._decorators = []
 		self._curHeader = self.STDHEADER
 		self._filters = {}
+		self._pathIndex = PathIndex(index)
+		# Changes to apply to the buffer: (start, end, lines) tuples,
+		# replacing the display rows start to end with lines.
+		self._splices = []
+		self._fullRedraw = True
 		self._setOpenGroup(self._fileindex.root, open=True)
 		self._generateDisplay()
 
-	def _mapKey(self, key, action):
-		vim.command("nmap <buffer> %s %s" % (key, action))
+	def _mapKey(self, batch, key, action):
+		batch.add("nmap <buffer> %s %s" % (key, action))
 
-	def _mapKeys(self):
+	def _mapKeys(self, batch):
+		""" Add the key maps of the browser buffer to the
+		L{vimbridge.CommandBatch} *batch*. """
 		o = "vCodeProj.browser"
-		self._mapKey("<CR>", ":py %s.onSelect()<CR>" % o)
-		self._mapKey("<2-LeftMouse>", ":py %s.onSelect()<CR>" % o)
-		self._mapKey("<S-CR>", ":py %s.onSelect(alt=True)<CR>" % o)
-
-		self._mapKey("<Right>", ":py %s.openGroup(recursive=False)<CR>" % o)
-		self._mapKey("<S-Right>", ":py %s.openGroup(recursive=True)<CR>" % o)
-		self._mapKey("<Left>", ":py %s.closeGroup(recursive=False)<CR>" % o)
-		self._mapKey("<S-Left>", ":py %s.closeGroup(recursive=True)<CR>" % o)
+		self._mapKey(batch, "<CR>", ":py %s.onSelect()<CR>" % o)
+		self._mapKey(batch, "<2-LeftMouse>", ":py %s.onSelect()<CR>" % o)
+		self._mapKey(batch, "<S-CR>", ":py %s.onSelect(alt=True)<CR>" % o)
+
+		self._mapKey(batch, "<Right>",
+				":py %s.openGroup(recursive=False)<CR>" % o)
+		self._mapKey(batch, "<S-Right>",
+				":py %s.openGroup(recursive=True)<CR>" % o)
+		self._mapKey(batch, "<Left>",
+				":py %s.closeGroup(recursive=False)<CR>" % o)
+		self._mapKey(batch, "<S-Left>",
+				":py %s.closeGroup(recursive=True)<CR>" % o)
 
 	def _redrawTree(self):
 		self.open()
-		cursor = vim.current.window.cursor
+		self._draw()
+
+	def _draw(self):
+		""" Bring the tree in the current buffer up to date with the display.
+		Only the rows changed since the last draw are replaced, unless the
+		display has been regenerated. Nothing is drawn unless the current
+		buffer is the browser. """
+		if not self._fullRedraw and not self._splices:
+			return
+		if basename(vim.current.buffer.name) != self.BUFNAME:
+			return
+		line, col = vim.current.window.cursor
 		b = vim.current.buffer
 		vim.command("setlocal modifiable")
-		l = self._curHeader + self._toList()
-		b[:] = l
+		if self._fullRedraw:
+			b[:] = self._curHeader + self._toList()
+		else:
+			offset = len(self._curHeader)
+			for start, end, lines in self._splices:
+				b[offset+start:offset+end] = lines
 		vim.command("setlocal nomodifiable")
-		vim.current.window.cursor = cursor
+		vim.current.window.cursor = (min(line, len(b)), col)
+		self._splices = []
+		self._fullRedraw = False
 
-	def _setupSyntaxHighlighting(self):
+	def _setupSyntaxHighlighting(self, batch):
 		syntax = (
 			"syn match help #\" .*#",
 			"syn match treePart #|[~+ -]#",
@@ -77,19 +122,20 @@ class ProjectBrowser(object):
 			"hi def link treeDir Statement",
 			"hi def link help Comment"
 		)
-		for s in syntax:
-			vim.command(s)
+		batch.add(*syntax)
 
 	def _getItemUnderCursor(self):
 		w = vim.current.window
 		line, col = w.cursor
 		index = line - len(self._curHeader) - 1
-		return index, self._displayedItems[index]
+		if index < 0 or index >= len(self._rows):
+			return -1, None
+		return index, self._rows.itemAt(index)
 
 	def _setOpenGroup(self, folder, open=True, recursive=False):
 		""" Mark as open or closed folder. """
 		if recursive:
-			for i in folder.iterRecursive():
+			for i in folder.iterRecursive(load=open):
 				if isinstance(i, Group):
 					meta = i.getMeta(self.__class__)
 					meta["open"] = open
@@ -101,54 +147,120 @@ class ProjectBrowser(object):
 		if not isinstance(folder, Group):
 			return
 		self._setOpenGroup(folder, open, recursive)
-		self._generateDisplay()
+		row = self._rows.rowOf(folder)
+		if row < 0:
+			self._generateDisplay()
+			return
+		end = row + 1
+		while end < len(self._rows):
+			if self._rows.itemAt(end).depth <= folder.depth:
+				break
+			end += 1
+		items = []
+		if self._isOpen(folder):
+			self._addChildrenToDisplay(folder, items)
+		self._rows.replace(row + 1, end, items)
+		self._requestDecorations(items)
+		self._splices.append((row+1, end, [self._renderLine(i) for i in items]))
+
+	def addDecorator(self, decorator):
+		""" Add a decorator of the items in the browser, like a
+		L{metadata.MetadataService}. decorator.request(items) is called with
+		the items added to the display, before they are drawn. It must only
+		set extraInfo from memory, and report later changes to L{redrawItems}.
+		"""
+		self._decorators.append(decorator)
+
+	def _requestDecorations(self, items):
+		for decorator in self._decorators:
+			decorator.request(items)
+
+	def redrawItems(self, items):
+		""" Redraw the rows of *items*, after their extraInfo has changed.
+		Drawn the next time the browser is drawn, see L{update}. """
+		for item in items:
+			row = self._rows.rowOf(item)
+			if row >= 0:
+				self._splices.append((row, row+1, [self._renderLine(item)]))
+
+	def _renderLine(self, item):
+		""" Get the line displaying *item*. The line is cached until the
+		title, depth or extraInfo of the item changes. """
+		meta = item.getMeta(self.__class__)
+		cached = meta.get("line")
+		if cached and cached[0] == item.title and cached[1] == item.depth \
+				and cached[2] == item.extraInfo:
+			return cached[3]
+		prefix = "| " * item.depth
+		if isinstance(item, Group):
+			line = "%s|~%s/" % (prefix, item.title)
+		else:
+			line = "%s|-%s" % (prefix, item.title)
+		if item.extraInfo:
+			line = " ".join([line] + [v for k,v in item.iterExtraInfoSorted()])
+		meta["line"] = (item.title, item.depth, dict(item.extraInfo), line)
+		return line
 
 	def _toList(self):
-		l = []
-		for item in self._displayedItems:
-			prefix = "".join(["| " for x in xrange(item.depth)])
-			if isinstance(item, Group):
-				l.append("%s|~%s/" % (prefix, item.title))
-			else:
-				l.append("%s|-%s" % (prefix, item.title))
-		return l
+		return [self._renderLine(item) for item in self._rows]
+
+	def getFilter(self):
+		""" Get the L{filter.Filter} applied to the browser, or None. """
+		return self._curFilter
 
 	def _isOpen(self, folder):
 		meta = folder.getMeta(self.__class__)
 		return meta.get("open", False)
 
-	def _addThroughFilter(self, f):
-		if self._curFilter != None and not self._curFilter.letThrough(f):
-			return
-		self._displayedItems.append(f)
+	def _letThrough(self, f):
+		return self._curFilter == None or self._curFilter.letThrough(f)
+
+	def _addChildrenToDisplay(self, folder, display):
+		counts = self._curCounts
+		for item in folder.iterChildren():
+			if isinstance(item, Group):
+				if counts is None or counts.count(item) > 0:
+					self._addToDisplay(item, display)
+			elif self._letThrough(item):
+				display.append(item)
 
-	def _addToDisplay(self, folder):
-		self._displayedItems.append(folder)
+	def _addToDisplay(self, folder, display):
+		display.append(folder)
 		if self._isOpen(folder):
-			for item in folder.iterChildren():
-				if isinstance(item, Group):
-					self._addToDisplay(item)
-				else:
-					self._addThroughFilter(item)
+			self._addChildrenToDisplay(folder, display)
 
 	def _generateDisplay(self):
-		self._displayedItems = []
-		self._addToDisplay(self._fileindex.root)
+		display = []
+		self._addToDisplay(self._fileindex.root, display)
+		self._rows.reset(display)
+		self._requestDecorations(display)
+		self._splices = []
+		self._fullRedraw = True
+		self._displayGeneration = self._fileindex.generation
+
+	def invalidate(self):
+		""" Redraw the whole tree the next time the browser is drawn, like
+		when another browser has been drawn in the buffer. The display is
+		only regenerated if the index has changed since it was generated. """
+		if self._displayGeneration != self._fileindex.generation:
+			self._generateDisplay()
+		self._fullRedraw = True
 
 	def _createBuffer(self):
-		vim.command("tabnew %s" % self.BUFNAME)
-		vim.command("setlocal nonumber")
-		vim.command("setlocal encoding=%s" % ENCODING)
-		vim.command("setlocal buftype=nofile")
-		vim.command("setlocal bufhidden=delete")
-		vim.command("setlocal noswapfile")
-		vim.command("setlocal nobuflisted")
-		vim.command("setlocal visualbell") # disable beep on click
-		vim.command("setlocal cursorline") # highlight current line
-		vim.command("setlocal nowrap")
-		self._setupSyntaxHighlighting()
-		self._mapKeys()
-		self._redrawTree()
+		""" Open the browser in a new tab. The buffer is set up with a single
+		call into vim. """
+		self._fullRedraw = True
+		batch = CommandBatch("tabnew %s" % self.BUFNAME,
+			"setlocal nonumber",
+			"setlocal encoding=%s" % ENCODING,
+			"setlocal buftype=nofile bufhidden=delete noswapfile nobuflisted",
+			"setlocal visualbell", # disable beep on click
+			"setlocal cursorline", # highlight current line
+			"setlocal nowrap")
+		self._setupSyntaxHighlighting(batch)
+		self._mapKeys(batch)
+		batch.execute()
+		self._draw()
 
 
 	def autoCompleteFilternames(self):
@@ -157,16 +269,112 @@ class ProjectBrowser(object):
 		vim.command("let result = %s" % repr(l))
 
 	def addFilter(self, name, filter):
+		""" Add *filter* as *name*, replacing the filter with that name. If
+		the replaced filter is applied, *filter* is applied instead. """
+		if self._filters.get(name) is filter:
+			return
 		self._filters[name] = filter
+		counts = self._filterCounts.pop(name, None)
+		if counts is not None:
+			counts.close()
+			if counts is self._curCounts:
+				self._curFilter = filter
+				self._curCounts = self._filterCounts[name] = SubtreeCounts(
+						filter, self._fileindex)
+				self._generateDisplay()
 
 	def applyFilter(self, filterName):
+		""" Show only the files accepted by the filter *filterName*, and the
+		groups containing any of them. """
 		self._curFilter = self._filters.get(filterName)
+		self._curCounts = None
+		if self._curFilter is not None:
+			if not filterName in self._filterCounts:
+				self._filterCounts[filterName] = SubtreeCounts(
+						self._curFilter, self._fileindex)
+			self._curCounts = self._filterCounts[filterName]
 		self._generateDisplay()
 		self._redrawTree()
 
 	def clearFilter(self):
 		self.applyFilter(None)
 
+	def autoCompleteFiles(self):
+		start = vim.eval("a:ArgLead")
+		l = [f.relPath for f in self._pathIndex.find(start)]
+		vim.command("let result = %s" % repr(l))
+
+	def jumpToFile(self, query):
+		""" Open the file best matching *query*. See L{finder.PathIndex}. """
+		matches = self._pathIndex.find(query, limit=1)
+		if matches:
+			self._openFile(matches[0])
+		else:
+			vim.command("echo %s" % repr("No file matching: " + query))
+
+	def setRootDir(self, group, rootDir):
+		""" Find the files below *group* relative to *rootDir*, instead of the
+		rootDir of the browser. Used when *group* is a project of a
+		L{Workspace}. """
+		self._rootDirs[group] = rootDir
+
+	def _rootDirOf(self, item):
+		while item is not None:
+			rootDir = self._rootDirs.get(item)
+			if rootDir is not None:
+				return rootDir
+			item = item.parent
+		return self._rootDir
+
+	def _findFile(self, absPath):
+		""" Find the file with the absolute path *absPath*, loading the lazy
+		groups bound to the directories above it. """
+		while True:
+			item = self._fileindex.getFile(absPath)
+			if item is not None or (self._rootDir is None
+					and not self._rootDirs):
+				return item
+			lazy = [g for g in self._fileindex if isinstance(g, LazyGroup)
+					and not g.loaded and self._isBoundAbove(g, absPath)]
+			if not lazy:
+				return None
+			for g in lazy:
+				g.load()
+
+	def _isBoundAbove(self, group, absPath):
+		rootDir = self._rootDirOf(group)
+		if rootDir is None:
+			return False
+		for relPath, excludePatt in getDirBindings(group):
+			if absPath.startswith(join(rootDir, relPath, "")):
+				return True
+		return False
+
+	def revealFile(self, absPath):
+		""" Open the groups above the file with the absolute path *absPath*,
+		and move the cursor to it. """
+		item = self._findFile(absPath)
+		if item is None:
+			vim.command("echo %s" % repr("Not in the project: " + absPath))
+			return
+		ancestors = []
+		group = item.parent
+		while group is not None:
+			ancestors.insert(0, group)
+			group = group.parent
+		for group in ancestors:
+			if not self._isOpen(group):
+				self._openOrCloseGroup(group, open=True)
+		self._redrawTree()
+		row = self._rows.rowOf(item)
+		if row < 0:
+			vim.command("echo %s" % repr("Hidden by the filter: " + absPath))
+			return
+		vim.current.window.cursor = (len(self._curHeader) + row + 1, 0)
+
+	def _openFile(self, item):
+		execute("tabedit %s" % item.absPath, "tabmove")
+
 	def onSelect(self, alt=False):
 		index, item = self._getItemUnderCursor()
 		if index < 0:
@@ -175,8 +383,7 @@ class ProjectBrowser(object):
 			self._openOrCloseGroup(item, not self._isOpen(item), recursive=alt)
 			self._redrawTree()
 		else:
-			vim.command("tabedit %s" % item.absPath)
-			vim.command("tabmove")
+			self._openFile(item)
 			if alt:
 				self.moveCursorTo()
 
@@ -195,13 +402,40 @@ class ProjectBrowser(object):
 		self._openOrCloseGroupUnderCursor(open=False, recursive=recursive)
 
 
+	def refresh(self):
+		""" Regenerate the display after the file index has changed. The tree
+		is redrawn right away if it is visible in the current tab page, and
+		the next time the browser is opened if not. """
+		self._generateDisplay()
+		self.update()
+
+	def update(self):
+		""" Draw the pending changes if the browser is visible in the current
+		tab page. """
+		found = windows.goToBuffer(self.BUFNAME, allTabs=False)
+		if found is not None:
+			prev, cur = found
+			self._draw()
+			if prev != cur:
+				windows.goTo(prev[1])
+
 	def open(self):
 		if not self.moveCursorTo():
 			self._createBuffer()
+		else:
+			self._draw()
 
 	def moveCursorTo(self):
 		return goToWindowByBufName(self.BUFNAME)
 
+	def setStatus(self, status=None):
+		""" Show *status* in the header of the browser, or remove the status
+		if None. Shown the next time the browser is drawn. """
+		self._curHeader = list(self.STDHEADER)
+		if status:
+			self._curHeader.insert(-1, "\" " + status)
+		self._fullRedraw = True
+
 
 
 
@@ -210,25 +444,447 @@ class ProjectBrowser(object):
 ##############################################################
 
 class Project(object):
-	def __init__(self, projectDir):
+	def __init__(self, projectDir, watch=True, lazy=False, compact=False,
+			background=False, python=None, fileInfo=False, vcsStatus=False,
+			alternateRules=None):
+		"""
+		@param watch: Keep the file index up to date when files are added or
+			removed. Changes are applied by L{pollChanges}.
+		@param lazy: Scan directories when they are opened in the browser.
+			See L{settings_parser.FilesParser.__init__}.
+		@param compact: Keep the files in a L{compact.CompactTree}, which uses
+			far less memory for large projects.
+		@param background: Parse the project with a L{worker.IndexWorker},
+			and add the groups to the browser as they are parsed by
+			L{pollChanges}.
+		@param python: Parse the project (with *background*), grep and scan
+			symbols in subprocesses run by this python interpreter instead of
+			threads. See L{procpool}.
+		@param fileInfo: Show the size and modification time of files in the
+			browser. See L{metadata.MetadataService}.
+		@param vcsStatus: Show the git status of files in the browser, and
+			mark the groups containing changed files. See L{vcs.GitStatus}.
+		@param alternateRules: The rules pairing files with their alternates.
+			See L{alternates.AlternateFiles}.
+		"""
 		self.projectDir = abspath(projectDir)
 		self.projectName = basename(self.projectDir).replace(".vcode", "")
 		self.rootDir = dirname(self.projectDir)
+		self._python = python
 
 		self.logFile = join(self.projectDir, "log")
 		self.log = logging.getLogger("vcode." + self.projectName)
-		self.log.setLevel(logging.info)
+		self.log.setLevel(logging.INFO)
 		handler = logging.handlers.RotatingFileHandler(
 						self.logFile, maxBytes=1024*30, backupCount=0)
 		self.log.addHandler(handler)
 
-		settings = SettingsParser(self.projectDir, self.projectName,
-				self.rootDir)
-		self.fileindex = FileIndex(settings.files)
+		self._worker = None
+		if background:
+			files = Group(self.projectName, 0)
+			filters = parseFilters(self.projectDir)
+			if python:
+				self._worker = ProcessIndexWorker(self.projectDir,
+						self.projectName, self.rootDir, lazy, python)
+			else:
+				self._worker = IndexWorker(self.projectDir, self.projectName,
+						self.rootDir, lazy)
+		else:
+			settings = SettingsParser(self.projectDir, self.projectName,
+					self.rootDir, lazy=lazy)
+			files = settings.files
+			filters = settings.filters
+		if compact:
+			files = CompactTree(self.rootDir).setRoot(files)
+		self.fileindex = FileIndex(files)
+
+		self._filters = filters
+		self.metadata = None
+		if fileInfo:
+			self.metadata = MetadataService()
+			self.fileindex.addListener(
+					lambda group, removed, added: self.metadata.forget(removed))
+		self.browser = self._makeBrowser(self.fileindex)
+		# The browser of the project tree (None), and of each view shown.
+		self._browsers = {None: self.browser}
+		self._viewName = None
+		templates, viewDefs = parseViews(self.projectDir, filters)
+		self.views = ViewEngine(self.fileindex, templates, viewDefs)
+		self.vcs = None
+		if vcsStatus:
+			self.vcs = GitStatus(self.fileindex, self.rootDir)
+			self.vcs.refresh()
+		self._searchIndex = None
+		self._symbolIndex = None
+		# Files added, removed or saved since each of the indexes above was
+		# updated, keyed on the index.
+		self._changedFiles = {}
+		self.fileindex.addListener(self._onIndexPatchedForIndexes)
+		self.alternates = AlternateFiles(self.fileindex, alternateRules)
+		self._grep = None
+		self._grepBuffer = None
+		self._grepQuery = None
+		self._grepMatches = 0
+		if self._worker:
+			self.browser.setStatus("scanning...")
+			self._worker.start()
+		self.browser.open()
+
+		self.watcher = None
+		if watch:
+			self.watcher = TreeWatcher(self.fileindex, self.rootDir,
+					onBatch=self._onWatcherBatch)
+			self.watcher.start()
+
+	def _makeBrowser(self, index):
+		browser = ProjectBrowser(index, self.rootDir)
+		for name, f in self._filters.iteritems():
+			browser.addFilter(name, f)
+		if self.metadata:
+			browser.addDecorator(self.metadata)
+		return browser
+
+	def autoCompleteViews(self):
+		start = vim.eval("a:ArgLead")
+		l = fnmatch.filter(self.views.getNames(), start + "*")
+		vim.command("let result = %s" % repr(l))
+
+	def showView(self, name=None):
+		""" Show the view *name* in the browser, or the project tree if None.
+		See L{views.ViewEngine}. The browser of each view is kept, with its
+		open groups and filter, so switching back to a view only redraws
+		it. """
+		browser = self._browsers.get(name)
+		if browser is None:
+			try:
+				view = self.views.getView(name)
+			except KeyError:
+				vim.command("echo %s" % repr("No view named: %s" % name))
+				return
+			browser = self._makeBrowser(view.index)
+			self._browsers[name] = browser
+		self._viewName = name
+		self.browser = browser
+		browser.invalidate()
+		browser.open()
+
+	def _redrawChanged(self, changed):
+		""" Redraw the items of the project tree in *changed* in the
+		browser, or the items showing them if a view is shown. """
+		if self._viewName is not None:
+			changed = self.views.getView(self._viewName).getItems(changed)
+		self.browser.redrawItems(changed)
+		self.browser.update()
+
+	def _onWatcherBatch(self, groups):
+		self.browser.refresh()
+		if self.vcs:
+			self.vcs.refresh(force=True)
+
+	def fileSaved(self):
+		""" Called when vim has written a file (see VCodeWatchFiles in
+		vcode.vim), since that changes the status of the file. """
+		if self.vcs:
+			self.vcs.refresh(force=True)
+		path = vim.eval("expand('<afile>:p')")
+		for changed in self._changedFiles.itervalues():
+			changed.add(path)
+
+	def _projectFiles(self):
+		return set([item.absPath for item in self.fileindex
+				if isinstance(item, File)])
+
+	def _onIndexPatchedForIndexes(self, group, removed, added):
+		paths = [item.absPath for item in removed + added
+				if isinstance(item, File)]
+		for changed in self._changedFiles.itervalues():
+			changed.update(paths)
+
+	def _updateIndex(self, index):
+		""" Bring *index*, a L{search.TrigramIndex} or L{symbols.SymbolIndex},
+		up to date. The first time, every file in the project is checked.
+		After that, only the files added, removed or saved in vim. """
+		changed = self._changedFiles.get(index)
+		if changed is None:
+			index.update(self._projectFiles())
+		elif changed:
+			gone = [path for path in changed
+					if not self.fileindex.getFiles(path)]
+			index.removeFiles(gone)
+			index.updateFiles(changed.difference(gone))
+		self._changedFiles[index] = set()
+		index.save()
+
+	def updateIndexes(self):
+		""" Check every file in the search and symbol indexes in use, to
+		find the files changed outside of vim. """
+		for index in self._changedFiles:
+			index.update(self._projectFiles())
+			index.save()
+
+	def _getSearchIndex(self):
+		if self._searchIndex is None:
+			self._searchIndex = TrigramIndex(join(self.projectDir,
+					SEARCH_INDEX_FILENAME))
+		self._updateIndex(self._searchIndex)
+		return self._searchIndex
+
+	def _getSymbolIndex(self):
+		if self._symbolIndex is None:
+			self._symbolIndex = SymbolIndex(join(self.projectDir,
+					SYMBOLS_FILENAME), python=self._python)
+		self._updateIndex(self._symbolIndex)
+		return self._symbolIndex
+
+	def autoCompleteSymbols(self):
+		start = vim.eval("a:ArgLead")
+		l = self._getSymbolIndex().complete(start, limit=200)
+		vim.command("let result = %s" % repr(l))
+
+	def jumpToSymbol(self, name):
+		""" Open the definition of *name*, or list the definitions in a new
+		tab if there are several. See L{symbols.SymbolIndex}. """
+		found = self._getSymbolIndex().lookup(name)
+		if not found:
+			vim.command("echo %s" % repr("No symbol named: " + name))
+		elif len(found) == 1:
+			name, kind, path, lineNr = found[0]
+			execute("tabedit +%d %s" % (lineNr, path), "tabmove")
+		else:
+			searchResults("vcode-symbols", ["%s:%d:%s %s" %
+					(relpath(path, self.rootDir), lineNr, kind, name)
+					for name, kind, path, lineNr in found], self.rootDir)
+
+	def search(self, query, regex=False, ignoreCase=False):
+		""" Search the content of the files in the project, and show the
+		matching lines in a new tab. See L{search.TrigramIndex.search}. """
+		try:
+			results = self._getSearchIndex().search(query, regex, ignoreCase)
+			lines = ["%s:%d:%s" % (relpath(path, self.rootDir), lineNr, line)
+					for path, lineNr, line in results]
+		except re.error, e:
+			vim.command("echo %s" % repr("Invalid regex: %s" % e))
+			return
+		if not lines:
+			vim.command("echo %s" % repr("Not found: " + query))
+			return
+		searchResults("vcode-search", lines, self.rootDir)
+
+	def _grepSources(self, filter):
+		""" Get the files searched by L{grep}: the files in the index accepted
+		by *filter*, and the directories of lazy groups not loaded yet.
+		@return: (paths, dirs) as taken by L{grep.ParallelGrep}. """
+		paths = []
+		seen = set()
+		dirs = []
+		for item in self.fileindex:
+			if isinstance(item, File):
+				if not item.absPath in seen \
+						and (filter is None or filter.letThrough(item)):
+					seen.add(item.absPath)
+					paths.append(item.absPath)
+			elif isinstance(item, LazyGroup) and not item.loaded:
+				dirs.extend(getDirBindings(item))
+		return paths, dirs
+
+	def grep(self, query, regex=False, ignoreCase=False):
+		""" Search the content of the files in the project, or the files
+		accepted by the filter of the browser, without using the search
+		index. The matching lines are shown in a new tab, and added to it by
+		L{pollChanges} as they are found. See L{grep.ParallelGrep}. """
+		self.cancelGrep()
+		pattern, flags = queryPattern(query, regex, ignoreCase)
+		try:
+			re.compile(pattern, flags)
+		except re.error, e:
+			vim.command("echo %s" % repr("Invalid regex: %s" % e))
+			return
+		filter = self.browser.getFilter()
+		paths, dirs = self._grepSources(filter)
+		self._grep = ParallelGrep(pattern, flags, paths, self.rootDir, dirs,
+				filter, python=self._python)
+		self._grepQuery = query
+		self._grepMatches = 0
+		self._grepBuffer = searchResults("vcode-grep", [""], self.rootDir)
+		self._setGrepStatus("searching...")
+		self._grep.start()
+
+	def cancelGrep(self):
+		""" Stop the search started by L{grep}. """
+		if self._grep:
+			self._grep.cancel()
+			self._setGrepStatus("cancelled")
+			self._grep = None
+
+	def _setGrepStatus(self, status):
+		if self._grepBuffer.valid:
+			replaceLines(self._grepBuffer, 0, 1, ['" grep %s: %s' %
+					(self._grepQuery, status)])
+
+	def _pollGrep(self):
+		if not self._grepBuffer.valid:
+			# The result buffer has been closed.
+			self.cancelGrep()
+			return
+		results = self._grep.poll()
+		if results:
+			self._grepMatches += len(results)
+			end = len(self._grepBuffer)
+			replaceLines(self._grepBuffer, end, end, ["%s:%d:%s" %
+					(relpath(path, self.rootDir), lineNr, line)
+					for path, lineNr, line in results])
+		if self._grep.done:
+			self._setGrepStatus("%d matches in %d files" %
+					(self._grepMatches, self._grep.fileCount))
+			self._grep = None
+
+	def openAlternate(self, ruleName=None):
+		""" Open the alternate of the file in the current buffer, like its
+		header, or the source file if it is a header. See
+		L{alternates.AlternateFiles}.
+
+		You should have "set hidden" in your .vimrc to retain file history,
+		and to enable switching files with unsaved changes.
+
+		@param ruleName: The name of the rule used to find the alternate,
+			like "header" or "test". By default, the first rule pairing the
+			file with another file is used.
+		"""
+		absPath = vim.current.buffer.name
+		f = self.fileindex.getFile(absPath)
+		if f is not None:
+			relPath = f.relPath
+		else:
+			relPath = relpath(absPath, self.rootDir)
+		found = self.alternates.find(relPath, ruleName)
+		if found:
+			execute("edit %s" % found[0].absPath)
+
+	def revealCurrentFile(self):
+		""" Show the file in the current buffer in the project browser. """
+		absPath = vim.eval("expand('%:p')")
+		self.browser.revealFile(absPath)
+
+	def _pollWorker(self):
+		""" Add the groups parsed by the background worker to the index. """
+		messages = self._worker.poll()
+		root = self.fileindex.root
+		added = False
+		for kind, payload in messages:
+			if kind == "group":
+				root.add(payload)
+				added = True
+			elif kind == "done":
+				self._worker = None
+				self.browser.setStatus(None)
+			elif kind == "error":
+				self._worker = None
+				self.log.error(payload)
+				self.browser.setStatus("scanning failed: " + payload)
+		if added:
+			self.fileindex.patch(root)
+		if messages:
+			self.browser.refresh()
+
+	def pollChanges(self):
+		""" Apply pending changes to the file index, and refresh the browser.
+		Called regularly from vim (see VCodeWatchFiles in vcode.vim). """
+		if self._worker:
+			self._pollWorker()
+		if self._grep:
+			self._pollGrep()
+		if self.watcher:
+			self.watcher.poll()
+		changed = []
+		if self.metadata:
+			changed.extend(self.metadata.poll())
+		if self.vcs:
+			self.vcs.refresh()
+			changed.extend(self.vcs.poll())
+		if changed:
+			self._redrawChanged(changed)
+
+
+
+class Workspace(object):
+	""" Several projects in one browser, each shown as a top-level group.
+
+	The projects are parsed through one L{scanner.ListingCache}, keyed on
+	absolute path, so a directory in the <dir>-tags of several projects is
+	only listed once. Each project still keeps its own snapshot, and a
+	watcher for its own groups.
+
+	A workspace is used like a L{Project} from vim, but only provides the
+	browser; searching, grep, git status and alternates are per project.
+	"""
+	def __init__(self, projectDirs, watch=True, lazy=False, fileInfo=False,
+			name="workspace"):
+		"""
+		@param projectDirs: The .vcode directories of the projects.
+		@param watch: See L{Project.__init__}.
+		@param lazy: See L{Project.__init__}.
+		@param fileInfo: See L{Project.__init__}.
+		"""
+		self.listingCache = ListingCache()
+		root = Group(name, 0)
+		# (projectName, rootDir, group) of each project.
+		self.projects = []
+		filters = {}
+		for projectDir in projectDirs:
+			projectDir = abspath(projectDir)
+			projectName = basename(projectDir).replace(".vcode", "")
+			rootDir = dirname(projectDir)
+			settings = SettingsParser(projectDir, projectName, rootDir,
+					lazy=lazy, listingCache=self.listingCache)
+			group = settings.files
+			for item in group.iterRecursive():
+				item.depth += 1
+			root.add(group)
+			self.projects.append((projectName, rootDir, group))
+			for filterName, f in settings.filters.iteritems():
+				filters["%s/%s" % (projectName, filterName)] = f
+		self.fileindex = FileIndex(root)
 
 		self.browser = ProjectBrowser(self.fileindex)
-		self.browser.addFilter("c/c++",
-				ProjectBrowserFilter(["*.h", "*.c", "*.cpp", "*.hpp"]))
-		self.browser.addFilter("txt",
-				ProjectBrowserFilter(["*.txt"]))
+		for projectName, rootDir, group in self.projects:
+			self.browser.setRootDir(group, rootDir)
+		for filterName, f in filters.iteritems():
+			self.browser.addFilter(filterName, f)
+		self.metadata = None
+		if fileInfo:
+			self.metadata = MetadataService()
+			self.fileindex.addListener(
+					lambda group, removed, added: self.metadata.forget(removed))
+			self.browser.addDecorator(self.metadata)
 		self.browser.open()
+
+		self.watchers = []
+		if watch:
+			for projectName, rootDir, group in self.projects:
+				watcher = TreeWatcher(self.fileindex, rootDir,
+						onBatch=self._onWatcherBatch, root=group)
+				watcher.start()
+				self.watchers.append(watcher)
+
+	def _onWatcherBatch(self, groups):
+		self.browser.refresh()
+
+	def fileSaved(self):
+		""" Called when vim has written a file. Nothing depends on it in a
+		workspace. """
+
+	def revealCurrentFile(self):
+		""" Show the file in the current buffer in the browser. """
+		absPath = vim.eval("expand('%:p')")
+		self.browser.revealFile(absPath)
+
+	def pollChanges(self):
+		""" Apply pending changes to the file index, and refresh the browser.
+		See L{Project.pollChanges}. """
+		for watcher in self.watchers:
+			watcher.poll()
+		if self.metadata:
+			changed = self.metadata.poll()
+			if changed:
+				self.browser.redrawItems(changed)
+				self.browser.update()
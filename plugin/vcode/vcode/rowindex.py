@@ -0,0 +1,255 @@
+"""
+Index of the rows displayed in the project browser.
+
+The rows of the browser are the visible items of a
+L{file_memorymodel.FileIndex}, in index order. Only the visible items are
+kept, as the nodes of a treap ordered by row: a binary tree balanced by a
+random priority in each node, where each node knows the size of its
+subtree. The row of a node is the number of nodes before it, counted on the
+way up to the root, and the node on a row is found on the way down from it,
+so both lookups take O(log rows). Opening or closing a group splits out the
+range of rows below it and merges in the new rows, in O(log rows) plus the
+number of rows added and removed, however large the index is.
+"""
+from random import random
+
+
+class _Node(object):
+	__slots__ = ("item", "priority", "left", "right", "parent", "size")
+
+	def __init__(self, item):
+		self.item = item
+		self.priority = random()
+		self.left = None
+		self.right = None
+		self.parent = None
+		self.size = 1
+
+
+def _size(node):
+	return node and node.size or 0
+
+def _update(node):
+	""" Recompute the size of *node*, and adopt its children. """
+	node.size = 1
+	for child in (node.left, node.right):
+		if child is not None:
+			node.size += child.size
+			child.parent = node
+
+def _merge(a, b):
+	""" Join the treaps *a* and *b*, with the rows of *b* after those of *a*.
+	@return: The root of the result. """
+	if a is None:
+		return b
+	if b is None:
+		return a
+	if a.priority > b.priority:
+		a.right = _merge(a.right, b)
+		_update(a)
+		return a
+	b.left = _merge(a, b.left)
+	_update(b)
+	return b
+
+def _split(node, count):
+	""" Split the treap *node* after its first *count* rows.
+	@return: The roots of the two treaps. """
+	if node is None:
+		return None, None
+	if _size(node.left) >= count:
+		left, node.left = _split(node.left, count)
+		_update(node)
+		return left, node
+	node.right, right = _split(node.right, count - _size(node.left) - 1)
+	_update(node)
+	return node, right
+
+def _build(items, nodes):
+	""" Build a treap of *items*, in order, in O(len(items)). The node of
+	each item is added to the dict *nodes*.
+	@return: The root. """
+	# The nodes on the right edge of the tree built so far.
+	edge = []
+	for item in items:
+		node = _Node(item)
+		nodes[item] = node
+		last = None
+		while edge and edge[-1].priority < node.priority:
+			last = edge.pop()
+			_update(last)
+		node.left = last
+		if edge:
+			edge[-1].right = node
+		edge.append(node)
+	while len(edge) > 1:
+		_update(edge.pop())
+	if not edge:
+		return None
+	_update(edge[0])
+	return edge[0]
+
+def _iterNodes(node):
+	""" Iterate over the nodes of the treap *node* in row order. """
+	stack = []
+	while stack or node is not None:
+		if node is not None:
+			stack.append(node)
+			node = node.left
+		else:
+			node = stack.pop()
+			yield node
+			node = node.right
+
+
+class VisibleRows(object):
+	""" The visible items of a L{file_memorymodel.FileIndex}, numbered by row.
+
+	Items removed from the FileIndex are removed from the rows when the index
+	is patched.
+	"""
+	def __init__(self, fileindex):
+		self._fileindex = fileindex
+		self._root = None
+		# The node of each visible item.
+		self._nodes = {}
+		fileindex.addListener(self._onIndexPatched)
+
+	def _setRoot(self, root):
+		if root is not None:
+			root.parent = None
+		self._root = root
+
+	def reset(self, items):
+		""" Make *items*, in row order, the visible items. """
+		self._nodes = {}
+		self._setRoot(_build(items, self._nodes))
+
+	def replace(self, start, end, items):
+		""" Replace the rows *start* to *end* with *items*. """
+		left, rest = _split(self._root, start)
+		removed, right = _split(rest, end - start)
+		for node in _iterNodes(removed):
+			del self._nodes[node.item]
+		added = _build(items, self._nodes)
+		self._setRoot(_merge(_merge(left, added), right))
+
+	def __len__(self):
+		return _size(self._root)
+
+	def __iter__(self):
+		""" Iterate over the visible items in row order. """
+		for node in _iterNodes(self._root):
+			yield node.item
+
+	def rowOf(self, item):
+		""" Get the row of *item*.
+		@return: The row, or -1 if *item* is not visible.
+		"""
+		node = self._nodes.get(item)
+		if node is None:
+			return -1
+		row = _size(node.left)
+		while node.parent is not None:
+			if node is node.parent.right:
+				row += _size(node.parent.left) + 1
+			node = node.parent
+		return row
+
+	def itemAt(self, row):
+		""" Get the item on *row*.
+		@raise IndexError: If there is no such row.
+		"""
+		if row < 0 or row >= len(self):
+			raise IndexError(row)
+		node = self._root
+		while True:
+			leftSize = _size(node.left)
+			if row < leftSize:
+				node = node.left
+			elif row == leftSize:
+				return node.item
+			else:
+				row -= leftSize + 1
+				node = node.right
+
+	def _onIndexPatched(self, group, removed, added):
+		rows = sorted([r for r in map(self.rowOf, removed) if r >= 0],
+				reverse=True)
+		for row in rows:
+			self.replace(row, row + 1, [])
+
+
+if __name__ == "__main__":
+	import unittest
+	from file_memorymodel import Group, File, FileIndex
+
+	class TestVisibleRows(unittest.TestCase):
+		def setUp(self):
+			self.a = Group("a", 1, File("x", "x", "/x", 2), File("y", "y", "/y", 2))
+			self.b = Group("b", 1, File("z", "z", "/z", 2))
+			self.root = Group("root", 0, self.a, self.b)
+			self.index = FileIndex(self.root)
+			self.rows = VisibleRows(self.index)
+			self.rows.reset([self.root, self.a, self.b])
+
+		def testLookup(self):
+			self.assertEquals(len(self.rows), 3)
+			self.assertEquals([self.rows.rowOf(i) for i in self.rows],
+					[0, 1, 2])
+			self.assertEquals(self.rows.itemAt(2), self.b)
+			self.assertEquals(self.rows.rowOf(self.a.getByTitle("x")), -1)
+			self.assertRaises(IndexError, self.rows.itemAt, 3)
+			self.assertRaises(IndexError, self.rows.itemAt, -1)
+
+		def testReplace(self):
+			y = self.a.getByTitle("y")
+			self.assertEquals(self.rows.rowOf(self.b), 2)
+			self.rows.replace(2, 2, [self.a.getByTitle("x"), y])
+			self.assertEquals(self.rows.rowOf(y), 3)
+			self.assertEquals(self.rows.rowOf(self.b), 4)
+			self.assertEquals(self.rows.itemAt(4), self.b)
+			self.rows.replace(2, 4, [])
+			self.assertEquals(self.rows.rowOf(y), -1)
+			self.assertEquals(self.rows.rowOf(self.b), 2)
+
+		def testIndexPatched(self):
+			z = self.b.getByTitle("z")
+			self.rows.replace(3, 3, [z])
+			self.a.add(File("w", "w", "/w", 2))
+			self.b.remove(z)
+			self.index.patch(self.root)
+			self.assertEquals([i.title for i in self.rows], ["root", "a", "b"])
+			self.assertEquals(self.rows.rowOf(z), -1)
+
+		def testOnlyVisibleRowsAreIndexed(self):
+			big = Group("big", 1, *[File("f%d" % i, "f", "/f", 2)
+					for i in xrange(1000)])
+			self.root.add(big)
+			self.index.patch(self.root)
+			self.rows.replace(3, 3, [big])
+			self.assertEquals(self.rows.rowOf(big), 3)
+			self.assertEquals(len(self.rows._nodes), 4)
+
+		def testManyRows(self):
+			files = [File("f%d" % i, "f", "/f", 2) for i in xrange(2000)]
+			self.rows.reset(files[:1000])
+			self.rows.replace(500, 500, files[1000:])
+			self.rows.replace(0, 250, [])
+			expected = files[250:500] + files[1000:] + files[500:1000]
+			self.assertEquals(list(self.rows), expected)
+			self.assertEquals(len(self.rows), len(expected))
+			for row in (0, 249, 250, 1249, 1250, len(expected) - 1):
+				self.assertEquals(self.rows.itemAt(row), expected[row])
+				self.assertEquals(self.rows.rowOf(expected[row]), row)
+			self.assertEquals(self.rows.rowOf(files[0]), -1)
+			# Balanced: no path is much longer than log2(rows).
+			depth = 0
+			for item in expected:
+				node, d = self.rows._nodes[item], 0
+				while node.parent is not None:
+					node, d = node.parent, d + 1
+				depth = max(depth, d)
+			self.assertTrue(depth < 50, depth)
+
+	unittest.main()
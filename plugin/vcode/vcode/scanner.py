@@ -0,0 +1,386 @@
+"""
+Directory scanner used to turn <dir>-tags into Group/File trees.
+
+Directories are listed one level at a time, and the listings of each level
+are fanned out across a thread pool. Directories matching the exclude pattern
+are pruned before they are listed, so excluded trees (like build/) are never
+descended.
+
+Directories can also be scanned lazily, in which case sub-directories are
+added as L{file_memorymodel.LazyGroup}s that are listed when they are opened.
+"""
+from os import listdir, stat
+from os.path import isdir, join
+from time import time
+from threading import Thread
+from Queue import Queue
+from multiprocessing.pool import ThreadPool
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None
+
+from file_memorymodel import Group, LazyGroup, File
+
+
+def listDir(absPath):
+	""" List the directory *absPath*.
+
+	Uses scandir when available, which answers the is-directory question from
+	the cached d_type of each entry instead of a separate stat.
+
+	@return: A list of (name, isDir) tuples in directory order.
+	"""
+	if scandir is None:
+		return [(name, isdir(join(absPath, name)))
+				for name in listdir(absPath)]
+	else:
+		return [(entry.name, entry.is_dir()) for entry in scandir(absPath)]
+
+
+class ListingCache(object):
+	""" Directory listings keyed on absolute path.
+
+	A cached listing is only used while the mtime of the directory is
+	unchanged, so a directory is listed again when entries are added to
+	or removed from it.
+	"""
+
+	# Listings of directories modified less than this many seconds before
+	# they were listed are not trusted, since the directory may change again
+	# without changing its mtime.
+	RACY_INTERVAL = 2
+
+	def __init__(self, listings=None):
+		"""
+		@param listings: Listings to start with, as returned by L{getUsed}.
+		"""
+		self._listings = listings or {}
+		self._used = {}
+
+	def listDir(self, absPath):
+		""" Like L{listDir}, but use the cached listing when it is
+		still valid. """
+		mtime = stat(absPath).st_mtime
+		cached = self._listings.get(absPath)
+		if cached is not None and cached[0] == mtime:
+			entries = cached[1]
+		else:
+			entries = listDir(absPath)
+			if time() - mtime < self.RACY_INTERVAL:
+				mtime = None
+		self._listings[absPath] = self._used[absPath] = (mtime, entries)
+		return entries
+
+	def isValid(self, absPath):
+		""" Check if the cached listing of *absPath* is still valid. """
+		cached = self._listings.get(absPath)
+		try:
+			return cached is not None and cached[0] == stat(absPath).st_mtime
+		except OSError:
+			return False
+
+	def getUsed(self):
+		""" Get the listings used since this cache was created.
+		@return: dict mapping absolute path to (mtime, entries).
+		"""
+		return self._used
+
+	def share(self, listings=None):
+		""" Create a cache sharing the listings of this cache, so directories
+		listed through either cache are only listed once. Used for the
+		projects of a workspace, whose <dir>-tags may overlap. The listings
+		used through the new cache are recorded separately, see L{getUsed}.
+
+		@param listings: Listings to add to the shared listings, as returned
+			by L{getUsed}. Listings already shared are kept.
+		"""
+		cache = ListingCache()
+		cache._listings = self._listings
+		for absPath, listing in (listings or {}).iteritems():
+			self._listings.setdefault(absPath, listing)
+		return cache
+
+
+class Prefetcher(object):
+	""" Lists directories into a L{ListingCache} from a background thread. """
+	def __init__(self, cache):
+		self._cache = cache
+		self._queue = Queue()
+		self._thread = None
+
+	def prefetch(self, absPath):
+		if self._thread is None:
+			self._thread = Thread(target=self._run, name="vcode-prefetch")
+			self._thread.setDaemon(True)
+			self._thread.start()
+		self._queue.put(absPath)
+
+	def _run(self):
+		while True:
+			absPath = self._queue.get()
+			try:
+				self._cache.listDir(absPath)
+			except OSError:
+				pass
+
+
+class DirScanner(object):
+	""" Scans directories below a root directory into Group/File trees. """
+	def __init__(self, rootDir, workers=None, cache=None, prefetch=False):
+		"""
+		@param rootDir: All paths given to the scanner are relative
+			to this directory.
+		@param workers: Number of threads used to list directories. Defaults
+			to the number of cpus.
+		@param cache: A L{ListingCache}. If given, directories are listed
+			through the cache.
+		@param prefetch: When scanning lazily, list the sub-directories of
+			each loaded group in the background, so they load instantly when
+			they are opened.
+		"""
+		self._rootDir = rootDir
+		self._workers = workers
+		self._pool = None
+		self._prefetcher = None
+		if prefetch:
+			cache = cache or ListingCache()
+			self._prefetcher = Prefetcher(cache)
+		self._cache = cache
+
+	def _map(self, func, items):
+		if len(items) < 2:
+			return map(func, items)
+		if self._pool is None:
+			self._pool = ThreadPool(self._workers)
+		return self._pool.map(func, items)
+
+	def close(self):
+		""" Stop the thread pool. The scanner can still be used afterwards,
+		a new pool is started when needed. """
+		if self._pool is not None:
+			self._pool.close()
+			self._pool.join()
+			self._pool = None
+
+	def listDir(self, relPath):
+		""" List the directory *relPath*.
+		@return: See L{listDir}. """
+		absPath = self._absPath(relPath)
+		if self._cache is None:
+			return listDir(absPath)
+		return self._cache.listDir(absPath)
+
+	def _absPath(self, relPath):
+		return relPath and join(self._rootDir, relPath) or self._rootDir
+
+	def _isExcluded(self, relPath, excludePatt):
+		return excludePatt is not None and excludePatt.match(relPath)
+
+	def _listRecursive(self, relPath, excludePatt):
+		""" List *relPath* and every non-excluded directory below it.
+		@return: dict mapping the relative path of each listed directory to
+			its listing.
+		"""
+		listings = {}
+		level = [relPath]
+		while level:
+			nextLevel = []
+			for path, entries in zip(level, self._map(self.listDir, level)):
+				listings[path] = entries
+				for name, isDir in entries:
+					p = join(path, name)
+					if isDir and not self._isExcluded(p, excludePatt):
+						nextLevel.append(p)
+			level = nextLevel
+		return listings
+
+	def _build(self, group, path, listings, excludePatt, lazy=False):
+		addDirBinding(group, path, excludePatt)
+		depth = group.depth + 1
+		lazyDirs = []
+		for name, isDir in listings[path]:
+			p = join(path, name)
+			if self._isExcluded(p, excludePatt):
+				continue
+			if isDir and lazy:
+				group.add(self.makeLazyGroup(name, depth, p, excludePatt))
+				lazyDirs.append(p)
+			elif isDir:
+				g = Group(name, depth)
+				self._build(g, p, listings, excludePatt)
+				if g.isEmpty():
+					addEmptyDirs(group, g, p, path)
+				group.add(g)
+			else:
+				group.add(File(name, p, join(self._rootDir, p), depth))
+		if self._prefetcher:
+			for p in lazyDirs:
+				self._prefetcher.prefetch(self._absPath(p))
+
+	def makeLazyGroup(self, title, depth, relPath, excludePatt=None):
+		""" Create a L{LazyGroup} which scans the directory *relPath* into
+		itself when it is loaded. Its sub-directories are added lazily. """
+		def loader(group):
+			listings = {relPath: self.listDir(relPath)}
+			self._build(group, relPath, listings, excludePatt, lazy=True)
+		group = LazyGroup(title, depth, loader)
+		addDirBinding(group, relPath, excludePatt)
+		return group
+
+	def scanInto(self, group, relPath, excludePatt=None, lazy=False):
+		""" Add the contents of the directory *relPath* to *group*.
+		Sub-directories are added as sub-groups.
+
+		@param excludePatt: Compiled regex. Files and directories with a
+			relative path matching this pattern are skipped.
+		@param lazy: Only list *relPath*, and add its sub-directories as
+			L{LazyGroup}s.
+		"""
+		if lazy:
+			listings = {relPath: self.listDir(relPath)}
+		else:
+			listings = self._listRecursive(relPath, excludePatt)
+		self._build(group, relPath, listings, excludePatt, lazy)
+		return group
+
+
+def addDirBinding(group, relPath, excludePatt):
+	""" Record that the contents of directory *relPath*, filtered by
+	*excludePatt*, has been added to *group*. """
+	meta = group.getMeta(DirScanner)
+	bindings = meta.setdefault("dirs", [])
+	if not (relPath, excludePatt) in bindings:
+		bindings.append((relPath, excludePatt))
+
+def getDirBindings(group):
+	""" Get the directories whose contents has been added to *group*.
+	@return: A list of (relPath, excludePatt) tuples.
+	"""
+	return group.getMeta(DirScanner).get("dirs", [])
+
+def addEmptyDirs(group, emptyGroup, relPath, dirPath):
+	""" Record that the directory *relPath* in the directory *dirPath*,
+	whose contents is added to *group*, was scanned into *emptyGroup*, which
+	was left out since empty groups are never added to a tree. The empty
+	directories below it are recorded as well, so a file added to any of
+	them is found by listing *dirPath* again. """
+	emptyDirs = group.getMeta(DirScanner).setdefault("emptyDirs", {})
+	emptyDirs[relPath] = dirPath
+	for p in getEmptyDirs(emptyGroup):
+		emptyDirs[p] = dirPath
+
+def getEmptyDirs(group):
+	""" Get the empty directories left out of *group*, see L{addEmptyDirs}.
+	@return: A dict mapping the relative path of each empty directory to the
+		directory bound to *group* it was found in.
+	"""
+	return group.getMeta(DirScanner).get("emptyDirs", {})
+
+
+if __name__ == "__main__":
+	import unittest
+	import re
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import makedirs, utime
+
+	class TestDirScanner(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			for d in ("src/main", "src/build/obj", "build"):
+				makedirs(join(self.rootDir, d))
+			for f in ("README", "src/a.c", "src/a.o", "src/main/b.c",
+					"src/build/obj/c.o", "build/d.o"):
+				open(join(self.rootDir, f), "w").close()
+			self.listed = []
+			self.s = DirScanner(self.rootDir, workers=2)
+			listDir = self.s.listDir
+			def recordingListDir(relPath):
+				self.listed.append(relPath)
+				return listDir(relPath)
+			self.s.listDir = recordingListDir
+
+		def tearDown(self):
+			self.s.close()
+			rmtree(self.rootDir)
+
+		def testScanInto(self):
+			root = self.s.scanInto(Group("root", 0), "")
+			src = root.getByTitle("src")
+			self.assertEquals(src.depth, 1)
+			self.assertEquals(src.getByTitle("main").getByTitle("b.c").relPath,
+					join("src", "main", "b.c"))
+			a = src.getByTitle("a.c")
+			self.assertEquals(a.depth, 2)
+			self.assertEquals(a.absPath, join(self.rootDir, "src", "a.c"))
+			self.assertEquals(len(root.childLst), 3)
+			self.assertEquals(getDirBindings(root), [("", None)])
+			self.assertEquals(getDirBindings(src), [("src", None)])
+
+		def testEmptyDirs(self):
+			makedirs(join(self.rootDir, "src", "empty", "deeper"))
+			root = self.s.scanInto(Group("root", 0), "")
+			src = root.getByTitle("src")
+			self.assertFalse("empty" in src.childDct)
+			self.assertEquals(getEmptyDirs(src), {
+				join("src", "empty"): "src",
+				join("src", "empty", "deeper"): "src"})
+
+		def testPruneExcludedDirs(self):
+			patt = re.compile(r"(.*build$)|(.*\.o$)")
+			root = self.s.scanInto(Group("root", 0), "src", patt)
+			self.assertEquals(sorted(root.childDct.keys()), ["a.c", "main"])
+			self.assertEquals(sorted(self.listed), ["src", join("src", "main")])
+
+		def testLazy(self):
+			root = self.s.scanInto(Group("root", 0), "", lazy=True)
+			self.assertEquals(self.listed, [""])
+			src = root.getByTitle("src")
+			self.assertTrue(isinstance(src, LazyGroup))
+			self.assertEquals(sorted([i.title for i in root.iterRecursive()]),
+					["README", "build", "root", "src"])
+			self.assertEquals(src.getByTitle("a.c").depth, 2)
+			self.assertEquals(self.listed, ["", "src"])
+			self.assertEquals(len(list(root.iterRecursive(load=True))), 12)
+
+	class TestListingCache(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			makedirs(join(self.rootDir, "a", "shared"))
+			open(join(self.rootDir, "a", "shared", "x.c"), "w").close()
+			for d in ("a", join("a", "shared")):
+				utime(join(self.rootDir, d), (1000, 1000))
+
+		def tearDown(self):
+			rmtree(self.rootDir)
+
+		def testShare(self):
+			cache = ListingCache()
+			first = cache.share()
+			second = cache.share()
+			listed = []
+			orig = globals()["listDir"]
+			def recordingListDir(absPath):
+				listed.append(absPath)
+				return orig(absPath)
+			globals()["listDir"] = recordingListDir
+			try:
+				a = DirScanner(self.rootDir, cache=first)
+				a.scanInto(Group("a", 0), "a")
+				b = DirScanner(join(self.rootDir, "a"), cache=second)
+				b.scanInto(Group("b", 0), "shared")
+			finally:
+				globals()["listDir"] = orig
+			shared = join(self.rootDir, "a", "shared")
+			self.assertEquals(listed, [join(self.rootDir, "a"), shared])
+			self.assertEquals(second.getUsed().keys(), [shared])
+			self.assertEquals(len(first.getUsed()), 2)
+			self.assertEquals(len(cache.share({"/x": (1, [])}).getUsed()), 0)
+			self.assertTrue("/x" in cache._listings)
+
+	unittest.main()
@@ -0,0 +1,441 @@
+"""
+Content search with a trigram index.
+
+A L{TrigramIndex} holds, for each sequence of three bytes (trigram) found in
+the files of a project, the sorted list of files containing it. A query is
+answered by intersecting the lists of the trigrams in the searched text, and
+only the files in the intersection are read and searched. The content is
+lowercased before it is indexed, so the same index answers case-insensitive
+queries.
+
+Regular expressions are filtered with the literal strings which must be part
+of any match, found by L{requiredLiterals}. A query without any literal of at
+least three characters searches every indexed file.
+
+Files are numbered in the order they are added. When a file changes, its old
+number is marked as deleted, and it is indexed again with a new number, so
+the lists stay sorted by only appending to them. Deleted numbers are dropped
+from the lists when more than half of the numbers are deleted.
+
+The index is saved in the project directory. Each file is stored with the
+(mtime, size) it had when indexed, so only changed files are read again when
+the index is loaded and updated.
+"""
+import re
+import sys
+import marshal
+import sre_parse
+import sre_constants
+from array import array
+from itertools import izip
+from os import stat, rename, remove
+
+
+SEARCH_INDEX_FILENAME = "search.index"
+
+# Increase when the format of the index changes.
+SEARCH_INDEX_VERSION = 1
+
+SEARCH_INDEX_HEADER = "vcode-search %d python-%d.%d\n" % (
+		(SEARCH_INDEX_VERSION,) + tuple(sys.version_info[:2]))
+
+# Files larger than this are not indexed, and never found.
+MAX_FILE_SIZE = 4 * 1024 * 1024
+
+# Files with a NUL byte among their first bytes are considered binary, and
+# are not indexed.
+BINARY_CHECK_SIZE = 1024
+
+
+def trigrams(data):
+	""" Get the set of trigrams in the string *data*. """
+	return set(map("".join, set(izip(data, data[1:], data[2:]))))
+
+def isBinary(data):
+	return "\0" in data[:BINARY_CHECK_SIZE]
+
+def fileKey(absPath):
+	""" Stat *absPath*.
+	@return: (mtime, size), or None if the file does not exist. """
+	try:
+		st = stat(absPath)
+	except OSError:
+		return None
+	return (st.st_mtime, st.st_size)
+
+def readText(absPath, size=None):
+	""" Read the file *absPath*, if it is a text file.
+	@param size: The size of the file, if known.
+	@return: The content, or None if the file is too large, binary or can
+		not be read. """
+	if size is not None and size > MAX_FILE_SIZE:
+		return None
+	try:
+		f = open(absPath, "rb")
+		try:
+			data = f.read(MAX_FILE_SIZE + 1)
+		finally:
+			f.close()
+	except IOError:
+		return None
+	if len(data) > MAX_FILE_SIZE or isBinary(data):
+		return None
+	return data
+
+def requiredLiterals(pattern):
+	""" Get strings that are part of every match of the regex *pattern*.
+	Only literals in the top level of the pattern, in groups, and in
+	repetitions required at least once are found. Alternatives are skipped.
+	@return: A list of strings.
+	"""
+	literals = []
+	_collectLiterals(sre_parse.parse(pattern), literals)
+	return literals
+
+def _collectLiterals(items, literals):
+	run = []
+	for op, av in items:
+		if op == sre_constants.LITERAL and av < 256:
+			run.append(chr(av))
+			continue
+		if run:
+			literals.append("".join(run))
+			run = []
+		if op == sre_constants.SUBPATTERN:
+			_collectLiterals(av[-1], literals)
+		elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) \
+				and av[0] >= 1:
+			_collectLiterals(av[-1], literals)
+	if run:
+		literals.append("".join(run))
+
+def queryPattern(query, regex=False, ignoreCase=False):
+	""" Get the regex and flags searching for *query*.
+	@param regex: *query* is a python regex, not a literal string.
+	@return: (pattern, flags) for re.compile.
+	"""
+	flags = ignoreCase and re.IGNORECASE or 0
+	if regex:
+		return query, flags | re.MULTILINE
+	return re.escape(query), flags
+
+def searchText(regex, data):
+	""" Search *data* with the compiled *regex*. *data* may also be a mmap.
+	@return: A generator yielding (lineNr, line) for each line containing a
+		match. Line numbers start at 1.
+	"""
+	pos = 0
+	lineNr = 1
+	lineStart = 0
+	while True:
+		m = regex.search(data, pos)
+		if m is None:
+			return
+		lineNr += data[lineStart:m.start()].count("\n")
+		lineStart = data.rfind("\n", 0, m.start()) + 1
+		lineEnd = data.find("\n", m.start())
+		if lineEnd < 0:
+			lineEnd = len(data)
+		yield lineNr, data[lineStart:lineEnd].rstrip("\r")
+		if lineEnd >= len(data):
+			return
+		pos = lineEnd + 1
+
+
+class TrigramIndex(object):
+	""" Trigram index of the content of a set of files. See the module
+	docs. """
+	def __init__(self, path=None):
+		"""
+		@param path: The file the index is loaded from and saved to. If None,
+			the index is only kept in memory.
+		"""
+		self.path = path
+		self._paths = [] # absolute path of each file number, None if deleted
+		self._keys = [] # (mtime, size) of each file number
+		self._numbers = {} # file number of each absolute path
+		self._postings = {} # sorted file numbers of each trigram
+		self._deleted = 0
+		self._changed = False
+		if path:
+			self._load()
+
+	def __len__(self):
+		""" The number of files in the index. """
+		return len(self._numbers)
+
+	def _load(self):
+		try:
+			f = open(self.path, "rb")
+		except IOError:
+			return
+		try:
+			if f.readline() != SEARCH_INDEX_HEADER:
+				return
+			data = marshal.load(f)
+		except (EOFError, ValueError, TypeError):
+			return
+		finally:
+			f.close()
+		self._paths = data["paths"]
+		self._keys = data["keys"]
+		for number, path in enumerate(self._paths):
+			if path is None:
+				self._deleted += 1
+			else:
+				self._numbers[path] = number
+		for trigram, numbers in data["postings"].iteritems():
+			postings = self._postings[trigram] = array("i")
+			postings.fromstring(numbers)
+
+	def save(self):
+		""" Save the index to L{path}, if it has changed since it was loaded.
+		Failing to save is not an error; the files are just indexed again
+		the next time. """
+		if not self.path or not self._changed:
+			return
+		data = dict(
+				paths = self._paths,
+				keys = self._keys,
+				postings = dict([(trigram, numbers.tostring())
+					for trigram, numbers in self._postings.iteritems()]))
+		tmpPath = self.path + ".tmp"
+		try:
+			f = open(tmpPath, "wb")
+			try:
+				f.write(SEARCH_INDEX_HEADER)
+				marshal.dump(data, f, 2)
+			finally:
+				f.close()
+			try:
+				rename(tmpPath, self.path)
+			except OSError:
+				# Windows does not replace existing files on rename.
+				remove(self.path)
+				rename(tmpPath, self.path)
+		except (IOError, OSError):
+			return
+		self._changed = False
+
+	def update(self, paths):
+		""" Make the index contain exactly the files in *paths*. Files which
+		are new, or whose mtime or size has changed, are read and indexed.
+		@return: The number of files indexed.
+		"""
+		paths = set(paths)
+		self._remove([p for p in self._numbers if not p in paths])
+		return self.updateFiles(paths)
+
+	def updateFiles(self, paths):
+		""" Index the files in *paths* which are new or have changed since
+		they were indexed, and remove those that no longer exist. Files not
+		in *paths* are kept as they are.
+		@return: The number of files indexed.
+		"""
+		count = 0
+		for path in paths:
+			key = fileKey(path)
+			number = self._numbers.get(path)
+			if number is not None and self._keys[number] == key:
+				continue
+			self._remove([path])
+			if key is not None:
+				self._add(path, key)
+				count += 1
+		self._compactIfNeeded()
+		return count
+
+	def removeFiles(self, paths):
+		""" Remove the files in *paths* from the index. """
+		self._remove(paths)
+		self._compactIfNeeded()
+
+	def _add(self, path, key):
+		number = len(self._paths)
+		self._paths.append(path)
+		self._keys.append(key)
+		self._numbers[path] = number
+		self._changed = True
+		data = readText(path, key[1])
+		if data is None:
+			return
+		postings = self._postings
+		for trigram in trigrams(data.lower()):
+			numbers = postings.get(trigram)
+			if numbers is None:
+				numbers = postings[trigram] = array("i")
+			numbers.append(number)
+
+	def _remove(self, paths):
+		for path in paths:
+			number = self._numbers.pop(path, None)
+			if number is not None:
+				self._paths[number] = None
+				self._deleted += 1
+				self._changed = True
+
+	def _compactIfNeeded(self):
+		""" Renumber the files without the deleted numbers, if more than half
+		of the numbers are deleted. """
+		if self._deleted * 2 <= len(self._paths):
+			return
+		renumber = {}
+		paths = []
+		keys = []
+		for number, path in enumerate(self._paths):
+			if path is not None:
+				renumber[number] = len(paths)
+				paths.append(path)
+				keys.append(self._keys[number])
+		postings = {}
+		for trigram, numbers in self._postings.iteritems():
+			numbers = array("i", [renumber[n] for n in numbers if n in renumber])
+			if numbers:
+				postings[trigram] = numbers
+		self._paths = paths
+		self._keys = keys
+		self._numbers = dict([(path, n) for n, path in enumerate(paths)])
+		self._postings = postings
+		self._deleted = 0
+		self._changed = True
+
+	def candidates(self, literals):
+		""" Get the files which may contain all of *literals*.
+		@return: A sorted list of absolute paths. """
+		wanted = set()
+		for literal in literals:
+			wanted.update(trigrams(literal.lower()))
+		if not wanted:
+			return sorted(self._numbers)
+		postings = []
+		for trigram in wanted:
+			numbers = self._postings.get(trigram)
+			if numbers is None:
+				return []
+			postings.append(numbers)
+		postings.sort(key=len)
+		found = set(postings[0])
+		for numbers in postings[1:]:
+			found.intersection_update(numbers)
+			if not found:
+				return []
+		paths = [self._paths[n] for n in found]
+		return sorted([p for p in paths if p is not None])
+
+	def search(self, query, regex=False, ignoreCase=False):
+		""" Search the indexed files for *query*. The files are read when
+		searched, so changes made after they were indexed are only missed if
+		they add the first match to a file.
+		@param regex: Search for the python regex *query* instead of the
+			literal string.
+		@return: A generator yielding (absPath, lineNr, line) for each line
+			with a match.
+		@raise re.error: If *query* is not a valid regex.
+		"""
+		compiled = re.compile(*queryPattern(query, regex, ignoreCase))
+		if regex:
+			literals = requiredLiterals(query)
+		else:
+			literals = [query]
+		return self._search(compiled, self.candidates(literals))
+
+	def _search(self, compiled, paths):
+		for path in paths:
+			data = readText(path)
+			if data is None:
+				continue
+			for lineNr, line in searchText(compiled, data):
+				yield path, lineNr, line
+
+
+
+if __name__ == "__main__":
+	import unittest
+	import time
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import utime
+	from os.path import join
+
+	class TestTrigramIndex(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			self.paths = []
+			for name, content in (("a.py", "def hello():\n\treturn 42\n"),
+					("b.py", "import a\nprint a.hello()\n"),
+					("c.bin", "hello\0world"),
+					("d.txt", "Hello World")):
+				self._write(name, content)
+			self.indexPath = join(self.rootDir, SEARCH_INDEX_FILENAME)
+			self.index = TrigramIndex(self.indexPath)
+			self.index.update(self.paths)
+
+		def tearDown(self):
+			rmtree(self.rootDir)
+
+		def _write(self, name, content, mtime=1000):
+			path = join(self.rootDir, name)
+			open(path, "wb").write(content)
+			utime(path, (mtime, mtime))
+			if not path in self.paths:
+				self.paths.append(path)
+			return path
+
+		def _search(self, *args, **kw):
+			return [(path[len(self.rootDir)+1:], lineNr, line)
+					for path, lineNr, line in self.index.search(*args, **kw)]
+
+		def testLiteral(self):
+			self.assertEquals(self._search("hello"), [("a.py", 1, "def hello():"),
+					("b.py", 2, "print a.hello()")])
+			self.assertEquals(self._search("hello", ignoreCase=True),
+					[("a.py", 1, "def hello():"), ("b.py", 2, "print a.hello()"),
+					("d.txt", 1, "Hello World")])
+			self.assertEquals(self._search("nothing"), [])
+
+		def testCandidates(self):
+			self.assertEquals(self.index.candidates(["return"]),
+					[join(self.rootDir, "a.py")])
+			self.assertEquals(len(self.index.candidates(["a"])), 4)
+
+		def testRegex(self):
+			self.assertEquals(self._search("^(import|print) a", regex=True),
+					[("b.py", 1, "import a"), ("b.py", 2, "print a.hello()")])
+			self.assertEquals(self._search("ret(urn)+ \\d+$", regex=True),
+					[("a.py", 2, "\treturn 42")])
+
+		def testRequiredLiterals(self):
+			self.assertEquals(requiredLiterals("def (hello|world)\\(x*y+\\)"),
+					["def ", "(", "y", ")"])
+			self.assertEquals(requiredLiterals("(?:foo)?bar"), ["bar"])
+
+		def testIncremental(self):
+			self._write("a.py", "def goodbye(): pass\n", mtime=2000)
+			remove(self.paths.pop(1))
+			self.assertEquals(self.index.updateFiles(self.paths +
+					[join(self.rootDir, "b.py")]), 1)
+			self.assertEquals(self._search("hello"), [])
+			self.assertEquals(self._search("goodbye"),
+					[("a.py", 1, "def goodbye(): pass")])
+			self.assertEquals(self.index.update(self.paths), 0)
+			self.assertEquals(len(self.index), 3)
+
+		def testCompact(self):
+			path = self.paths[0]
+			for mtime in (2000, 3000, 4000, 5000, 6000):
+				self._write("a.py", "x = %d\n" % mtime, mtime=mtime)
+				self.index.updateFiles([path])
+			self.assertEquals(len(self.index._paths), 4)
+			self.assertEquals(self._search("6000"), [("a.py", 1, "x = 6000")])
+			self.assertEquals(self._search("Hello W"), [("d.txt", 1,
+					"Hello World")])
+
+		def testSave(self):
+			self.index.save()
+			loaded = TrigramIndex(self.indexPath)
+			self.assertEquals(len(loaded), 4)
+			self.assertEquals(loaded.update(self.paths), 0)
+			self.assertEquals(loaded.candidates(["return"]),
+					[join(self.rootDir, "a.py")])
+
+	unittest.main()
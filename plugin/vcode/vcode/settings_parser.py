@@ -1,11 +1,18 @@
 import re
-from os.path import isdir, join
-from os import listdir, sep, chdir
+from os.path import join, basename
+from os import sep
 import fnmatch
 from xml.dom import minidom
+from xml.sax import make_parser, SAXParseException
+from xml.sax.handler import ContentHandler, feature_external_ges
 import glob
 
 from file_memorymodel import Group, File
+from scanner import DirScanner
+from globber import Globber
+from snapshot import ProjectSnapshot
+from filter import Filter
+from views import ViewDir, ViewTemplate, ViewDef
 from common import ENCODING
 
 
@@ -13,13 +20,6 @@ from common import ENCODING
 PATHNAME_SEP = "/"
 
 
-def getChildNodeByNodeName(node, childName):
-	""" Get the first childnode of "node" with nodeName "childName". """
-	for child in node.childNodes:
-		if child.nodeName == childName:
-			return child
-	return None
-
 def getTextNodes(node):
 	""" Merge all TEXT_NODE childnodes of "node" into a single string. """
 	t = []
@@ -47,19 +47,20 @@ class PatternCompiler(object):
 
 
 class PatternParser(object):
-	""" Parse a XML node containing zero or one <shellpatterns> and zero or one
-	<pyregex> node, each containing whitespace-separated patterns. """
-	def __init__(self, patternNode):
-		self._patternNode = patternNode
+	""" Parse the text of the <shellpatterns> and <pyregex> nodes of an
+	<exclude>, each containing whitespace-separated patterns. """
+	def __init__(self, patterns):
+		"""
+		@param patterns: dict mapping "shellpatterns" and "pyregex" to the
+			list of text chunks read from the node.
+		"""
+		self._patterns = patterns
 		self._patternCompiler = PatternCompiler()
 		self._parseShellPatterns()
 		self._parsePyRegex()
 
 	def _parseList(self, nodename):
-		n = getChildNodeByNodeName(self._patternNode, nodename)
-		if not n:
-			return []
-		return getTextNodes(n).split()
+		return "".join(self._patterns.get(nodename, [])).split()
 
 	def _parseShellPatterns(self):
 		for shellpatt in self._parseList("shellpatterns"):
@@ -78,119 +79,229 @@ class FilesParseException(Exception):
 	""" Raised when there is some parse error in the <files> config. """
 
 
+class _Frame(object):
+	""" An open element while parsing a <files> config. """
+	FILES, GROUP, DIR, EXCLUDE, PATTERNS, IGNORED = range(6)
+
+	def __init__(self, kind, line, group=None):
+		self.kind = kind
+		self.line = line
+		self.group = group
+		# The frame of the <exclude> of the element, if it has one.
+		self.exclude = None
+		# The files, and the frames of the <group>s and <dir>s, below the
+		# element, in document order.
+		self.children = []
+		self.attrs = {}
+		self.text = []
+		self.patterns = {}
+
+
+class _FilesHandler(ContentHandler):
+	""" Forwards SAX events to a L{FilesParser}. """
+	def __init__(self, parser):
+		ContentHandler.__init__(self)
+		self._parser = parser
+		self._locator = None
+
+	def setDocumentLocator(self, locator):
+		self._locator = locator
+
+	def startElement(self, name, attrs):
+		self._parser._startElement(name, attrs, self._locator.getLineNumber())
+
+	def endElement(self, name):
+		self._parser._endElement()
+
+	def characters(self, content):
+		self._parser._characters(content)
+
+
 class FilesParser(object):
-	def __init__(self, rootDir, projectName):
+	""" Parses <files> configs into a Group/File tree.
+
+	The configs are read with a streaming SAX parser, and the files are
+	created as the elements are read. An <exclude> applies to the whole
+	<group> or <dir> it is in, wherever it comes, so the <dir>s are scanned
+	when their top-level group has been read.
+	"""
+	def __init__(self, rootDir, projectName, listingCache=None, lazy=False,
+			onGroup=None):
+		"""
+		@param listingCache: A L{scanner.ListingCache} used when
+			scanning <dir>-tags.
+		@param lazy: Scan the sub-directories of <dir>-tags when they are
+			opened instead of up front. Can be overridden for each <dir>-tag
+			with lazy="yes" or lazy="no".
+		@param onGroup: Called as onGroup(group) when each top-level group
+			has been parsed and added to the root group.
+		"""
+		self._onGroup = onGroup
 		self._rootDir = rootDir
 		self._projectName = projectName
-		chdir(rootDir)
-		dom  = minidom.getDOMImplementation().createDocument(None, "allFiles",
-				None)
-		self._allFiles = dom.documentElement
+		self._lazy = lazy
+		self._scanner = DirScanner(rootDir, cache=listingCache, prefetch=lazy)
+		# <filesearch>-tags are matched against the listings of the scanner.
+		self._globber = Globber(self._scanner.listDir)
+		# True if the parsed tree depends on more than the scanned directories.
+		self.volatile = False
+		self._filePaths = []
 
 	def addFiles(self, *filePaths):
-		for path in filePaths:
-			dom = minidom.parse(path)
-			filesNode = dom.documentElement
-			self._allFiles.appendChild(filesNode)
+		self._filePaths.extend(filePaths)
 
 	def parse(self):
 		rootGroup = Group(self._projectName, 0)
-		self._parseFilesNode(rootGroup, self._allFiles.firstChild)
+		try:
+			for path in self._filePaths:
+				self._parseFile(rootGroup, path)
+		finally:
+			self._scanner.close()
 		return rootGroup
 
-	def _parseFilesNode(self, rootGroup, filesNode):
-		for node in filesNode.childNodes:
-			self._parseNode(rootGroup, node, excludePatt=None)
-		if filesNode != self._allFiles.lastChild:
-			self._parseFilesNode(rootGroup, filesNode.nextSibling)
-
-	def _parseExclude(self, node, parentExclude=None):
-		excludeNode = getChildNodeByNodeName(node, "exclude")
-		if excludeNode:
-			inherit = excludeNode.getAttribute("inherit")
-			regex = []
-			if parentExclude and inherit == "yes":
-				regex = [parentExclude]
-			
-			p = PatternParser(excludeNode).toRegex()
-			if p:
-				regex.append(p)
-	
-			if regex:
-				return "|".join(regex)
+	def _parseFile(self, rootGroup, path):
+		self._path = path
+		self._rootGroup = rootGroup
+		self._stack = []
+		parser = make_parser()
+		parser.setFeature(feature_external_ges, False)
+		parser.setContentHandler(_FilesHandler(self))
+		try:
+			parser.parse(path)
+		except SAXParseException, e:
+			raise FilesParseException("%s:%d: %s" % (path, e.getLineNumber(),
+				e.getMessage()))
+
+	def _error(self, line, message):
+		return FilesParseException("%s:%d: %s" % (self._path, line, message))
+
+	def _startElement(self, name, attrs, line):
+		if not self._stack:
+			self._stack.append(_Frame(_Frame.FILES, line, self._rootGroup))
+			return
+		parent = self._stack[-1]
+		frame = _Frame(_Frame.IGNORED, line)
+		if parent.kind in (_Frame.FILES, _Frame.GROUP):
+			if name == "group":
+				group = Group(attrs.get("title", ""), parent.group.depth+1)
+				frame = _Frame(_Frame.GROUP, line, group)
+				if parent.kind == _Frame.GROUP:
+					parent.children.append(frame)
+			elif name == "exclude":
+				if parent.kind == _Frame.GROUP:
+					frame = self._startExclude(parent, attrs, line)
+			elif parent.kind != _Frame.GROUP:
+				raise self._error(line,
+						"<%s> must be directly below a <group>." % name)
+			elif name == "file":
+				parent.children.append(self._parseFileNode(parent.group, attrs))
+			elif name == "filesearch":
+				parent.children.extend(
+						self._parseFileSearchNode(parent.group, attrs))
+			elif name == "dir":
+				frame = _Frame(_Frame.DIR, line, parent.group)
+				frame.attrs = dict(attrs)
+				parent.children.append(frame)
+		elif parent.kind == _Frame.DIR:
+			if name == "exclude":
+				frame = self._startExclude(parent, attrs, line)
+		elif parent.kind == _Frame.EXCLUDE:
+			if name in ("shellpatterns", "pyregex") \
+					and not name in parent.patterns:
+				frame = _Frame(_Frame.PATTERNS, line)
+				parent.patterns[name] = frame.text
+		self._stack.append(frame)
+
+	def _startExclude(self, parent, attrs, line):
+		""" Start the <exclude> of *parent*. Only the first is used. """
+		if parent.exclude is not None:
+			return _Frame(_Frame.IGNORED, line)
+		frame = _Frame(_Frame.EXCLUDE, line)
+		frame.attrs = dict(attrs)
+		parent.exclude = frame
+		return frame
+
+	def _endElement(self):
+		frame = self._stack.pop()
+		if frame.kind == _Frame.GROUP and self._stack[-1].kind == _Frame.FILES:
+			self._buildGroup(frame, None)
+			self._rootGroup.add(frame.group)
+			if self._onGroup and not frame.group.isEmpty():
+				self._onGroup(frame.group)
+
+	def _buildGroup(self, frame, parentExclude):
+		""" Add the children of the <group> of *frame* to its group, scanning
+		its <dir>s. Child groups are added unless they are empty. """
+		exclude = self._excludeOf(frame, parentExclude)
+		group = frame.group
+		for child in frame.children:
+			if not isinstance(child, _Frame):
+				group.add(child)
+			elif child.kind == _Frame.GROUP:
+				self._buildGroup(child, exclude)
+				group.add(child.group)
 			else:
-				return None
-		else:
+				self._parseDirNode(group, child.attrs,
+						self._excludeOf(child, exclude))
+
+	def _excludeOf(self, frame, parentExclude):
+		""" Get the exclude pattern of the element of *frame*. """
+		if frame.exclude is None:
 			return parentExclude
+		return self._parseExclude(frame.exclude, parentExclude)
+
+	def _characters(self, content):
+		frame = self._stack[-1]
+		if frame.kind == _Frame.PATTERNS:
+			frame.text.append(content)
+
+	def _parseExclude(self, excludeFrame, parentExclude=None):
+		inherit = excludeFrame.attrs.get("inherit")
+		regex = []
+		if parentExclude and inherit == "yes":
+			regex = [parentExclude]
 
+		p = PatternParser(excludeFrame.patterns).toRegex()
+		if p:
+			regex.append(p)
 
-	def _parseFileSearchNode(self, parentGroup, node):
-		pattern = node.getAttribute("pattern")
-		print pattern
-		files = glob.glob(pattern)
-		for path in files:
-			print path
-			parentGroup.add(File(
-				basename(path),
-				path,
-				self.getAbsolutePath(path),
-				parentGroup.depth+1))
-
-	def _parseFileNode(self, parentGroup, node):
-		path = node.getAttribute("path")
-		parentGroup.add(File(
-			node.getAttribute("title") or path,
+		if regex:
+			return "|".join(regex)
+		else:
+			return None
+
+	def _parseFileSearchNode(self, parentGroup, attrs):
+		""" Get the files matching the pattern of a <filesearch>, relative to
+		the root directory. See L{globber.Globber}. """
+		pattern = attrs.get("pattern", "")
+		return [File(
+				basename(relPath),
+				relPath,
+				join(self._rootDir, relPath),
+				parentGroup.depth+1)
+			for relPath, isDir in self._globber.glob(pattern) if not isDir]
+
+	def _parseFileNode(self, parentGroup, attrs):
+		path = attrs.get("path", "")
+		return File(
+			attrs.get("title") or path,
 			self.getRelativePath(path),
 			self.getAbsolutePath(path),
-			parentGroup.depth+1))
-
-	def _parseDir(self, title, path, depth, compiledExcludePatt, group=None):
-		g = group or Group(title, depth)
-		for f in listdir(self.getAbsolutePath(path)):
-			p = join(path, f)
-			if isdir(self.getAbsolutePath(p)):
-				g.add(self._parseDir(f, p, depth+1, compiledExcludePatt))
-			else:
-				if compiledExcludePatt and compiledExcludePatt.match(p):
-					continue
-				g.add(File(f, p, join(self._rootDir, p), depth+1))
-		return g
+			parentGroup.depth+1)
 
-	def _parseDirNode(self, parentGroup, node, excludePatt):
-		excludePatt = self._parseExclude(node, excludePatt)
+	def _parseDirNode(self, parentGroup, attrs, excludePatt):
 		if excludePatt:
 			compiledExcludePatt = re.compile(excludePatt)
 		else:
 			compiledExcludePatt = None
-		path = node.getAttribute("path")
-		self._parseDir(None, path,
-				parentGroup.depth, compiledExcludePatt,
-				parentGroup)
-
-	def _parseGroupNode(self, parentGroup, node, excludePatt=None):
-		excludePatt = self._parseExclude(node, excludePatt)
-		title = node.getAttribute("title")
-		group = Group(title, parentGroup.depth+1)
-		for c in node.childNodes:
-			self._parseNode(group, c, excludePatt)
-		parentGroup.add(group)
-
-	def _parseNode(self, parentGroup, node, excludePatt=None):
-		if node.nodeType != minidom.Node.ELEMENT_NODE:
-			return
-		if node.tagName == "group":
-			self._parseGroupNode(parentGroup, node, excludePatt=excludePatt)
-		elif node.tagName == "exclude":
-			return
-		elif not node.parentNode.tagName in ("group"):
-			raise FilesParseException("<%s> must be directly below a <group>."
-					% node.tagName)
-		elif node.tagName == "file":
-			self._parseFileNode(parentGroup, node)
-		elif node.tagName == "filesearch":
-			self._parseFileSearchNode(parentGroup, node)
-		elif node.tagName == "dir":
-			self._parseDirNode(parentGroup, node, excludePatt)
+		path = attrs.get("path", "")
+		lazy = attrs.get("lazy")
+		if lazy:
+			lazy = lazy == "yes"
+		else:
+			lazy = self._lazy
+		self._scanner.scanInto(parentGroup, self.getRelativePath(path),
+				compiledExcludePatt, lazy)
 
 	def getRelativePath(self, relativePath):
 		return relativePath.replace(PATHNAME_SEP, sep)
@@ -199,10 +310,321 @@ class FilesParser(object):
 		return join(self._rootDir, self.getRelativePath(relativePath))
 
 
+class FiltersParseException(Exception):
+	""" Raised when there is some parse error in the <filters> config. """
+
+
+class FiltersParser(object):
+	""" Parse the named <filter>s in *.filters.xml files into
+	L{filter.Filter}s. """
+	def __init__(self):
+		self.filters = {}
+
+	def addFilters(self, *filePaths):
+		for path in filePaths:
+			filtersNode = minidom.parse(path).documentElement
+			for node in filtersNode.childNodes:
+				if node.nodeType == minidom.Node.ELEMENT_NODE \
+						and node.tagName == "filter":
+					self._parseFilterNode(node)
+
+	def _parseFilterNode(self, node):
+		name = node.getAttribute("name").encode(ENCODING)
+		if not name:
+			raise FiltersParseException("<filter> requires a name.")
+		f = Filter(name=name, description=node.getAttribute("description"))
+		for rule in getTextNodes(node).split():
+			try:
+				f.addPattern(rule)
+			except ValueError, e:
+				raise FiltersParseException("In filter %s: %s" % (name, e))
+		self.filters[name] = f
+
+
+def parseFilters(projectDir):
+	""" Parse the *.filters.xml files in *projectDir*.
+	@return: dict mapping the name of each filter to a L{filter.Filter}.
+	"""
+	filtersParser = FiltersParser()
+	filterPaths = glob.glob(join(projectDir, "*.filters.xml"))
+	filterPaths.sort()
+	filtersParser.addFilters(*filterPaths)
+	return filtersParser.filters
+
+
+class ViewsParseException(Exception):
+	""" Raised when there is some parse error in the <views> config. """
+
+
+class ViewsParser(object):
+	""" Parse the <viewTemplate>s and <view>s in *.views.xml files into
+	L{views.ViewTemplate}s and L{views.ViewDef}s. """
+	def __init__(self, filters):
+		"""
+		@param filters: The named filters of the project, used by the filter
+			attribute of <dir>-tags.
+		"""
+		self._filters = filters
+		self.templates = {}
+		self.views = {}
+
+	def addViews(self, *filePaths):
+		for path in filePaths:
+			viewsNode = minidom.parse(path).documentElement
+			for node in self._elements(viewsNode):
+				if node.tagName == "viewTemplate":
+					self._parseTemplateNode(node)
+				elif node.tagName == "view":
+					self._parseViewNode(node)
+		for view in self.views.itervalues():
+			for templateName, d in view.links:
+				if not templateName in self.templates:
+					raise ViewsParseException("View %s: No template named %s."
+							% (view.name, templateName))
+
+	def _elements(self, node, tagName=None):
+		return [child for child in node.childNodes
+				if child.nodeType == minidom.Node.ELEMENT_NODE
+				and (tagName is None or child.tagName == tagName)]
+
+	def _name(self, node):
+		name = node.getAttribute("name").encode(ENCODING)
+		if not name:
+			raise ViewsParseException("<%s> requires a name." % node.tagName)
+		return name
+
+	def _parseTemplateNode(self, node):
+		template = ViewTemplate(self._name(node))
+		for groupNode in self._elements(node, "group"):
+			title = groupNode.getAttribute("title") \
+					or groupNode.getAttribute("name")
+			dirs = [self._parseDirNode(template, d)
+					for d in self._elements(groupNode, "dir")]
+			template.addGroup(title.encode(ENCODING), dirs)
+		self.templates[template.name] = template
+
+	def _parseDirNode(self, template, node):
+		filterName = node.getAttribute("filter").encode(ENCODING)
+		filterNodes = self._elements(node, "filter")
+		f = None
+		if filterName and filterNodes:
+			raise ViewsParseException("Template %s: Use either the filter "
+					"attribute or a <filter> in <dir>." % template.name)
+		elif filterName:
+			f = self._filters.get(filterName)
+			if f is None:
+				raise ViewsParseException("Template %s: No filter named %s."
+						% (template.name, filterName))
+		elif filterNodes:
+			try:
+				f = Filter(getTextNodes(filterNodes[0]).split())
+			except ValueError, e:
+				raise ViewsParseException("Template %s: %s" % (template.name, e))
+		return ViewDir(node.getAttribute("path").encode(ENCODING), f,
+				flatten = node.getAttribute("flatten") == "yes",
+				pathsep = node.getAttribute("pathsep").encode(ENCODING) or "/",
+				ignoreExtension = node.getAttribute("ignoreExtension") == "yes")
+
+	def _parseViewNode(self, node):
+		view = ViewDef(self._name(node))
+		for link in self._elements(node, "viewTemplateLink"):
+			view.addLink(self._name(link),
+					link.getAttribute("dir").encode(ENCODING))
+		self.views[view.name] = view
+
+
+def parseViews(projectDir, filters):
+	""" Parse the *.views.xml files in *projectDir*.
+	@param filters: The named filters of the project, see L{parseFilters}.
+	@return: (templates, views), dicts mapping names to
+		L{views.ViewTemplate}s and L{views.ViewDef}s.
+	"""
+	viewsParser = ViewsParser(filters)
+	viewPaths = glob.glob(join(projectDir, "*.views.xml"))
+	viewPaths.sort()
+	viewsParser.addViews(*viewPaths)
+	return viewsParser.templates, viewsParser.views
+
+
 class SettingsParser(object):
-	def __init__(self, projectDir, projectName, rootDir):
-		f = FilesParser(rootDir, projectName)
+	def __init__(self, projectDir, projectName, rootDir, useSnapshot=True,
+			lazy=False, onGroup=None, listingCache=None):
+		"""
+		@param useSnapshot: Load the files from the L{snapshot.ProjectSnapshot}
+			in *projectDir* when it is up to date, and update it when it is not.
+		@param lazy: See L{FilesParser.__init__}.
+		@param onGroup: See L{FilesParser.__init__}. When the files are loaded
+			from the snapshot, it is called for each top-level group after
+			loading.
+		@param listingCache: A L{scanner.ListingCache} shared with the other
+			projects of a workspace.
+		"""
+		self.filters = parseFilters(projectDir)
+
 		filePaths = glob.glob(join(projectDir, "*.files.xml"))
 		filePaths.sort()
-		f.addFiles(*filePaths)
-		self.files = f.parse()
+		if not useSnapshot:
+			if listingCache is not None:
+				listingCache = listingCache.share()
+			f = FilesParser(rootDir, projectName, listingCache, lazy, onGroup)
+			self.files = self._parseFiles(f, filePaths)
+			return
+
+		snapshot = ProjectSnapshot(projectDir, projectName, rootDir, filePaths,
+				options=dict(lazy=lazy), listingCache=listingCache)
+		self.files = snapshot.loadTree(DirScanner(rootDir,
+				cache=snapshot.listingCache, prefetch=lazy))
+		if self.files is None:
+			f = FilesParser(rootDir, projectName, snapshot.listingCache, lazy,
+					onGroup)
+			self.files = self._parseFiles(f, filePaths)
+			snapshot.save(self.files, f.volatile)
+		elif onGroup:
+			for group in self.files.iterChildren():
+				onGroup(group)
+
+	def _parseFiles(self, filesParser, filePaths):
+		filesParser.addFiles(*filePaths)
+		return filesParser.parse()
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import makedirs
+
+	class TestFilesParser(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			makedirs(join(self.rootDir, "src"))
+			for f in ("a.c", "a.o", "a.log", "README"):
+				open(join(self.rootDir, "src", f), "w").close()
+
+		def tearDown(self):
+			rmtree(self.rootDir)
+
+		def _parse(self, *configs):
+			self.groups = []
+			p = FilesParser(self.rootDir, "test", onGroup=self.groups.append)
+			for i, config in enumerate(configs):
+				path = join(self.rootDir, "%d.files.xml" % i)
+				open(path, "w").write(config)
+				p.addFiles(path)
+			return p.parse()
+
+		def _titles(self, group):
+			return sorted([i.title for i in group.iterChildren()])
+
+		def testExcludeInherit(self):
+			root = self._parse("""<files>
+				<group title="g">
+					<exclude><shellpatterns>*.o</shellpatterns></exclude>
+					<group title="inherited"><dir path="src"/></group>
+					<group title="expanded">
+						<dir path="src">
+							<exclude inherit="yes"><pyregex>.*log$</pyregex></exclude>
+						</dir>
+					</group>
+					<group title="replaced">
+						<dir path="src">
+							<exclude><shellpatterns>*/README</shellpatterns></exclude>
+						</dir>
+					</group>
+				</group>
+				</files>""")
+			g = root.getByTitle("g")
+			self.assertEquals(self._titles(g.getByTitle("inherited")),
+					["README", "a.c", "a.log"])
+			self.assertEquals(self._titles(g.getByTitle("expanded")),
+					["README", "a.c"])
+			self.assertEquals(self._titles(g.getByTitle("replaced")),
+					["a.c", "a.log", "a.o"])
+
+		def testFilesAndConfigOrder(self):
+			root = self._parse(
+					'<files><group title="x"><file path="src/a.c"/></group></files>',
+					'<files><group title="y"><file path="src/README"/></group></files>')
+			self.assertEquals([g.title for g in root.iterChildren()], ["x", "y"])
+			self.assertEquals([g.title for g in self.groups], ["x", "y"])
+			a = root.getByTitle("x").getByTitle("src/a.c")
+			self.assertEquals(a.absPath, join(self.rootDir, "src", "a.c"))
+			self.assertEquals(a.depth, 2)
+
+		def testFileSearch(self):
+			makedirs(join(self.rootDir, "src", "sub"))
+			open(join(self.rootDir, "src", "sub", "b.c"), "w").close()
+			root = self._parse('<files><group title="x">'
+					'<filesearch pattern="src/*.c"/>'
+					'<filesearch pattern="src/**/*.c"/>'
+					'<filesearch pattern="src/*"/>'
+					'</group></files>')
+			x = root.getByTitle("x")
+			self.assertEquals([i.relPath for i in x.iterChildren()],
+					[join("src", "a.c"), join("src", "a.c"),
+					join("src", "sub", "b.c"), join("src", "README"),
+					join("src", "a.c"), join("src", "a.log"), join("src", "a.o")])
+			self.assertEquals(x.getByTitle("b.c").absPath,
+					join(self.rootDir, "src", "sub", "b.c"))
+
+		def testViews(self):
+			path = join(self.rootDir, "maven.views.xml")
+			open(path, "w").write("""<views>
+				<viewTemplate name="maven">
+					<group title="${dir}/java/">
+						<dir path="${dir}/src/main/java" filter="java"
+							flatten="yes" pathsep="." ignoreExtension="yes"/>
+					</group>
+					<group title="${dir}/python/">
+						<dir path="${dir}/src/main/python"><filter>+*.py</filter></dir>
+					</group>
+				</viewTemplate>
+				<view name="maven">
+					<viewTemplateLink name="maven" dir="/ui"/>
+				</view>
+				</views>""")
+			java = Filter(["+*.java"])
+			templates, views = parseViews(self.rootDir, {"java": java})
+			groups = templates["maven"].groups
+			self.assertEquals([title for title, dirs in groups],
+					["${dir}/java/", "${dir}/python/"])
+			d = groups[0][1][0]
+			self.assertEquals((d.path, d.filter, d.flatten, d.pathsep,
+					d.ignoreExtension), ("${dir}/src/main/java", java, True, ".",
+					True))
+			self.assertEquals(str(groups[1][1][0].filter), "+*.py")
+			self.assertEquals(views["maven"].links, [("maven", "/ui")])
+			self.assertRaises(ViewsParseException, parseViews, self.rootDir, {})
+
+		def testErrorLineNumbers(self):
+			try:
+				self._parse('<files>\n<group title="x"/>\n<file path="a"/>\n</files>')
+			except FilesParseException, e:
+				self.assertTrue(str(e).endswith(
+						"0.files.xml:3: <file> must be directly below a <group>."))
+			else:
+				self.fail()
+			self.assertRaises(FilesParseException, self._parse,
+					'<files>\n<group>\n</files>')
+
+		def testExcludeAfterElements(self):
+			root = self._parse("""<files>
+				<group title="g">
+					<file path="src/a.o"/>
+					<group title="inherited"><dir path="src"/></group>
+					<dir path="src">
+						<exclude inherit="yes"><pyregex>.*log$</pyregex></exclude>
+					</dir>
+					<exclude><shellpatterns>*.o</shellpatterns></exclude>
+					<exclude><shellpatterns>*.c</shellpatterns></exclude>
+				</group>
+				</files>""")
+			g = root.getByTitle("g")
+			titles = [i.title for i in g.iterChildren()]
+			self.assertEquals(titles[:2], ["src/a.o", "inherited"])
+			self.assertEquals(sorted(titles[2:]), ["README", "a.c"])
+			self.assertEquals(self._titles(g.getByTitle("inherited")),
+					["README", "a.c", "a.log"])
+
+	unittest.main()
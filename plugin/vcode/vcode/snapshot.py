@@ -0,0 +1,310 @@
+"""
+On-disk snapshot of the parsed project tree.
+
+The snapshot is stored in the project directory. It contains the tree created
+by L{settings_parser.FilesParser}, and the directory listings used to create
+it. The snapshot is keyed on the mtime and md5 of each config file, and the
+tree is only used as-is when none of the listed directories have changed
+since the snapshot was written. Otherwise the config is parsed again with the
+old listings in a L{scanner.ListingCache}, so only the changed directories
+are listed again.
+"""
+import marshal
+import re
+import sys
+from hashlib import md5
+from os import stat, rename, remove
+from os.path import join
+
+from file_memorymodel import Group, LazyGroup, File
+from scanner import DirScanner, ListingCache, addDirBinding, getDirBindings, \
+		getEmptyDirs
+from common import ENCODING
+
+
+SNAPSHOT_FILENAME = "snapshot"
+
+# Increase when the format of the snapshot changes.
+SNAPSHOT_VERSION = 4
+
+SNAPSHOT_HEADER = "vcode-snapshot %d python-%d.%d\n" % (
+		(SNAPSHOT_VERSION,) + tuple(sys.version_info[:2]))
+
+
+def encodeTree(item):
+	""" Encode the tree below *item* as nested tuples. Groups are encoded as
+	(title, children-tuple, dir-bindings, empty-dirs) and files as
+	(title, relPath).
+	L{LazyGroup}s which are not loaded are encoded with None as children. """
+	if isinstance(item, Group):
+		bindings = tuple([(relPath, excludePatt and excludePatt.pattern)
+				for relPath, excludePatt in getDirBindings(item)])
+		if isinstance(item, LazyGroup) and not item.loaded:
+			children = None
+		else:
+			children = tuple([encodeTree(i) for i in item.iterChildren()])
+		emptyDirs = tuple(sorted(getEmptyDirs(item).items()))
+		return (item.title, children, bindings, emptyDirs)
+	else:
+		return (item.title, item.relPath)
+
+def decodeTree(encoded, rootDir, depth=0, scanner=None, _patterns=None):
+	""" Inverse of L{encodeTree}.
+	@param rootDir: Root directory of the project. Used to create the
+		absolute path of files.
+	@param scanner: The L{scanner.DirScanner} used to load lazy groups.
+	"""
+	if _patterns is None:
+		_patterns = {None: None}
+		scanner = scanner or DirScanner(rootDir)
+	if len(encoded) == 2:
+		title, relPath = encoded
+		return File(title.decode(ENCODING), relPath, join(rootDir, relPath),
+				depth)
+	title, children, bindings, emptyDirs = encoded
+	title = title.decode(ENCODING)
+	for relPath, pattern in bindings:
+		if not pattern in _patterns:
+			_patterns[pattern] = re.compile(pattern)
+	if children is None:
+		relPath, pattern = bindings[0]
+		return scanner.makeLazyGroup(title, depth, relPath, _patterns[pattern])
+	group = Group(title, depth)
+	for relPath, pattern in bindings:
+		addDirBinding(group, relPath, _patterns[pattern])
+	if emptyDirs:
+		group.getMeta(DirScanner)["emptyDirs"] = dict(emptyDirs)
+	for child in children:
+		group.add(decodeTree(child, rootDir, depth+1, scanner, _patterns))
+	return group
+
+
+class ProjectSnapshot(object):
+	""" Load and save the snapshot of a project. """
+	def __init__(self, projectDir, projectName, rootDir, configPaths,
+			options=None, listingCache=None):
+		"""
+		@param configPaths: The config files the tree is created from.
+		@param options: dict with any other options affecting the tree.
+		@param listingCache: A L{scanner.ListingCache} shared with other
+			projects. L{listingCache} shares its listings, see
+			L{scanner.ListingCache.share}.
+		"""
+		self.path = join(projectDir, SNAPSHOT_FILENAME)
+		self._rootDir = rootDir
+		self._key = self._makeKey(projectName, rootDir, configPaths,
+				options or {})
+		self._data = self._load()
+		listings = None
+		if self._data:
+			listings = self._data["listings"]
+		if listingCache is None:
+			self.listingCache = ListingCache(listings)
+		else:
+			self.listingCache = listingCache.share(listings)
+
+	def _makeKey(self, projectName, rootDir, configPaths, options):
+		configs = []
+		for path in configPaths:
+			digest = md5(open(path, "rb").read()).hexdigest()
+			configs.append((path, stat(path).st_mtime, digest))
+		return (projectName, rootDir, tuple(configs),
+				tuple(sorted(options.items())))
+
+	def _load(self):
+		try:
+			f = open(self.path, "rb")
+		except IOError:
+			return None
+		try:
+			if f.readline() != SNAPSHOT_HEADER:
+				return None
+			data = marshal.load(f)
+		except (EOFError, ValueError, TypeError):
+			return None
+		finally:
+			f.close()
+		if not isinstance(data, dict):
+			return None
+		return data
+
+	def _isUnchanged(self):
+		""" Check the listings of the snapshot against the directories. Not
+		against L{listingCache}, which may hold newer listings of the same
+		directories when it is shared with other projects. """
+		for absPath, (mtime, entries) in self._data["listings"].iteritems():
+			try:
+				if mtime is None or stat(absPath).st_mtime != mtime:
+					return False
+			except OSError:
+				return False
+		return True
+
+	def loadTree(self, scanner=None):
+		""" Load the tree from the snapshot.
+
+		@param scanner: The L{scanner.DirScanner} used to load lazy groups.
+			Defaults to a scanner using L{listingCache}.
+		@return: The root group, or None if there is no usable snapshot, the
+			config files have changed, or any of the scanned directories have
+			changed.
+		"""
+		if not self._data or self._data["key"] != self._key \
+				or self._data["volatile"] or not self._isUnchanged():
+			return None
+		scanner = scanner or DirScanner(self._rootDir, cache=self.listingCache)
+		return decodeTree(self._data["tree"], self._rootDir, scanner=scanner)
+
+	def save(self, root, volatile=False):
+		""" Save *root*, and the listings used by L{listingCache}, to the
+		snapshot file. Failing to write the snapshot is not an error; the
+		project is just parsed again on the next start.
+
+		@param volatile: True if *root* contains files that can not be
+			validated against the listings (like <filesearch> results).
+			A volatile snapshot is only used for its listings.
+		"""
+		data = dict(
+				key = self._key,
+				tree = encodeTree(root),
+				listings = self.listingCache.getUsed(),
+				volatile = volatile)
+		tmpPath = self.path + ".tmp"
+		try:
+			f = open(tmpPath, "wb")
+			try:
+				f.write(SNAPSHOT_HEADER)
+				marshal.dump(data, f, 2)
+			finally:
+				f.close()
+			try:
+				rename(tmpPath, self.path)
+			except OSError:
+				# Windows does not replace existing files on rename.
+				remove(self.path)
+				rename(tmpPath, self.path)
+		except (IOError, OSError):
+			pass
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import makedirs, utime
+	from settings_parser import FilesParser
+
+	class TestProjectSnapshot(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			self.projectDir = join(self.rootDir, "test.vcode")
+			makedirs(self.projectDir)
+			makedirs(join(self.rootDir, "src", "sub"))
+			for f in ("src/a.c", "src/sub/b.c"):
+				open(join(self.rootDir, f), "w").close()
+			self.config = join(self.projectDir, "project.files.xml")
+			open(self.config, "w").write(
+					'<files><group title="src"><dir path="src"/></group></files>')
+			self._makeOld("src", "src/sub")
+
+		def tearDown(self):
+			rmtree(self.rootDir)
+
+		def _makeOld(self, *dirs, **kw):
+			# Listings of recently modified directories are not trusted.
+			mtime = kw.get("mtime", 1000)
+			for d in dirs:
+				utime(join(self.rootDir, d), (mtime, mtime))
+
+		def _parse(self, projectDir=None, config=None, listingCache=None):
+			config = config or self.config
+			snapshot = ProjectSnapshot(projectDir or self.projectDir, "test",
+					self.rootDir, [config], listingCache=listingCache)
+			root = snapshot.loadTree()
+			if root is not None:
+				return root, None
+			p = FilesParser(self.rootDir, "test", snapshot.listingCache)
+			p.addFiles(config)
+			root = p.parse()
+			snapshot.save(root)
+			return root, snapshot.listingCache
+
+		def _titles(self, root):
+			return [i.title for i in root.iterRecursive()]
+
+		def testEncodeDecode(self):
+			makedirs(join(self.rootDir, "src", "empty"))
+			root, cache = self._parse()
+			decoded = decodeTree(encodeTree(root), self.rootDir)
+			self.assertEquals(self._titles(decoded), self._titles(root))
+			a = decoded.getByTitle("src").getByTitle("a.c")
+			self.assertEquals(a.relPath, join("src", "a.c"))
+			self.assertEquals(a.absPath, join(self.rootDir, "src", "a.c"))
+			self.assertEquals(a.depth, 2)
+			self.assertEquals(getDirBindings(decoded.getByTitle("src")),
+					[("src", None)])
+			self.assertEquals(getEmptyDirs(decoded.getByTitle("src")),
+					{join("src", "empty"): "src"})
+
+		def testEncodeLazy(self):
+			root = Group("root", 0)
+			lazy = DirScanner(self.rootDir).makeLazyGroup("src", 1, "src")
+			root.add(lazy)
+			decoded = decodeTree(encodeTree(root), self.rootDir)
+			self.assertFalse(lazy.loaded)
+			decodedLazy = decoded.getByIndex(0)
+			self.assertTrue(isinstance(decodedLazy, LazyGroup))
+			self.assertEquals(decodedLazy.getByTitle("a.c").depth, 2)
+
+		def testWarmStart(self):
+			root, cache = self._parse()
+			self.assertNotEquals(cache, None)
+			warmRoot, cache = self._parse()
+			self.assertEquals(cache, None)
+			self.assertEquals(self._titles(warmRoot), self._titles(root))
+
+		def testRescanChangedDirs(self):
+			self._parse()
+			open(join(self.rootDir, "src", "sub", "c.c"), "w").close()
+			self._makeOld("src/sub", mtime=2000)
+			listed = []
+			listDir = ListingCache.listDir
+			def recordingListDir(cache, absPath):
+				if not cache.isValid(absPath):
+					listed.append(absPath)
+				return listDir(cache, absPath)
+			ListingCache.listDir = recordingListDir
+			try:
+				root, cache = self._parse()
+			finally:
+				ListingCache.listDir = listDir
+			self.assertEquals(listed, [join(self.rootDir, "src", "sub")])
+			self.assertTrue("c.c" in self._titles(root))
+
+		def testStaleSnapshotWithSharedCache(self):
+			# Two projects of a workspace showing the same directory.
+			otherDir = join(self.rootDir, "other.vcode")
+			makedirs(otherDir)
+			otherConfig = join(otherDir, "project.files.xml")
+			open(otherConfig, "w").write(
+					'<files><group title="sub"><dir path="src/sub"/></group></files>')
+			self._parse()
+			open(join(self.rootDir, "src", "sub", "c.c"), "w").close()
+			self._makeOld("src/sub", mtime=2000)
+			shared = ListingCache()
+			other, cache = self._parse(otherDir, otherConfig, shared)
+			self.assertTrue("c.c" in self._titles(other))
+			root, cache = self._parse(listingCache=shared)
+			self.assertNotEquals(cache, None)
+			self.assertTrue("c.c" in self._titles(root))
+
+		def testConfigChanged(self):
+			self._parse()
+			open(self.config, "w").write(
+					'<files><group title="x"><dir path="src"/></group></files>')
+			root, cache = self._parse()
+			self.assertNotEquals(cache, None)
+			self.assertEquals(root.getByIndex(0).title, "x")
+
+	unittest.main()
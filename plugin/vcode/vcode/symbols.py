@@ -0,0 +1,468 @@
+"""
+Index of the symbols defined in the files of a project.
+
+Definitions are found by lightweight, line-based scanners for C/C++
+(.c, .cpp, .h, .hpp), Java and Python files. They are not parsers; they find
+the usual way of writing functions, classes, types and macros, and may miss
+unusual formatting.
+
+A L{SymbolIndex} caches the symbols of each file with its (mtime, size) and
+the md5 of its content. When the mtime or size of a file has changed, the file
+is read again, and only scanned if its md5 has changed too. Files are read and
+scanned in batches by a pool of processes (see L{procpool}), or of threads.
+
+Symbols are looked up by name in a dict, and names are completed from a
+sorted list of every name, searched with bisect.
+"""
+import re
+import sys
+import marshal
+from hashlib import md5
+from bisect import bisect_left, bisect_right
+from os import stat, rename, remove
+from os.path import splitext
+from multiprocessing.pool import ThreadPool
+
+from procpool import ProcessPool
+
+
+SYMBOLS_FILENAME = "symbols"
+
+# Increase when the format of the cache, or the scanners, change.
+SYMBOLS_VERSION = 2
+
+SYMBOLS_HEADER = "vcode-symbols %d python-%d.%d\n" % (
+		(SYMBOLS_VERSION,) + tuple(sys.version_info[:2]))
+
+# Files larger than this are not scanned.
+MAX_FILE_SIZE = 4 * 1024 * 1024
+
+_CPP_PREFIX = r"^(?:[A-Za-z_][\w:<>,*& \t]*?[ \t*&]+)?"
+
+# (regex, kind) for each language. The regexes have a "name" group, and a
+# "kind" group when kind is None.
+_RULES = {
+	"python": [
+		(r"^[ \t]*(?P<kind>def|class)[ \t]+(?P<name>\w+)", None),
+	],
+	"java": [
+		(r"^[ \t]*(?:(?:public|protected|private|static|final|abstract|"
+			r"strictfp)[ \t]+)*(?P<kind>class|interface|enum)[ \t]+"
+			r"(?P<name>\w+)", None),
+		# A method, or constructor, with a return type or a modifier before
+		# its name. Statements like "return f(a," are not.
+		(r"^[ \t]+(?:(?:public|protected|private|static|final|abstract|"
+			r"synchronized|native|strictfp)[ \t]+)*(?:<[^>\n]*>[ \t]+)?"
+			r"(?!(?:return|new|throw|else|case|yield)\b)"
+			r"[\w.$]+(?:<[^()\n]*>)?(?:\[\])*[ \t]+(?P<name>\w+)"
+			r"[ \t]*\([^;\n]*$", "method"),
+		# A constructor with only its name, when its parameters are closed and
+		# followed by its body or throws. Calls split over lines are not.
+		(r"^[ \t]+(?P<name>\w+)[ \t]*\([^();\n]*\)[ \t]*(?:\{|throws\b)"
+			r"[^;\n]*$", "method"),
+	],
+	"cpp": [
+		(r"^[ \t]*#[ \t]*define[ \t]+(?P<name>\w+)", "macro"),
+		(r"^[ \t]*(?:typedef[ \t]+)?(?P<kind>struct|class|union|enum)"
+			r"[ \t]+(?P<name>\w+)[^;\n]*$", None),
+		(r"^[ \t]*typedef\b[^;(\n]*?\b(?P<name>\w+)[ \t]*;", "typedef"),
+		(_CPP_PREFIX + r"(?:\w+::)*(?P<name>~?\w+)[ \t]*\([^;\n]*$",
+			"function"),
+	],
+}
+_RULES = dict([(language, [(re.compile(regex, re.MULTILINE), kind)
+		for regex, kind in rules]) for language, rules in _RULES.iteritems()])
+
+_LANGUAGES = {
+	".c": "cpp", ".cpp": "cpp", ".h": "cpp", ".hpp": "cpp",
+	".java": "java",
+	".py": "python",
+}
+
+# Words matched by the scanners which are not names of definitions.
+_KEYWORDS = set(["if", "for", "while", "switch", "return", "else", "do",
+		"new", "throw", "catch", "sizeof", "case", "super", "this",
+		"synchronized"])
+
+
+def getLanguage(path):
+	""" Get the language of the file *path* from its extension.
+	@return: The language, or None if the file is not scanned. """
+	return _LANGUAGES.get(splitext(path)[1].lower())
+
+def scanSymbols(data, language):
+	""" Find the definitions in *data*, the content of a file.
+	@return: A list of (name, kind, lineNr) ordered by line. Line numbers
+		start at 1.
+	"""
+	lineStarts = [0]
+	lineStarts.extend([m.end() for m in re.finditer("\n", data)])
+	symbols = []
+	for regex, kind in _RULES[language]:
+		for m in regex.finditer(data):
+			name = m.group("name")
+			if name in _KEYWORDS:
+				continue
+			symbols.append((name, kind or m.group("kind"),
+					bisect_right(lineStarts, m.start())))
+	symbols.sort(key=lambda s: s[2])
+	return symbols
+
+def scanFile(path, digest=None):
+	""" Read and scan the file *path*.
+	@param digest: The md5 of the file when it was last scanned.
+	@return: (key, digest, symbols). *symbols* is None if the md5 is still
+		*digest*, and *key* is None if the file can not be read. """
+	try:
+		st = stat(path)
+		key = (st.st_mtime, st.st_size)
+		if st.st_size > MAX_FILE_SIZE:
+			return key, None, ()
+		f = open(path, "rb")
+		try:
+			data = f.read()
+		finally:
+			f.close()
+	except (IOError, OSError):
+		return None, None, ()
+	newDigest = md5(data).hexdigest()
+	if newDigest == digest:
+		return key, digest, None
+	return key, newDigest, tuple(scanSymbols(data, getLanguage(path)))
+
+def scanBatch(files):
+	""" Scan a batch of (path, digest). Run in the processes of the pool.
+	@return: A list of (path, key, digest, symbols). """
+	return [(path,) + scanFile(path, digest) for path, digest in files]
+
+
+class SymbolIndex(object):
+	""" Symbols defined in a set of files. See the module docs. """
+
+	# Number of files scanned by each task in the pool. Fewer files are
+	# scanned without starting a pool.
+	BATCH_SIZE = 100
+
+	def __init__(self, path=None, workers=None, python=None):
+		"""
+		@param path: The file the cache is loaded from and saved to. If
+			None, the cache is only kept in memory.
+		@param workers: Number of processes. Defaults to the number of cpus.
+		@param python: Scan in processes run by this python interpreter. If
+			None, the files are scanned in threads, since forking vim is not
+			safe. See L{procpool}.
+		"""
+		self.path = path
+		self._workers = workers
+		self._python = python
+		# (mtime, size), md5 and symbols of each file, by absolute path.
+		self._files = {}
+		self._byName = {}
+		self._names = []
+		# True when the cache has changed since it was saved.
+		self._changed = False
+		# True when _byName and _names are out of date.
+		self._dirty = False
+		if path:
+			self._load()
+			self._rebuild()
+
+	def _load(self):
+		try:
+			f = open(self.path, "rb")
+		except IOError:
+			return
+		try:
+			if f.readline() != SYMBOLS_HEADER:
+				return
+			self._files = marshal.load(f)
+		except (EOFError, ValueError, TypeError):
+			return
+		finally:
+			f.close()
+
+	def save(self):
+		""" Save the cache to L{path}, if it has changed. Failing to save is
+		not an error; the files are just scanned again the next time. """
+		if not self.path or not self._changed:
+			return
+		tmpPath = self.path + ".tmp"
+		try:
+			f = open(tmpPath, "wb")
+			try:
+				f.write(SYMBOLS_HEADER)
+				marshal.dump(self._files, f, 2)
+			finally:
+				f.close()
+			try:
+				rename(tmpPath, self.path)
+			except OSError:
+				# Windows does not replace existing files on rename.
+				remove(self.path)
+				rename(tmpPath, self.path)
+		except (IOError, OSError):
+			return
+		self._changed = False
+
+	def update(self, paths):
+		""" Make the index contain the symbols of exactly the files in
+		*paths* which are in a supported language.
+		@return: The number of files scanned.
+		"""
+		paths = set([p for p in paths if getLanguage(p)])
+		removed = [p for p in self._files if not p in paths]
+		for path in removed:
+			del self._files[path]
+		if removed:
+			self._changed = self._dirty = True
+		return self.updateFiles(paths)
+
+	def updateFiles(self, paths):
+		""" Scan the files in *paths* which are new or have changed, and
+		remove those that no longer exist. Files not in *paths* are kept.
+		@return: The number of files read.
+		"""
+		todo = []
+		for path in paths:
+			if not getLanguage(path):
+				continue
+			cached = self._files.get(path)
+			try:
+				st = stat(path)
+			except OSError:
+				if cached:
+					del self._files[path]
+					self._changed = self._dirty = True
+				continue
+			if cached and cached[0] == (st.st_mtime, st.st_size):
+				continue
+			todo.append((path, cached and cached[1]))
+		for path, key, digest, symbols in self._scan(todo):
+			if key is None:
+				self._files.pop(path, None)
+			elif symbols is None:
+				# Touched, but not changed.
+				self._files[path] = (key, digest, self._files[path][2])
+			else:
+				self._files[path] = (key, digest, symbols)
+		if todo:
+			self._changed = self._dirty = True
+		if self._dirty:
+			self._rebuild()
+		return len(todo)
+
+	def removeFiles(self, paths):
+		""" Remove the files in *paths* from the index. """
+		for path in paths:
+			if self._files.pop(path, None) is not None:
+				self._changed = self._dirty = True
+		if self._dirty:
+			self._rebuild()
+
+	def _scan(self, todo):
+		if len(todo) < self.BATCH_SIZE:
+			return scanBatch(todo)
+		if self._python:
+			pool = ProcessPool(self._python, self._workers)
+		else:
+			pool = ThreadPool(self._workers)
+		try:
+			results = []
+			batches = [todo[i:i+self.BATCH_SIZE]
+					for i in xrange(0, len(todo), self.BATCH_SIZE)]
+			for batch in pool.imap_unordered(scanBatch, batches):
+				results.extend(batch)
+			return results
+		finally:
+			pool.terminate()
+			pool.join()
+
+	def _rebuild(self):
+		byName = {}
+		for path, (key, digest, symbols) in self._files.iteritems():
+			for name, kind, lineNr in symbols:
+				byName.setdefault(name, []).append((name, kind, path, lineNr))
+		for found in byName.itervalues():
+			found.sort(key=lambda s: (s[2], s[3]))
+		self._byName = byName
+		self._names = sorted(byName)
+		self._dirty = False
+
+	def __len__(self):
+		""" The number of distinct names. """
+		return len(self._names)
+
+	def lookup(self, name):
+		""" Get the definitions of *name*.
+		@return: A list of (name, kind, absPath, lineNr), ordered by path and
+			line. """
+		return self._byName.get(name, [])
+
+	def complete(self, prefix, limit=None):
+		""" Get the names starting with *prefix*, in sorted order.
+		@param limit: The maximum number of names returned. """
+		start = bisect_left(self._names, prefix)
+		if prefix:
+			end = bisect_left(self._names, prefix[:-1] +
+					chr(ord(prefix[-1]) + 1), start)
+		else:
+			end = len(self._names)
+		if limit is not None:
+			end = min(end, start + limit)
+		return self._names[start:end]
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import utime
+	from os.path import join
+
+	CPP = """#include "a.h"
+#define MAX_SIZE 10
+typedef unsigned int uint;
+struct Point {
+	int x;
+};
+struct Forward;
+static int add(int a, int b)
+{
+	if (a) {
+		return add(a - 1, b);
+	}
+}
+void
+Foo::bar(const char *s) {
+}
+int declared(int a);
+"""
+
+	JAVA = """package x;
+public class Hello extends Object {
+	private int count;
+	public Hello(int count) {
+	}
+	public static List<String> greet(String name) throws Exception {
+		if (name == null) {
+			throw new Exception();
+		}
+		return call(name);
+	}
+	abstract void run();
+}
+interface Runner {}
+"""
+
+	JAVA_CALLS = """class Calls {
+	Calls() throws Exception {
+	}
+	public int run() {
+		return compute(a,
+				b);
+		log(a,
+				b);
+		synchronized (this) {
+		}
+	}
+	private static int compute(int a,
+			int b) {
+	}
+}
+"""
+
+	PY = """class Hello(object):
+	def greet(self):
+		def inner():
+			pass
+"""
+
+	class TestScanSymbols(unittest.TestCase):
+		def _scan(self, data, language):
+			return [(name, kind) for name, kind, lineNr in
+					scanSymbols(data, language)]
+
+		def testCpp(self):
+			self.assertEquals(scanSymbols(CPP, "cpp"), [
+				("MAX_SIZE", "macro", 2), ("uint", "typedef", 3),
+				("Point", "struct", 4), ("add", "function", 8),
+				("bar", "function", 15)])
+
+		def testJava(self):
+			self.assertEquals(self._scan(JAVA, "java"), [("Hello", "class"),
+					("Hello", "method"), ("greet", "method"),
+					("Runner", "interface")])
+
+		def testJavaMultiLineCalls(self):
+			self.assertEquals(scanSymbols(JAVA_CALLS, "java"), [
+				("Calls", "class", 1), ("Calls", "method", 2),
+				("run", "method", 4), ("compute", "method", 12)])
+
+		def testPython(self):
+			self.assertEquals(self._scan(PY, "python"), [("Hello", "class"),
+					("greet", "def"), ("inner", "def")])
+
+	class TestSymbolIndex(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			self.paths = []
+			for name, content in (("a.cpp", CPP), ("Hello.java", JAVA),
+					("hello.py", PY), ("README", "class NotCode")):
+				path = join(self.rootDir, name)
+				open(path, "w").write(content)
+				utime(path, (1000, 1000))
+				self.paths.append(path)
+			self.cachePath = join(self.rootDir, SYMBOLS_FILENAME)
+			self.index = SymbolIndex(self.cachePath, workers=2)
+			self.assertEquals(self.index.update(self.paths), 3)
+
+		def tearDown(self):
+			rmtree(self.rootDir)
+
+		def testLookup(self):
+			self.assertEquals(self.index.lookup("Hello"), [
+				("Hello", "class", self.paths[1], 2),
+				("Hello", "method", self.paths[1], 4),
+				("Hello", "class", self.paths[2], 1)])
+			self.assertEquals(self.index.lookup("NotCode"), [])
+
+		def testComplete(self):
+			self.assertEquals(self.index.complete("gr"), ["greet"])
+			self.assertEquals(self.index.complete("H"), ["Hello"])
+			self.assertEquals(self.index.complete("M"), ["MAX_SIZE"])
+			self.assertEquals(len(self.index.complete("")), len(self.index))
+			self.assertEquals(self.index.complete("", limit=2), ["Hello",
+					"MAX_SIZE"])
+
+		def testIncremental(self):
+			py = self.paths[2]
+			utime(py, (2000, 2000))
+			self.assertEquals(self.index.updateFiles([py]), 1)
+			open(py, "w").write("def renamed(): pass\n")
+			self.assertEquals(self.index.updateFiles([py]), 1)
+			self.assertEquals(self.index.lookup("inner"), [])
+			self.assertEquals(self.index.lookup("renamed"), [
+				("renamed", "def", py, 1)])
+			self.assertEquals(self.index.updateFiles([py]), 0)
+
+		def testCache(self):
+			self.index.save()
+			loaded = SymbolIndex(self.cachePath)
+			self.assertEquals(loaded.lookup("add"), self.index.lookup("add"))
+			self.assertEquals(loaded.update(self.paths[1:]), 0)
+			self.assertEquals(loaded.lookup("add"), [])
+
+		def testPool(self):
+			paths = []
+			for i in xrange(SymbolIndex.BATCH_SIZE * 3):
+				path = join(self.rootDir, "m%d.py" % i)
+				open(path, "w").write("def f%d(): pass\n" % i)
+				paths.append(path)
+			for python in (None, sys.executable):
+				index = SymbolIndex(workers=2, python=python)
+				self.assertEquals(index.update(paths), len(paths))
+				self.assertEquals(index.lookup("f250"), [
+					("f250", "def", paths[250], 1)])
+
+	unittest.main()
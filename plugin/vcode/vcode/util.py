@@ -1,59 +1,33 @@
 import vim
-from os.path import exists, join, splitext
-import subprocess
-from os import linesep
+from diffstream import DiffStream
+from vimbridge import windows, CommandBatch
 
 def goToWindowByNr(nr):
-	vim.command('exec %d . "wincmd w"' % nr)
+	windows.goTo(nr)
 
 def windowNrFromName(name):
-	return int(vim.eval("bufwinnr('^%s$')" % name))
+	return windows.windowNr(name)
 
 def currentTabNr():
-	return int(vim.eval("tabpagenr()"))
+	return windows.current()[0]
 
 def goToWindowByBufName(name):
-	orig = currentTabNr()
-	while True:
-		nr = windowNrFromName(name)
-		if nr >= 0:
-			goToWindowByNr(nr)
-			return True
-		vim.command("tabnext")
-		if currentTabNr() == orig:
-			return False
-
-def cppAltHeaderFile():
-	""" Opens the header file for the current c/c++ source file, if
-	a .c/.cpp file is open, or the source file if a .h/.hpp file is
-	open.
-	
-	You should have "set hidden" in your .vimrc to retain file history,
-	and to enable switching files with unsaved changes.
-	"""
-	name = vim.current.buffer.name
-	root, ext = splitext(name)
-	if ext in (".h", ".hpp"):
-		extensions = [".cpp", ".c"]
-	elif ext in (".c", ".cpp"):
-		extensions = [".hpp", ".h"]
-	else:
-		return
+	""" Move to a window showing the buffer *name*, in the current tab if
+	there is one.
+	@return: False if the buffer is not shown in any window. """
+	return windows.goToBuffer(name) is not None
 
-	for e in extensions:
-		path = root + e
-		if exists(path):
-			vim.command("edit %s" % path)
-			return
+def scratchBuffer(title, *commands):
+	""" Open a new tab with an empty buffer which is never saved, and run
+	*commands* in it. Everything is run in a single call into vim. """
+	CommandBatch("tabnew " + title,
+		"setlocal nonumber buftype=nofile bufhidden=delete noswapfile "
+			"nobuflisted nowrap",
+		*commands).execute()
 
-def colorDiff(title, lines):
-	vim.command("tabnew " + title)
-	vim.command("setlocal nonumber")
-	vim.command("setlocal buftype=nofile")
-	vim.command("setlocal bufhidden=delete")
-	vim.command("setlocal noswapfile")
-	vim.command("setlocal nobuflisted")
-	vim.command("setlocal nowrap")
+def colorDiffBuffer(title, *commands):
+	""" Open a scratch buffer with diff syntax highlighting, and run
+	*commands* in it. """
 	syntax = (
 		"syn match add #^+.*#",
 		"syn match add #^+++.*#",
@@ -67,13 +41,124 @@ def colorDiff(title, lines):
 		"hi def link info Special",
 		"hi def link separator String",
 	)
-	for s in syntax:
-		vim.command(s)
+	scratchBuffer(title, *(syntax + commands))
+
+def colorDiff(title, lines):
+	colorDiffBuffer(title)
+	vim.current.buffer[:] = lines
+	vim.command("setlocal nomodifiable")
+
+# The buffer and DiffStream of each diff shown by colorDiffCommand, by
+# buffer number.
+_diffViews = {}
+_diffTimer = None
+
+# Lines added to each diff buffer by one call to pollDiffs.
+MAX_DIFF_LINES_PER_POLL = 20000
+
+def colorDiffCommand(cmd, cwd=None):
+	""" Show the output of the diff command *cmd* as it is read. The lines
+	are added in chunks by L{pollDiffs}, called from a timer, so vim stays
+	responsive during huge diffs. Without timers, the chunks are added when
+	the cursor moves in the diff, or vim is idle there. ]] and [[ jump to
+	the next and previous hunk, and ]f and [f to the next and previous
+	file. """
+	global _diffTimer
+	commands = ["nnoremap <buffer> %s :python vcode.util.jumpInDiff(%r)<CR>"
+			% (key, where) for key, where in (("]]", "nextHunk"),
+			("[[", "previousHunk"), ("]f", "nextFile"), ("[f", "previousFile"))]
+	hasTimers = vim.eval("has('timers')") == "1"
+	if not hasTimers:
+		# VCodeWatchFiles, which polls from CursorHold, is off by default.
+		commands.append("au CursorHold,CursorMoved <buffer> "
+				"python vcode.util.pollDiffs()")
+	colorDiffBuffer("\\ ".join(cmd), "setlocal nomodifiable", *commands)
+	buffer = vim.current.buffer
+	stream = DiffStream(cmd, cwd)
+	_diffViews[buffer.number] = (buffer, stream)
+	stream.start()
+	if _diffTimer is None and hasTimers:
+		_diffTimer = int(vim.eval(
+				"timer_start(100, 'VCodePollDiffs', {'repeat': -1})"))
+	pollDiffs()
+
+def _setDiffStatus(buffer, status):
+	vim.command("call setbufvar(%d, '&statusline', %r)" % (buffer.number,
+			status.replace("%", "%%")))
+
+def pollDiffs():
+	""" Add the lines read since the last call to the buffers of the diffs
+	shown by L{colorDiffCommand}. Diffs whose buffer has been closed are
+	cancelled. """
+	global _diffTimer
+	streaming = False
+	for number, (buffer, stream) in _diffViews.items():
+		if not buffer.valid:
+			stream.cancel()
+			del _diffViews[number]
+			continue
+		if stream.done:
+			continue
+		lines = stream.poll(MAX_DIFF_LINES_PER_POLL)
+		if lines:
+			start = len(stream.index) - len(lines)
+			# The first lines replace the empty line of the new buffer.
+			replaceLines(buffer, start, start or 1, lines)
+		if stream.error:
+			_setDiffStatus(buffer, "diff failed: " + stream.error)
+		elif stream.done:
+			_setDiffStatus(buffer, "diff: %d lines" % len(stream.index))
+		else:
+			streaming = True
+			_setDiffStatus(buffer, "diff: %d lines, reading..." %
+					len(stream.index))
+	if not streaming and _diffTimer is not None:
+		vim.command("call timer_stop(%d)" % _diffTimer)
+		_diffTimer = None
+
+def cancelDiff():
+	""" Stop the diff command of the diff in the current buffer. """
+	view = _diffViews.get(vim.current.buffer.number)
+	if view and not view[1].done:
+		view[1].cancel()
+		view[1].done = True
+		_setDiffStatus(view[0], "diff: %d lines, cancelled" %
+				len(view[1].index))
+
+def jumpInDiff(where):
+	""" Move the cursor in the current diff buffer.
+	@param where: The L{diffstream.DiffIndex} method finding the line, like
+		"nextHunk". """
+	view = _diffViews.get(vim.current.buffer.number)
+	if view is None:
+		return
+	line = getattr(view[1].index, where)(vim.current.window.cursor[0] - 1)
+	if line is not None:
+		vim.current.window.cursor = (line + 1, 0)
+
+def searchResults(title, lines, rootDir):
+	""" Show search results in a scratch buffer. Each line is formatted like
+	"path:lineNr:text", with the path relative to *rootDir*. <CR> opens the
+	file under the cursor at the line.
+	@return: The buffer. """
+	syntax = (
+		"syn match searchPos #^[^:]*:\\d\\+:# contains=searchLineNr",
+		"syn match searchLineNr #:\\d\\+:# contained",
+		"syn match searchInfo #^\" .*#",
+
+		"hi def link searchPos String",
+		"hi def link searchLineNr Special",
+		"hi def link searchInfo Comment",
+	)
+	scratchBuffer(title, "setlocal path=%s" % rootDir.replace(" ", "\\ "),
+			"nnoremap <buffer> <CR> gF", *syntax)
 	vim.current.buffer[:] = lines
 	vim.command("setlocal nomodifiable")
+	return vim.current.buffer
 
-def colorDiffCommand(cmd):
-	p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	stdout = p.communicate()[0]
-	lines = stdout.split(linesep)
-	colorDiff("\\ ".join(cmd), lines)
+def replaceLines(buffer, start, end, lines):
+	""" Replace lines *start* to *end* of the nomodifiable *buffer*, like a
+	buffer created by L{searchResults}, with *lines*. """
+	vim.command("call setbufvar(%d, '&modifiable', 1)" % buffer.number)
+	buffer[start:end] = lines
+	vim.command("call setbufvar(%d, '&modifiable', 0)" % buffer.number)
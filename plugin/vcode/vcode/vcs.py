@@ -0,0 +1,333 @@
+"""
+Version control status shown in the project browser.
+
+A L{GitStatus} runs a single C{git status --porcelain=v2 -z} for the whole
+repository each time it is refreshed, never one command per file. The output
+is parsed while it is read, in a background thread, into a dict from absolute
+path to status letter. L{GitStatus.poll}, called from vim's main thread, maps
+the status onto the files of a L{file_memorymodel.FileIndex} with
+L{file_memorymodel.FileIndex.getFiles}, and sets their extraInfo to markers
+like "[git:M]". The groups above a changed file are marked as dirty with
+"[git:*]".
+
+Git updates .git/index when files are staged or committed, so the status is
+only read again when the mtime of the index has changed. Changes to the work
+tree do not touch the index, so callers force a refresh when they know files
+have changed, like after a file has been written (see L{project.Project.fileSaved}).
+"""
+import sys
+from os import devnull, stat, sep
+from os.path import join, normpath
+from threading import Thread
+from Queue import Queue, Empty
+from subprocess import Popen, PIPE
+
+
+# The key of the decoration in FileTreeItem.extraInfo.
+EXTRA_INFO_KEY = "git"
+# The status letter of groups containing changed files.
+DIRTY = "*"
+
+
+class GitError(Exception):
+	""" Raised when git fails. """
+
+
+def formatStatus(letter):
+	return "[git:%s]" % letter
+
+def statusLetter(xy):
+	""" Get the letter displayed for the XY field of a porcelain v2 entry.
+	The work tree status (Y) is preferred over the index status (X). """
+	if xy[1] != ".":
+		return xy[1]
+	return xy[0]
+
+def parseStatus(f, chunkSize=65536):
+	""" Parse the output of C{git status --porcelain=v2 -z} from the file *f*,
+	reading at most *chunkSize* bytes at a time.
+	@return: A generator yielding (path, letter) for each entry. *path* is
+		relative to the top of the repository, with / as separator.
+	"""
+	pending = ""
+	skipOrigPath = False
+	while True:
+		data = f.read(chunkSize)
+		if not data:
+			break
+		records = (pending + data).split("\0")
+		pending = records.pop()
+		for record in records:
+			if skipOrigPath:
+				# The path a renamed or copied file had before.
+				skipOrigPath = False
+				continue
+			kind = record[:1]
+			if kind == "1":
+				fields = record.split(" ", 8)
+				yield fields[8], statusLetter(fields[1])
+			elif kind == "2":
+				fields = record.split(" ", 9)
+				skipOrigPath = True
+				yield fields[9], statusLetter(fields[1])
+			elif kind == "u":
+				yield record.split(" ", 10)[10], "U"
+			elif kind == "?":
+				yield record[2:], "?"
+			# Ignored files (!) and headers (#) are not shown.
+
+def _git(args, cwd, git="git"):
+	""" Run git with *args* in *cwd*.
+	@return: The started process, with its output in process.stdout. """
+	return Popen([git] + args, cwd=cwd, stdout=PIPE, stderr=open(devnull, "w"),
+			close_fds=sys.platform != "win32")
+
+def findRepository(rootDir, git="git"):
+	""" Find the git repository containing *rootDir*.
+	@return: (topDir, gitDir), or None if *rootDir* is not in a repository.
+		*topDir* is the top of the work tree, spelled from *rootDir* so it
+		matches the paths in the project even through symbolic links.
+	"""
+	try:
+		process = _git(["rev-parse", "--show-cdup", "--absolute-git-dir"],
+				rootDir, git)
+	except OSError:
+		return None
+	out = process.communicate()[0]
+	if process.returncode != 0:
+		return None
+	cdup, gitDir = out.split("\n")[:2]
+	return normpath(join(rootDir, cdup)), gitDir
+
+def readStatus(topDir, git="git"):
+	""" Get the status of the files in the repository with the work tree
+	*topDir*. Untracked files are listed one by one, not by directory.
+	@return: A dict from absolute path to status letter.
+	@raise GitError: If git fails.
+	"""
+	# --no-optional-locks keeps git from writing the index, which would
+	# change its mtime and make the next refresh run git again.
+	process = _git(["--no-optional-locks", "status", "--porcelain=v2", "-z",
+			"--untracked-files=all"], topDir, git)
+	status = {}
+	for path, letter in parseStatus(process.stdout):
+		status[join(topDir, path.replace("/", sep))] = letter
+	if process.wait() != 0:
+		raise GitError("git status failed in %s" % topDir)
+	return status
+
+
+class GitStatus(object):
+	""" Background git status of the files in a L{file_memorymodel.FileIndex},
+	and decoration of their extraInfo. """
+	def __init__(self, fileindex, rootDir, git="git"):
+		"""
+		@param rootDir: A directory in the work tree of the repository.
+		@param git: The git executable.
+		"""
+		self._fileindex = fileindex
+		self._rootDir = rootDir
+		self._git = git
+		self._repository = None
+		self._status = {}
+		self._decorations = {}
+		# The (mtime, size) of the index when the status was last read.
+		self._key = None
+		self._thread = None
+		self._forced = False
+		self._stale = False
+		self._results = Queue()
+		fileindex.addListener(self._onIndexPatched)
+
+	def _onIndexPatched(self, group, removed, added):
+		self._stale = True
+
+	def _indexKey(self):
+		try:
+			st = stat(join(self._repository[1], "index"))
+		except OSError:
+			return None
+		return (st.st_mtime, st.st_size)
+
+	def refresh(self, force=False):
+		""" Read the status in the background, unless the index has not
+		changed since it was last read. The result is applied by L{poll}.
+		@param force: Read the status even if the index has not changed,
+			like after files in the work tree have changed.
+		"""
+		if self._thread is not None and self._thread.isAlive():
+			self._forced = self._forced or force
+			return
+		if self._repository is None:
+			self._repository = findRepository(self._rootDir, self._git) or False
+		if not self._repository:
+			return
+		key = self._indexKey()
+		if key == self._key and not force and not self._forced:
+			return
+		self._key = key
+		self._forced = False
+		self._thread = Thread(target=self._read, name="vcode-git-status")
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def _read(self):
+		try:
+			self._results.put(readStatus(self._repository[0], self._git))
+		except (OSError, GitError):
+			self._results.put({})
+
+	def getStatus(self, absPath):
+		""" Get the status letter of *absPath*, like "M" or "?".
+		@return: The letter, or None if the file is unchanged. """
+		return self._status.get(absPath)
+
+	def poll(self):
+		""" Apply the status read since the last call, and the status of
+		files added to the index. Never blocks.
+		@return: The items whose decoration changed.
+		"""
+		status = None
+		while True:
+			try:
+				status = self._results.get_nowait()
+			except Empty:
+				break
+		if status is None and not self._stale:
+			return []
+		if status is not None:
+			self._status = status
+		self._stale = False
+		if self._forced:
+			self.refresh()
+		return self._decorate()
+
+	def _decorate(self):
+		""" Map the status onto the files in the index, and mark the groups
+		above them as dirty.
+		@return: The items whose decoration changed. """
+		decorations = {}
+		for absPath, letter in self._status.iteritems():
+			for f in self._fileindex.getFiles(absPath):
+				decorations[f] = formatStatus(letter)
+				parent = f.parent
+				while parent is not None and not parent in decorations:
+					decorations[parent] = formatStatus(DIRTY)
+					parent = parent.parent
+
+		changed = []
+		for item in self._decorations:
+			if not item in decorations:
+				item.extraInfo.pop(EXTRA_INFO_KEY, None)
+				changed.append(item)
+		for item, decoration in decorations.iteritems():
+			if item.extraInfo.get(EXTRA_INFO_KEY) != decoration:
+				item.extraInfo[EXTRA_INFO_KEY] = decoration
+				changed.append(item)
+		self._decorations = decorations
+		return changed
+
+
+
+if __name__ == "__main__":
+	import unittest
+	import subprocess
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import makedirs
+	from os.path import basename
+	from StringIO import StringIO
+	from file_memorymodel import File, Group, FileIndex
+
+	class TestParseStatus(unittest.TestCase):
+		def testParse(self):
+			out = StringIO("\0".join([
+				"# branch.oid 0123",
+				"1 .M N... 100644 100644 100644 0123 0123 src/a b.c",
+				"1 A. N... 000000 100644 100644 0000 0123 new.c",
+				"2 R. N... 100644 100644 100644 0123 0123 R100 moved.c",
+				"old.c",
+				"u UU N... 100644 100644 100644 100644 01 02 03 conflict.c",
+				"? untracked.c",
+				"! ignored.o"]) + "\0")
+			self.assertEquals(list(parseStatus(out, chunkSize=7)), [
+				("src/a b.c", "M"), ("new.c", "A"), ("moved.c", "R"),
+				("conflict.c", "U"), ("untracked.c", "?")])
+
+	class TestGitStatus(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			makedirs(join(self.rootDir, "src", "sub"))
+			for name in ("a.c", "sub/b.c", "c.c"):
+				open(join(self.rootDir, "src", name), "w").write(name)
+			self._git("init", "-q")
+			self._git("add", "src/a.c", "src/sub/b.c")
+			self._git("commit", "-q", "-m", "initial")
+			open(join(self.rootDir, "src", "sub", "b.c"), "w").write("changed")
+
+			self.files = {}
+			for relPath in ("src/a.c", "src/sub/b.c", "src/c.c"):
+				name = basename(relPath)
+				self.files[name] = File(name, relPath,
+						join(self.rootDir, relPath), 2)
+			self.sub = Group("sub", 1, self.files["b.c"])
+			self.other = Group("other", 1, self.files["a.c"], self.files["c.c"])
+			self.root = Group("root", 0, self.sub, self.other)
+			self.index = FileIndex(self.root)
+			self.status = GitStatus(self.index, join(self.rootDir, "src"))
+
+		def tearDown(self):
+			rmtree(self.rootDir)
+
+		def _git(self, *args):
+			subprocess.check_call(["git", "-c", "user.name=vcode",
+					"-c", "user.email=vcode@example.com"] + list(args),
+					cwd=self.rootDir)
+
+		def _poll(self, force=False):
+			self.status.refresh(force)
+			if self.status._thread:
+				self.status._thread.join()
+			return self.status.poll()
+
+		def _decorations(self):
+			return dict([(item.title, item.extraInfo.get(EXTRA_INFO_KEY))
+					for item in self.index if EXTRA_INFO_KEY in item.extraInfo])
+
+		def testStatus(self):
+			self.assertEquals(len(self._poll()), 5)
+			self.assertEquals(self._decorations(), {"b.c": "[git:M]",
+					"c.c": "[git:?]", "sub": "[git:*]", "other": "[git:*]",
+					"root": "[git:*]"})
+			self.assertEquals(self.status.getStatus(self.files["c.c"].absPath),
+					"?")
+
+		def testCache(self):
+			self._poll()
+			thread = self.status._thread
+			open(self.files["a.c"].absPath, "w").write("changed")
+			self.assertEquals(self._poll(), [])
+			self.assertTrue(self.status._thread is thread)
+			self.assertEquals(self._poll(force=True), [self.files["a.c"]])
+			self.assertEquals(self.files["a.c"].extraInfo[EXTRA_INFO_KEY],
+					"[git:M]")
+
+		def testCommit(self):
+			self._poll()
+			self._git("add", "src")
+			self._git("commit", "-q", "-m", "all")
+			self._poll()
+			self.assertEquals(self._decorations(), {})
+
+		def testIndexPatched(self):
+			self._poll()
+			copy = File("c.c", "c.c", self.files["c.c"].absPath, 2)
+			self.sub.add(copy)
+			self.index.patch(self.sub)
+			self.assertEquals(self.status.poll(), [copy])
+
+		def testNotRepository(self):
+			rmtree(join(self.rootDir, ".git"))
+			self.assertEquals(self._poll(), [])
+
+	unittest.main()
@@ -0,0 +1,353 @@
+"""
+Views: other ways of showing the files of a project.
+
+A view shows the files of the project tree grouped differently, like the
+Java sources of every module below one group per module, with the packages
+flattened and the extensions hidden, so src/main/java/com/foo/Bar.java is
+shown as com.foo.Bar. Views are configured in *.views.xml files in the
+project directory (see L{settings_parser.parseViews}) as
+L{ViewTemplate}s, which are applied to directories of the project by
+L{ViewDef}s.
+
+The files of a view are L{ViewFile}s: small proxies of the files in the
+project tree, with their own title and depth, sharing the path and extraInfo
+of the file they show. A view is built the first time it is used, and then
+kept up to date as the project index is patched, touching only the files
+added or removed. Each view has its own L{file_memorymodel.FileIndex}, so it
+can be shown by a browser of its own.
+"""
+from os import sep
+from os.path import splitext
+from string import Template
+
+from file_memorymodel import File, Group, FileIndex
+from fsabstraction import normVirtualPath, VIRTPATH_SEP
+
+
+class ViewFile(File):
+	""" A file in a view, showing the L{file_memorymodel.File} *source*. """
+	def __init__(self, source, title, depth):
+		self.source = source
+		super(ViewFile, self).__init__(title, source.relPath, source.absPath,
+				depth)
+
+	@property
+	def extraInfo(self):
+		return self.source.extraInfo
+
+	@extraInfo.setter
+	def extraInfo(self, value):
+		# Set by FileTreeItem. The extraInfo of the source is used instead.
+		pass
+
+
+class ViewDir(object):
+	""" The files below a directory, as shown in a view. """
+	def __init__(self, path, filter=None, flatten=False, pathsep="/",
+			ignoreExtension=False):
+		"""
+		@param path: Path of the directory relative to the project root,
+			with / as separator. May contain ${dir}, replaced by the
+			directory the template is applied to.
+		@param filter: Only show the files accepted by this
+			L{filter.Filter}.
+		@param flatten: Show every file directly below the group, titled
+			with its path below the directory, joined with *pathsep*.
+			Otherwise, sub-directories are shown as groups.
+		@param ignoreExtension: Leave out the extension of the titles.
+		"""
+		self.path = path
+		self.filter = filter
+		self.flatten = flatten
+		self.pathsep = pathsep
+		self.ignoreExtension = ignoreExtension
+
+
+class ViewTemplate(object):
+	""" Groups of L{ViewDir}s, applied to directories by L{ViewDef}s. """
+	def __init__(self, name):
+		self.name = name
+		# (title, dirs) of each group. The title may contain ${dir}.
+		self.groups = []
+
+	def addGroup(self, title, dirs):
+		self.groups.append((title, dirs))
+
+
+class ViewDef(object):
+	""" A named view, made of templates applied to directories. """
+	def __init__(self, name):
+		self.name = name
+		# (templateName, dir) of each <viewTemplateLink>.
+		self.links = []
+
+	def addLink(self, templateName, dir):
+		self.links.append((templateName, dir))
+
+
+class _Section(object):
+	""" A L{ViewDir} applied to a directory, and the group it fills. """
+	def __init__(self, viewDir, prefix, group):
+		self.viewDir = viewDir
+		# Virtual path of the directory, ending with /.
+		self.prefix = prefix
+		self.group = group
+		# The ViewFile of each source file shown in the section.
+		self.files = {}
+
+	def title(self, rest):
+		parts = rest.split(VIRTPATH_SEP)
+		if self.viewDir.ignoreExtension:
+			parts[-1] = splitext(parts[-1])[0]
+		return parts
+
+
+class View(object):
+	""" A view built from a L{ViewDef}. See the module docs. """
+	def __init__(self, viewDef, templates, files):
+		"""
+		@param templates: dict mapping names to L{ViewTemplate}s.
+		@param files: The L{file_memorymodel.File}s of the project.
+		"""
+		self.name = viewDef.name
+		self.root = Group(viewDef.name, 0)
+		self._sections = []
+		groups = []
+		for templateName, d in viewDef.links:
+			template = templates[templateName]
+			for title, dirs in template.groups:
+				title = Template(title).safe_substitute(dir=d).strip("/")
+				group = Group(title, 1)
+				group.parent = self.root
+				groups.append(group)
+				for viewDir in dirs:
+					path = Template(viewDir.path).safe_substitute(dir=d)
+					prefix = normVirtualPath("/" + path) + VIRTPATH_SEP
+					self._sections.append(_Section(viewDir, prefix, group))
+		files = list(files)
+		files.sort(key=lambda f: f.relPath)
+		self._add(files)
+		# Put the groups in the order of the templates.
+		for group in groups:
+			if group in self.root.childLst:
+				self.root.remove(group)
+		for group in groups:
+			self.root.add(group)
+			group.parent = self.root
+		self.index = FileIndex(self.root)
+
+	def _virtualPath(self, item):
+		return VIRTPATH_SEP + item.relPath.replace(sep, VIRTPATH_SEP)
+
+	def _add(self, files):
+		""" Add *files* to the sections showing them.
+		@return: The groups that were changed. """
+		changed = []
+		for f in files:
+			path = self._virtualPath(f)
+			for section in self._sections:
+				if not path.startswith(section.prefix) or f in section.files:
+					continue
+				viewDir = section.viewDir
+				if viewDir.filter is not None and not viewDir.filter.letThrough(f):
+					continue
+				parts = section.title(path[len(section.prefix):])
+				if viewDir.flatten:
+					parent = section.group
+					title = viewDir.pathsep.join(parts)
+				else:
+					parent = self._makeGroups(section.group, parts[:-1])
+					title = parts[-1]
+				item = ViewFile(f, title, parent.depth + 1)
+				added = self._attach(parent, item)
+				section.files[f] = item
+				if not added in changed:
+					changed.append(added)
+		return changed
+
+	def _makeGroups(self, group, titles):
+		""" Get the group at the path *titles* below *group*, creating the
+		groups missing. Empty groups are never added to a tree, so new groups
+		are only linked to their parent until they are attached by
+		L{_attach}. """
+		for title in titles:
+			child = group.childDct.get(title)
+			if not isinstance(child, Group):
+				child = Group(title, group.depth + 1)
+				child.parent = group
+			group = child
+		return group
+
+	def _attach(self, parent, item):
+		""" Add *item* to *parent*, and attach the groups above it which are
+		not in the tree yet.
+		@return: The topmost group that changed. """
+		while True:
+			parent.add(item)
+			if parent is self.root \
+					or parent.parent.childDct.get(parent.title) is parent:
+				return parent
+			item = parent
+			parent = parent.parent
+
+	def _remove(self, files):
+		""" Remove the L{ViewFile}s of *files*, and the groups left empty.
+		@return: The groups that were changed. """
+		changed = []
+		for f in files:
+			for section in self._sections:
+				item = section.files.pop(f, None)
+				if item is None:
+					continue
+				group = item.parent
+				group.remove(item)
+				while group.isEmpty() and group is not self.root:
+					parent = group.parent
+					parent.remove(group)
+					# Keep the link, so the group can be attached again.
+					group.parent = parent
+					group = parent
+				if not group in changed:
+					changed.append(group)
+		return changed
+
+	def update(self, removed, added):
+		""" Apply the changes of a patch of the project index, and patch the
+		index of the view. """
+		changed = self._remove([i for i in removed if isinstance(i, File)])
+		changed.extend(self._add([i for i in added if isinstance(i, File)]))
+		for group in changed:
+			if not self._hasAncestorIn(group, changed):
+				self.index.patch(group)
+
+	def _hasAncestorIn(self, item, groups):
+		parent = item.parent
+		while parent is not None:
+			if parent in groups:
+				return True
+			parent = parent.parent
+		return False
+
+	def getItems(self, sources):
+		""" Get the L{ViewFile}s showing the files in *sources*. """
+		items = []
+		for f in sources:
+			for section in self._sections:
+				item = section.files.get(f)
+				if item is not None:
+					items.append(item)
+		return items
+
+
+class ViewEngine(object):
+	""" Builds the views of a project when they are first used, and keeps
+	them up to date with the index of the project. """
+	def __init__(self, fileindex, templates, viewDefs):
+		"""
+		@param templates: dict mapping names to L{ViewTemplate}s.
+		@param viewDefs: dict mapping names to L{ViewDef}s.
+		"""
+		self._fileindex = fileindex
+		self._templates = templates
+		self._viewDefs = viewDefs
+		self._views = {}
+		fileindex.addListener(self._onIndexPatched)
+
+	def getNames(self):
+		return sorted(self._viewDefs.keys())
+
+	def getView(self, name):
+		""" Get the view *name*, building it the first time.
+		@raise KeyError: If there is no view named *name*. """
+		view = self._views.get(name)
+		if view is None:
+			view = View(self._viewDefs[name], self._templates,
+					[i for i in self._fileindex if isinstance(i, File)])
+			self._views[name] = view
+		return view
+
+	def _onIndexPatched(self, group, removed, added):
+		for view in self._views.itervalues():
+			view.update(removed, added)
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from os.path import join
+	from filter import Filter
+
+	def makeFile(relPath):
+		return File(relPath.rsplit("/", 1)[-1], relPath.replace("/", sep),
+				join("/root", relPath), 1)
+
+	class TestViewEngine(unittest.TestCase):
+		def setUp(self):
+			self.root = Group("root", 0, *[makeFile(p) for p in (
+				"ui/src/main/java/com/foo/Bar.java",
+				"ui/src/main/java/com/foo/Baz.java",
+				"ui/src/main/java/com/foo/notes.txt",
+				"ui/src/main/python/app/main.py",
+				"core/src/main/java/Core.java")])
+			self.index = FileIndex(self.root)
+			maven = ViewTemplate("maven")
+			maven.addGroup("${dir}/java/", [ViewDir("${dir}/src/main/java",
+					Filter(["+*.java"]), flatten=True, pathsep=".",
+					ignoreExtension=True)])
+			maven.addGroup("${dir}/python/", [ViewDir("${dir}/src/main/python")])
+			view = ViewDef("maven")
+			view.addLink("maven", "/ui")
+			view.addLink("maven", "/core")
+			self.engine = ViewEngine(self.index, {"maven": maven},
+					{"maven": view})
+
+		def _lines(self, view):
+			return ["  " * i.depth + i.title for i in view.index]
+
+		def testBuild(self):
+			view = self.engine.getView("maven")
+			self.assertEquals(self._lines(view), [
+				"maven",
+				"  ui/java",
+				"    com.foo.Bar",
+				"    com.foo.Baz",
+				"  ui/python",
+				"    app",
+				"      main.py",
+				"  core/java",
+				"    Core"])
+			bar = self.root.getByTitle("Bar.java")
+			bar.extraInfo["x"] = "[x]"
+			self.assertEquals(view.getItems([bar])[0].extraInfo, {"x": "[x]"})
+			self.assertTrue(self.engine.getView("maven") is view)
+			self.assertRaises(KeyError, self.engine.getView, "missing")
+
+		def testCompactSource(self):
+			from compact import CompactTree
+			source = CompactTree("/root").setRoot(self.root).getByIndex(0)
+			item = ViewFile(source, "Bar", 2)
+			self.assertEquals(item.extraInfo, {})
+			item.extraInfo["x"] = "[x]"
+			self.assertEquals(source.extraInfo, {"x": "[x]"})
+
+		def testUpdate(self):
+			view = self.engine.getView("maven")
+			self.root.remove(self.root.getByTitle("main.py"))
+			self.root.remove(self.root.getByTitle("Core.java"))
+			self.root.add(makeFile("ui/src/main/java/com/foo/New.java"))
+			self.root.add(makeFile("ui/src/main/python/lib/util.py"))
+			self.index.patch(self.root)
+			self.assertEquals(self._lines(view), [
+				"maven",
+				"  ui/java",
+				"    com.foo.Bar",
+				"    com.foo.Baz",
+				"    com.foo.New",
+				"  ui/python",
+				"    lib",
+				"      util.py"])
+			self.root.add(makeFile("core/src/main/java/Core.java"))
+			self.index.patch(self.root)
+			self.assertEquals(self._lines(view)[-2:], ["  core/java", "    Core"])
+
+	unittest.main()
@@ -0,0 +1,106 @@
+"""
+The calls from vcode into vim.
+
+Every vim.command and vim.eval crosses from python into vim, so the user
+interface batches its commands: a L{CommandBatch} collects the commands of
+one operation, like the options, syntax rules and key maps of a new buffer,
+and runs them with a single vim.command, as a list of strings run one by one
+with :execute. Joining them with newlines would not do, since commands like
+:map and :syntax take the rest of the line, newlines included.
+
+Finding the window showing a buffer used to take an eval per tab page.
+L{Windows} finds it, or moves to it, with a single call to VCodeFindBuffer
+or VCodeGoToBuffer (defined in vcode.vim). Window numbers are not kept
+between calls, since vim renumbers windows without any event, like when
+they are rotated with CTRL-W r. Only the window a move started from is used
+afterwards, to go back within the same operation.
+
+Outside vim, install L{fakevim} first.
+"""
+import vim
+
+
+def _string(text):
+	return "'%s'" % text.replace("'", "''")
+
+def _command(commands):
+	""" Run the list of *commands* in a single call into vim. """
+	if len(commands) == 1:
+		vim.command(commands[0])
+	else:
+		vim.command("for vcode_cmd in [%s] | exe vcode_cmd | endfor"
+				% ", ".join([_string(c) for c in commands]))
+
+
+class CommandBatch(object):
+	""" Ex commands run by vim in a single call. """
+	def __init__(self, *commands):
+		self._commands = list(commands)
+
+	def add(self, *commands):
+		self._commands.extend(commands)
+
+	def execute(self):
+		""" Run the commands added since the last call. """
+		if not self._commands:
+			return
+		commands = self._commands
+		self._commands = []
+		_command(commands)
+
+
+def execute(*commands):
+	""" Run *commands* in a single call. See L{CommandBatch}. """
+	CommandBatch(*commands).execute()
+
+
+class Windows(object):
+	""" Finds and moves between windows with a single call into vim each.
+	See the module docs. """
+	def find(self, name):
+		""" Find a window showing the buffer *name*, in the current tab page
+		if there is one.
+		@return: (tabNr, winNr), or None if the buffer is not shown. """
+		found = vim.eval("VCodeFindBuffer(%s)" % _string(name))
+		if not found:
+			return None
+		return int(found[0]), int(found[1])
+
+	def current(self):
+		""" Get the current tab page and window.
+		@return: (tabNr, winNr) """
+		return int(vim.eval("tabpagenr()")), int(vim.eval("winnr()"))
+
+	def windowNr(self, name):
+		""" Get the number of the window showing the buffer *name* in the
+		current tab page, like bufwinnr().
+		@return: The window number, or -1. """
+		found = vim.eval("VCodeFindBuffer(%s)" % _string(name))
+		if not found or found[0] != found[2]:
+			return -1
+		return int(found[1])
+
+	def goTo(self, winNr, tabNr=None):
+		""" Make window *winNr* of tab page *tabNr*, by default the current
+		tab page, the current window. """
+		commands = []
+		if tabNr is not None:
+			commands.append("tabnext %d" % tabNr)
+		commands.append("%d wincmd w" % winNr)
+		_command(commands)
+
+	def goToBuffer(self, name, allTabs=True):
+		""" Move to a window showing the buffer *name*, in the current tab
+		page if there is one, otherwise in any tab page if *allTabs*.
+		@return: ((tabNr, winNr) before the move, (tabNr, winNr) after it),
+			or None if the buffer is not shown in any such window. """
+		found = vim.eval("VCodeGoToBuffer(%s, %d)" % (_string(name),
+				allTabs and 1 or 0))
+		if not found:
+			return None
+		found = [int(x) for x in found]
+		return (found[0], found[1]), (found[2], found[3])
+
+
+# The windows of vim.
+windows = Windows()
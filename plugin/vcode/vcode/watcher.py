@@ -0,0 +1,596 @@
+"""
+Keep the file tree up to date when files are added to or removed from the
+scanned directories.
+
+Changes are picked up with inotify on Linux, and by polling the mtime of the
+directories elsewhere. Changes are collected until no new changes has arrived
+for a short while, so a burst of changes (like a git checkout) is applied to
+the tree and the L{file_memorymodel.FileIndex} as a single batch.
+
+vim is not thread-safe, so nothing is applied to the tree until
+L{TreeWatcher.poll} is called from the main thread.
+"""
+import sys
+import struct
+import ctypes
+import ctypes.util
+from errno import EAGAIN, ENOSPC
+from os import read, close, stat, strerror
+from os.path import join, dirname
+from threading import Thread, Lock, Event
+from time import time
+
+from file_memorymodel import Group, LazyGroup, File
+from scanner import DirScanner, getDirBindings, addEmptyDirs, getEmptyDirs
+
+
+class InotifySource(object):
+	""" Reports changed directories using the Linux inotify API. """
+	IN_MOVED_FROM = 0x00000040
+	IN_MOVED_TO = 0x00000080
+	IN_CREATE = 0x00000100
+	IN_DELETE = 0x00000200
+	IN_Q_OVERFLOW = 0x00004000
+	IN_IGNORED = 0x00008000
+	IN_ONLYDIR = 0x01000000
+	IN_CLOEXEC = 0x00080000
+	IN_NONBLOCK = 0x00000800
+
+	WATCH_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+	EVENT_HEADER = struct.Struct("iIII")
+
+	def __init__(self):
+		self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self._libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+				ctypes.c_uint32)
+		self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+		if self._fd < 0:
+			self._raiseErrno()
+		self._pathByWd = {}
+		self._wdByPath = {}
+
+	def _raiseErrno(self):
+		errno = ctypes.get_errno()
+		raise OSError(errno, strerror(errno))
+
+	def start(self):
+		pass
+
+	def watch(self, relPath, absPath):
+		if isinstance(absPath, unicode):
+			# The paths of the config are unicode. ctypes would pass them as
+			# wchar_t*.
+			absPath = absPath.encode(sys.getfilesystemencoding())
+		wd = self._libc.inotify_add_watch(self._fd, absPath, self.WATCH_MASK)
+		if wd < 0:
+			self._raiseErrno()
+		self._pathByWd[wd] = relPath
+		self._wdByPath[relPath] = wd
+
+	def unwatch(self, relPath):
+		wd = self._wdByPath.pop(relPath, None)
+		if wd is not None:
+			self._libc.inotify_rm_watch(self._fd, wd)
+
+	def readChanges(self):
+		""" Get the relative path of directories changed since the last call. """
+		changed = set()
+		while True:
+			try:
+				data = read(self._fd, 65536)
+			except OSError, e:
+				if e.errno == EAGAIN:
+					break
+				raise
+			offset = 0
+			while offset < len(data):
+				wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data,
+						offset)
+				offset += self.EVENT_HEADER.size + length
+				if mask & self.IN_Q_OVERFLOW:
+					changed.update(self._wdByPath.keys())
+				path = self._pathByWd.get(wd)
+				if path is None:
+					continue
+				if mask & self.IN_IGNORED:
+					del self._pathByWd[wd]
+					if self._wdByPath.get(path) == wd:
+						del self._wdByPath[path]
+				else:
+					changed.add(path)
+		return changed
+
+	def close(self):
+		close(self._fd)
+
+
+class PollingSource(object):
+	""" Reports changed directories by checking the mtime of every watched
+	directory from a background thread. """
+	def __init__(self, interval=2.0):
+		"""
+		@param interval: Seconds between each check.
+		"""
+		self._interval = interval
+		self._dirs = {}
+		self._changed = set()
+		self._lock = Lock()
+		self._stopped = Event()
+		self._thread = None
+
+	def _mtime(self, absPath):
+		try:
+			return stat(absPath).st_mtime
+		except OSError:
+			return None
+
+	def start(self):
+		self._thread = Thread(target=self._run, name="vcode-poll")
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def watch(self, relPath, absPath):
+		mtime = self._mtime(absPath)
+		with self._lock:
+			self._dirs[relPath] = (absPath, mtime)
+
+	def unwatch(self, relPath):
+		with self._lock:
+			self._dirs.pop(relPath, None)
+
+	def _run(self):
+		while not self._stopped.wait(self._interval):
+			self.check()
+
+	def check(self):
+		""" Check the mtime of every watched directory. """
+		with self._lock:
+			dirs = self._dirs.items()
+		for relPath, (absPath, mtime) in dirs:
+			newMtime = self._mtime(absPath)
+			if newMtime != mtime:
+				with self._lock:
+					if relPath in self._dirs:
+						self._dirs[relPath] = (absPath, newMtime)
+						self._changed.add(relPath)
+
+	def readChanges(self):
+		""" Get the relative path of directories changed since the last call. """
+		with self._lock:
+			changed = self._changed
+			self._changed = set()
+		return changed
+
+	def close(self):
+		self._stopped.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+
+def createSource():
+	""" Create the best change source available on this platform. """
+	if sys.platform.startswith("linux"):
+		try:
+			return InotifySource()
+		except (OSError, AttributeError):
+			pass
+	return PollingSource()
+
+
+class TreeWatcher(object):
+	""" Watches the directories scanned into a L{file_memorymodel.FileIndex},
+	and patches the tree and the index when they change. """
+	def __init__(self, fileindex, rootDir, onBatch=None, debounce=0.3,
+			maxDelay=2.0, source=None, root=None):
+		"""
+		@param rootDir: The directory the <dir>-tags of the watched tree are
+			relative to.
+		@param onBatch: Called as onBatch(groups) after a batch of changes
+			has been applied. *groups* are the groups that were patched.
+		@param debounce: Changes are applied when no new changes has arrived
+			for this many seconds...
+		@param maxDelay: ...or when the oldest unapplied change is this
+			many seconds old.
+		@param source: The source of changes. Defaults to L{createSource}.
+		@param root: Only watch the tree below this group, like the group of
+			one project in a workspace. Defaults to the root of *fileindex*.
+		"""
+		self._fileindex = fileindex
+		self._root = root or fileindex.root
+		self._rootDir = rootDir
+		self._onBatch = onBatch
+		self._debounce = debounce
+		self._maxDelay = maxDelay
+		self._source = source or createSource()
+		self._scanner = DirScanner(rootDir)
+		self._bindings = {}
+		# Empty directories left out of the tree, see scanner.addEmptyDirs:
+		# a list of (group, dirPath) for each relPath. A change to one of them
+		# is applied by listing dirPath again.
+		self._emptyDirs = {}
+		self._pending = set()
+		self._firstChange = self._lastChange = None
+
+	def _absPath(self, relPath):
+		return relPath and join(self._rootDir, relPath) or self._rootDir
+
+	def _watch(self, relPath):
+		try:
+			self._source.watch(relPath, self._absPath(relPath))
+		except OSError, e:
+			if e.errno != ENOSPC or isinstance(self._source, PollingSource):
+				raise
+			# Out of inotify watches. Fall back to polling.
+			self._source.close()
+			self._source = PollingSource()
+			for path in set(self._bindings) | set(self._emptyDirs):
+				self._source.watch(path, self._absPath(path))
+			self._source.start()
+
+	def _isScanned(self, group):
+		return not isinstance(group, LazyGroup) or group.loaded
+
+	def _bind(self, items):
+		""" Watch the directories scanned into the groups in *items*. """
+		for group in items:
+			if not isinstance(group, Group) or not self._isScanned(group):
+				continue
+			for relPath, excludePatt in getDirBindings(group):
+				bindings = self._bindings.setdefault(relPath, [])
+				if (group, excludePatt) in bindings:
+					continue
+				bindings.append((group, excludePatt))
+				if len(bindings) == 1 and not relPath in self._emptyDirs:
+					self._watch(relPath)
+			self._bindEmptyDirs(group)
+
+	def _bindEmptyDirs(self, group):
+		""" Watch the empty directories left out of *group*. """
+		for relPath, dirPath in getEmptyDirs(group).iteritems():
+			entries = self._emptyDirs.setdefault(relPath, [])
+			if (group, dirPath) in entries:
+				continue
+			entries.append((group, dirPath))
+			if len(entries) == 1 and not relPath in self._bindings:
+				self._watch(relPath)
+
+	def _release(self, relPath):
+		""" Stop watching *relPath* unless it is still needed. """
+		if not relPath in self._bindings and not relPath in self._emptyDirs:
+			self._source.unwatch(relPath)
+
+	def _unbind(self, items):
+		for group in items:
+			if not isinstance(group, Group):
+				continue
+			for relPath, excludePatt in getDirBindings(group):
+				bindings = [b for b in self._bindings.get(relPath, [])
+						if b[0] is not group]
+				if bindings:
+					self._bindings[relPath] = bindings
+				elif relPath in self._bindings:
+					del self._bindings[relPath]
+					self._release(relPath)
+			for relPath in getEmptyDirs(group):
+				self._unbindEmptyDir(relPath, group)
+
+	def _unbindEmptyDir(self, relPath, group):
+		entries = [e for e in self._emptyDirs.get(relPath, [])
+				if e[0] is not group]
+		if entries:
+			self._emptyDirs[relPath] = entries
+		elif relPath in self._emptyDirs:
+			del self._emptyDirs[relPath]
+			self._release(relPath)
+
+	def _onIndexPatched(self, group, removed, added):
+		self._unbind(removed)
+		# *group* is not in *added* when a lazy group is loaded.
+		if self._isInTree(group):
+			self._bind([group] + added)
+		else:
+			self._bind([item for item in added if self._isInTree(item)])
+
+	def start(self):
+		self._bind(self._root.iterRecursive())
+		self._fileindex.addListener(self._onIndexPatched)
+		self._source.start()
+
+	def stop(self):
+		self._source.close()
+		self._scanner.close()
+
+	def _isFromDir(self, item, relPath, excludePatt):
+		""" Check if *item* was added to its group from the directory
+		*relPath*. """
+		p = join(relPath, item.title)
+		if isinstance(item, File):
+			return item.relPath == p
+		return (p, excludePatt) in getDirBindings(item)
+
+	def _patchGroup(self, group, relPath, excludePatt, entries):
+		""" Make the items added to *group* from directory *relPath* match
+		*entries*.
+		@return: True if *group* was changed.
+		"""
+		emptyDirs = getEmptyDirs(group)
+		for p, dirPath in emptyDirs.items():
+			if dirPath == relPath:
+				del emptyDirs[p]
+		current = {}
+		for item in group.iterChildren():
+			if self._isFromDir(item, relPath, excludePatt):
+				current[item.title] = item
+		wanted = {}
+		for name, isDir in entries:
+			p = join(relPath, name)
+			if excludePatt is None or not excludePatt.match(p):
+				wanted[name] = isDir
+
+		changed = False
+		for title, item in current.items():
+			if wanted.get(title) != isinstance(item, Group):
+				group.remove(item)
+				changed = True
+		depth = group.depth + 1
+		for name, isDir in entries:
+			if not name in wanted or name in current \
+					and current[name].parent is group:
+				continue
+			p = join(relPath, name)
+			if isDir:
+				g = self._scanner.scanInto(Group(name, depth), p, excludePatt)
+				if g.isEmpty():
+					addEmptyDirs(group, g, p, relPath)
+					continue
+				group.add(g)
+			else:
+				group.add(File(name, p, join(self._rootDir, p), depth))
+			changed = True
+		return changed
+
+	def _removeIfEmpty(self, group):
+		""" Remove *group* if empty, since empty groups are never added to the
+		tree.
+		@return: The group that should be patched in the index.
+		"""
+		while group.isEmpty() and group.parent is not None \
+				and group is not self._root:
+			parent = group.parent
+			parent.remove(group)
+			# Keep watching the directories of the group, so it is added
+			# again when files are added to them.
+			parentDirs = [d for d, patt in getDirBindings(parent)]
+			for relPath, excludePatt in getDirBindings(group):
+				if dirname(relPath) in parentDirs:
+					addEmptyDirs(parent, group, relPath, dirname(relPath))
+			self._bindEmptyDirs(parent)
+			group = parent
+		return group
+
+	def _hasAncestorIn(self, item, groups):
+		parent = item.parent
+		while parent is not None:
+			if parent in groups:
+				return True
+			parent = parent.parent
+		return False
+
+	def _isInTree(self, item):
+		while item is not self._root:
+			if item.parent is None:
+				return False
+			item = item.parent
+		return True
+
+	def applyChanges(self, changedDirs):
+		""" Re-list the directories in *changedDirs*, and patch the tree and
+		the index.
+		@return: The groups that were patched.
+		"""
+		dirs = set()
+		for relPath in changedDirs:
+			if relPath in self._bindings:
+				dirs.add(relPath)
+			for group, dirPath in list(self._emptyDirs.get(relPath, [])):
+				if getEmptyDirs(group).get(relPath) == dirPath \
+						and self._isInTree(group):
+					dirs.add(dirPath)
+				else:
+					# Not empty anymore, or removed from the tree.
+					self._unbindEmptyDir(relPath, group)
+		changedGroups = []
+		for relPath in dirs:
+			if not relPath in self._bindings:
+				continue
+			try:
+				entries = self._scanner.listDir(relPath)
+			except OSError:
+				# Removed. Handled when the parent directory is patched.
+				continue
+			for group, excludePatt in list(self._bindings.get(relPath, [])):
+				if not self._isInTree(group):
+					continue
+				if self._patchGroup(group, relPath, excludePatt, entries):
+					changedGroups.append(group)
+				self._bindEmptyDirs(group)
+
+		patched = []
+		for group in changedGroups:
+			group = self._removeIfEmpty(group)
+			if not group in patched:
+				patched.append(group)
+		topmost = [group for group in patched
+				if self._isInTree(group) and not self._hasAncestorIn(group, patched)]
+		for group in topmost:
+			self._fileindex.patch(group)
+		return topmost
+
+	def poll(self):
+		""" Collect changes, and apply them if the debounce interval has
+		passed. Must be called regularly from the main thread.
+		@return: True if a batch of changes was applied.
+		"""
+		now = time()
+		changes = self._source.readChanges()
+		if changes:
+			self._pending.update(changes)
+			self._lastChange = now
+			if self._firstChange is None:
+				self._firstChange = now
+		if not self._pending:
+			return False
+		if now - self._lastChange < self._debounce \
+				and now - self._firstChange < self._maxDelay:
+			return False
+		pending = self._pending
+		self._pending = set()
+		self._firstChange = self._lastChange = None
+		groups = self.applyChanges(pending)
+		if groups and self._onBatch:
+			self._onBatch(groups)
+		return bool(groups)
+
+
+
+if __name__ == "__main__":
+	import unittest
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import makedirs, remove
+	from file_memorymodel import FileIndex
+
+	class TestTreeWatcher(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			makedirs(join(self.rootDir, "src", "sub"))
+			makedirs(join(self.rootDir, "src", "empty"))
+			for f in ("src/a.c", "src/sub/b.c"):
+				self._create(f)
+			scanner = DirScanner(self.rootDir)
+			self.root = Group("root", 0)
+			self.src = scanner.scanInto(Group("src", 1), "src")
+			self.root.add(self.src)
+			self.index = FileIndex(self.root)
+			self.batches = []
+			self.w = TreeWatcher(self.index, self.rootDir,
+					onBatch=self.batches.append, debounce=0,
+					source=PollingSource())
+			self.w.start()
+
+		def tearDown(self):
+			self.w.stop()
+			rmtree(self.rootDir)
+
+		def _create(self, relPath):
+			open(join(self.rootDir, relPath), "w").close()
+
+		def _titles(self):
+			return [i.title for i in self.index]
+
+		def testAddAndRemoveFiles(self):
+			self._create("src/c.c")
+			remove(join(self.rootDir, "src", "a.c"))
+			self.w.applyChanges(set(["src"]))
+			self.assertEquals(sorted(self.src.childDct.keys()), ["c.c", "sub"])
+			self.assertEquals(sorted(self._titles()),
+					["b.c", "c.c", "root", "src", "sub"])
+			c = self.src.getByTitle("c.c")
+			self.assertEquals(c.depth, 2)
+			self.assertEquals(c.relPath, join("src", "c.c"))
+
+		def testAddDir(self):
+			makedirs(join(self.rootDir, "src", "new"))
+			self._create("src/new/d.c")
+			self.w.applyChanges(set(["src"]))
+			self.assertTrue("d.c" in self._titles())
+			self._create("src/new/e.c")
+			self.w.applyChanges(set([join("src", "new")]))
+			self.assertTrue("e.c" in self._titles())
+
+		def testRemoveLastFileRemovesGroup(self):
+			remove(join(self.rootDir, "src", "sub", "b.c"))
+			self.w.applyChanges(set([join("src", "sub")]))
+			self.assertEquals(self._titles(), ["root", "src", "a.c"])
+
+		def testWatchLoadedLazyGroup(self):
+			lazy = DirScanner(self.rootDir).makeLazyGroup("lazy", 1, "src")
+			self.root.add(lazy)
+			self.index.patch(self.root)
+			self.assertEquals(len(self.w._bindings["src"]), 1)
+			lazy.load()
+			self.assertEquals(len(self.w._bindings["src"]), 2)
+			self._create("src/c.c")
+			self.w.applyChanges(set(["src"]))
+			self.assertEquals(lazy.getByTitle("c.c").depth, 2)
+			self.assertEquals([i.title for i in self.index].count("c.c"), 2)
+
+		def testAddToEmptyDir(self):
+			empty = join("src", "empty")
+			self.assertFalse("empty" in self._titles())
+			self.assertTrue(empty in self.w._source._dirs)
+			self._create("src/empty/e.c")
+			self.w.applyChanges(set([empty]))
+			self.assertTrue("e.c" in self._titles())
+			self.assertEquals(self.src.getByTitle("empty").depth, 2)
+			makedirs(join(self.rootDir, empty, "deeper"))
+			self.w.applyChanges(set([empty]))
+			self._create("src/empty/deeper/d.c")
+			self.w.applyChanges(set([join(empty, "deeper")]))
+			self.assertTrue("d.c" in self._titles())
+
+		def testAddToEmptiedDir(self):
+			remove(join(self.rootDir, "src", "sub", "b.c"))
+			self.w.applyChanges(set([join("src", "sub")]))
+			self._create("src/sub/c.c")
+			self.w.applyChanges(set([join("src", "sub")]))
+			self.assertEquals(self._titles(), ["root", "src", "a.c", "sub", "c.c"])
+
+		def testPollBatches(self):
+			self._create("src/c.c")
+			self._create("src/sub/d.c")
+			self.w._source.check()
+			self.assertTrue(self.w.poll())
+			self.assertEquals(self.batches, [[self.src]])
+			self.assertFalse(self.w.poll())
+
+		def testRoot(self):
+			other = DirScanner(self.rootDir).scanInto(Group("other", 1), "src")
+			self.root.add(other)
+			self.index.patch(self.root)
+			self.w.stop()
+			self.w = TreeWatcher(self.index, self.rootDir, source=PollingSource(),
+					root=self.src)
+			self.w.start()
+			self.assertEquals([g for g, patt in self.w._bindings["src"]],
+					[self.src])
+			self._create("src/c.c")
+			self.w.applyChanges(set(["src"]))
+			self.assertTrue("c.c" in self.src.childDct)
+			self.assertFalse("c.c" in other.childDct)
+
+	class TestInotifySource(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			try:
+				self.source = InotifySource()
+			except (OSError, AttributeError):
+				self.source = None
+
+		def tearDown(self):
+			if self.source is not None:
+				self.source.close()
+			rmtree(self.rootDir)
+
+		def testUnicodePaths(self):
+			if self.source is None:
+				return
+			for d in (u"a", u"b"):
+				makedirs(join(self.rootDir, d))
+				self.source.watch(d, unicode(join(self.rootDir, d)))
+			self.assertEquals(len(set(self.source._wdByPath.values())), 2)
+			open(join(self.rootDir, "b", "c.c"), "w").close()
+			self.assertEquals(self.source.readChanges(), set([u"b"]))
+
+	unittest.main()
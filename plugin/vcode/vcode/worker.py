@@ -0,0 +1,212 @@
+"""
+Background indexing.
+
+Parsing a large project, and scanning its directories, can take long enough
+to freeze vim. An L{IndexWorker} parses the project in a thread, and a
+L{ProcessIndexWorker} in a separate python process, while vim keeps running.
+The top-level groups are sent back as soon as each of them has been parsed.
+
+The worker and vim never share any part of the tree. Each group is encoded
+with L{snapshot.encodeTree} in the worker, and decoded into a new tree by
+L{IndexWorker.poll}, which is called from vim's main thread. A subprocess
+writes the messages to its stdout as marshal data, each prefixed with its
+length.
+
+Messages are (kind, payload) tuples:
+	- ("group", group): A top-level group has been parsed.
+	- ("done", None): The whole project has been parsed.
+	- ("error", message): Parsing failed.
+"""
+import sys
+from os.path import abspath, splitext
+from threading import Thread
+from Queue import Queue, Empty
+from subprocess import Popen, PIPE
+
+from settings_parser import SettingsParser
+from scanner import DirScanner
+from snapshot import encodeTree, decodeTree
+from procpool import writeFrame, readFrames
+
+
+# Run by ProcessIndexWorker.
+WORKER_SCRIPT = splitext(abspath(__file__))[0] + ".py"
+
+
+def parseProject(send, projectDir, projectName, rootDir, lazy=False):
+	""" Parse the project, calling send(message) for each message. """
+	try:
+		SettingsParser(projectDir, projectName, rootDir, lazy=lazy,
+				onGroup=lambda group: send(("group", encodeTree(group))))
+	except Exception, e:
+		send(("error", "%s: %s" % (e.__class__.__name__, e)))
+	else:
+		send(("done", None))
+
+
+class IndexWorker(object):
+	""" Parses a project in a background thread. """
+	def __init__(self, projectDir, projectName, rootDir, lazy=False):
+		"""
+		@param lazy: See L{settings_parser.FilesParser.__init__}.
+		"""
+		self._args = (projectDir, projectName, rootDir, lazy)
+		self._rootDir = rootDir
+		self._scanner = DirScanner(rootDir, prefetch=lazy)
+		self._queue = Queue()
+		self._thread = None
+
+	def start(self):
+		self._thread = Thread(target=parseProject,
+				args=(self._queue.put,) + self._args, name="vcode-index")
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def stop(self):
+		""" Stop waiting for the worker. A thread can not be interrupted, so
+		it finishes parsing, but nothing more is received from it. """
+		self._queue = Queue()
+
+	def poll(self):
+		""" Get the messages received since the last call, without blocking.
+		Groups are decoded into new L{file_memorymodel.Group}s with depth 1.
+		@return: A list of messages.
+		"""
+		messages = []
+		while True:
+			try:
+				kind, payload = self._queue.get_nowait()
+			except Empty:
+				return messages
+			if kind == "group":
+				payload = decodeTree(payload, self._rootDir, 1, self._scanner)
+			messages.append((kind, payload))
+
+
+class ProcessIndexWorker(IndexWorker):
+	""" Parses a project in a python subprocess. Useful when the python
+	running in vim should not spend any time parsing. """
+	def __init__(self, projectDir, projectName, rootDir, lazy=False,
+			python="python"):
+		"""
+		@param python: The python interpreter used to run the worker.
+			Note that sys.executable is vim itself when running inside vim.
+		"""
+		super(ProcessIndexWorker, self).__init__(projectDir, projectName,
+				rootDir, lazy)
+		self._python = python
+		self._process = None
+
+	def start(self):
+		projectDir, projectName, rootDir, lazy = self._args
+		self._process = Popen([self._python, WORKER_SCRIPT, "--worker",
+				projectDir, projectName, rootDir, lazy and "lazy" or ""],
+				stdout=PIPE, close_fds=sys.platform != "win32")
+		self._thread = Thread(target=self._read, args=(self._process,
+				self._queue), name="vcode-index-reader")
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def _read(self, process, queue):
+		kind = None
+		for kind, payload in readFrames(process.stdout):
+			queue.put((kind, payload))
+		returncode = process.wait()
+		if not kind in ("done", "error"):
+			queue.put(("error", "Index worker exited with %d." % returncode))
+
+	def stop(self):
+		super(ProcessIndexWorker, self).stop()
+		if self._process is not None and self._process.poll() is None:
+			self._process.kill()
+
+
+def workerMain(args):
+	""" Entry point of the subprocess started by L{ProcessIndexWorker}. """
+	projectDir, projectName, rootDir, lazy = args
+	out = sys.stdout
+	# Anything printed while parsing must not end up in the frames.
+	sys.stdout = sys.stderr
+	parseProject(lambda message: writeFrame(out, message),
+			projectDir, projectName, rootDir, lazy == "lazy")
+
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["--worker"]:
+	workerMain(sys.argv[2:])
+
+elif __name__ == "__main__":
+	import unittest
+	import time
+	from shutil import rmtree
+	from tempfile import mkdtemp
+	from os import makedirs
+	from os.path import join
+	from StringIO import StringIO
+
+	class TestIndexWorker(unittest.TestCase):
+		def setUp(self):
+			self.rootDir = mkdtemp()
+			self.projectDir = join(self.rootDir, "test.vcode")
+			makedirs(self.projectDir)
+			makedirs(join(self.rootDir, "src", "sub"))
+			for f in ("src/a.c", "src/sub/b.c", "README"):
+				open(join(self.rootDir, f), "w").close()
+			open(join(self.projectDir, "project.files.xml"), "w").write(
+					'<files><group title="src"><dir path="src"/></group>'
+					'<group title="empty"/>'
+					'<group title="doc"><file path="README"/></group></files>')
+
+		def tearDown(self):
+			rmtree(self.rootDir)
+
+		def _run(self, worker):
+			worker.start()
+			messages = []
+			timeout = time.time() + 10
+			while not messages or messages[-1][0] == "group":
+				self.assertTrue(time.time() < timeout)
+				time.sleep(0.01)
+				messages.extend(worker.poll())
+			return messages
+
+		def _check(self, messages):
+			self.assertEquals([kind for kind, payload in messages],
+					["group", "group", "done"])
+			src, doc = [payload for kind, payload in messages[:2]]
+			self.assertEquals(src.depth, 1)
+			self.assertEquals(src.getByTitle("sub").getByTitle("b.c").relPath,
+					join("src", "sub", "b.c"))
+			self.assertEquals(doc.getByIndex(0).absPath,
+					join(self.rootDir, "README"))
+
+		def testThread(self):
+			self._check(self._run(IndexWorker(self.projectDir, "test",
+					self.rootDir)))
+			# Loaded from the snapshot the second time.
+			self._check(self._run(IndexWorker(self.projectDir, "test",
+					self.rootDir)))
+
+		def testProcess(self):
+			self._check(self._run(ProcessIndexWorker(self.projectDir, "test",
+					self.rootDir, python=sys.executable)))
+
+		def testError(self):
+			open(join(self.projectDir, "project.files.xml"), "w").write(
+					'<files><file path="README"/></files>')
+			messages = self._run(IndexWorker(self.projectDir, "test",
+					self.rootDir))
+			self.assertEquals(messages[0][0], "error")
+			self.assertTrue("must be directly below a <group>" in
+					messages[0][1])
+
+		def testFrames(self):
+			f = StringIO()
+			writeFrame(f, ("group", ("a", (), ())))
+			writeFrame(f, ("done", None))
+			f.write("\0\0")
+			f.seek(0)
+			self.assertEquals(list(readFrames(f)),
+					[("group", ("a", (), ())), ("done", None)])
+
+	unittest.main()